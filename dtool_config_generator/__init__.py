@@ -27,7 +27,6 @@ import os
 
 from flask import Flask, flash, redirect, request, url_for
 from flask_admin import Admin
-from flask_admin.contrib.sqla import ModelView
 from flask_cors import CORS
 from flask_ldap3_login import LDAP3LoginManager
 from flask_login import LoginManager
@@ -35,10 +34,12 @@ from flask_migrate import Migrate
 from flask_smorest import Api
 
 from dtool_config_generator.extensions import db, ma, mail
+from dtool_config_generator.metrics import instrument
 from dtool_config_generator.security import require_confirmation, confirm
 from dtool_config_generator.utils import (
     TemplateContextBuilder,
-    DtoolConfigGeneratorAdminIndexView)
+    DtoolConfigGeneratorAdminIndexView,
+    UserModelView)
 from dtool_config_generator.config import Config
 
 
@@ -113,7 +114,7 @@ def create_app(test_config=None, test_config_file=None):
 
     mail.init_app(app)
     db.init_app(app)
-    Migrate(app, db)
+    Migrate(app, db, directory=os.path.join(os.path.dirname(__file__), "migrations"))
     ma.init_app(app)
 
     # admin initialized here due to https://github.com/flask-admin/flask-admin/issues/910
@@ -122,7 +123,7 @@ def create_app(test_config=None, test_config_file=None):
                   template_mode='bootstrap3')
 
     from dtool_config_generator.models import User
-    admin.add_view(ModelView(User, db.session))
+    admin.add_view(UserModelView(User, db.session))
 
     api = Api(app)
 
@@ -130,6 +131,7 @@ def create_app(test_config=None, test_config_file=None):
 
     # Initialise the ldap manager using the settings read into the flask app.
     ldap_manager = LDAP3LoginManager(app)
+    ldap_manager.authenticate = instrument('ldap.authenticate')(ldap_manager.authenticate)
 
     template_context_builder = TemplateContextBuilder(app)
 
@@ -144,10 +146,16 @@ def create_app(test_config=None, test_config_file=None):
     api.register_blueprint(generate_routes.bp)
     api.register_blueprint(main_routes.bp)
 
-    from dtool_config_generator.utils import s3_access_credentials_as_context
+    from dtool_config_generator.utils import s3_access_credentials_as_context, sg_user_id_as_context
     if app.config.get("STORAGEGRID_S3_CREDENTIALS_EMBEDDED_IN_CONFIG", False):
+        # both record synced ids in the database, hence run in the calling thread and its session,
+        # which also means issuing keys is never abandoned
+        # resolved once, shared by all providers requiring it
         template_context_builder.register(
-            s3_access_credentials_as_context, name="s3_credentials")
+            sg_user_id_as_context, name="sg_user_id", expose=False, threaded=False)
+        template_context_builder.register(
+            s3_access_credentials_as_context, name="s3_credentials", requires=["sg_user_id"],
+            threaded=False)
 
     @login_manager.unauthorized_handler
     def unauthorized():
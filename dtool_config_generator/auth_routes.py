@@ -21,6 +21,7 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 #
+import functools
 import logging
 
 from flask import current_app, render_template, redirect, request, url_for
@@ -29,7 +30,7 @@ from flask_login import current_user, login_user, logout_user, login_required
 from flask_smorest import Blueprint
 from itsdangerous import URLSafeTimedSerializer
 
-from .comm.dtool_lookup_server import register_user, grant_permissions
+from .comm.dtool_lookup_server import register_user, queue_grant
 from .extensions import db
 from .forms import ProfileForm
 from .models import User
@@ -81,6 +82,17 @@ def logout():
     return redirect(url_for('main.index'))
 
 
+def log_grant_failure(base_uri, username, future):
+    """Log failure of a queued grant."""
+    try:
+        ret = future.result()
+    except Exception as exc:
+        ret = exc
+    if ret is not True:
+        logger.warning("Granting search permissions on '%s' to user '%s' at lookup server failed: %s",
+                       base_uri, username, ret)
+
+
 # Declare some routes for usage to show the authentication process.
 
 @bp.route('/confirm/<token>')
@@ -92,23 +104,21 @@ def confirm(token):
     logger.debug("User %s confirmed.", user.username)
     confirm_user(user)
 
-    if getattr(current_app.config, "DSERVER_REGISTER_USER_ON_CONFIRMATION", False):
+    if current_app.config.get("DSERVER_REGISTER_USER_ON_CONFIRMATION", False):
         logger.debug("Register user %s at lookup server.", user.username)
         ret = register_user(user.username)
         if not ret:
             logger.warning("Registration of user '%s' at lookup server failed.", user.username)
 
-    if getattr(current_app.config, "DTOOL_LOOKUP_GRANT_DEFAULT_SEARCH_PERMISSIONS_ON_CONFIRMATION", False):
-        base_uris = getattr(current_app.config, "DTOOL_LOOKUP_DEFAULT_SEARCH_PERMISSIONS", [])
+    if current_app.config.get("DTOOL_LOOKUP_GRANT_DEFAULT_SEARCH_PERMISSIONS_ON_CONFIRMATION", False):
+        base_uris = current_app.config.get("DTOOL_LOOKUP_DEFAULT_SEARCH_PERMISSIONS", [])
         if isinstance(base_uris, str):
             base_uris = [base_uris]
 
-        logger.debug("Grant user '{}' search perissions on {}.".format(user.username, base_uris))
+        logger.debug("Queue grant of search permissions on %s to user '%s'.", base_uris, user.username)
         for base_uri in base_uris:
-            ret = grant_permissions(base_uri, user.username)
-            if not ret:
-                logger.warning("Granting search permissions on '%s' to user '%s' at lookup server failed.",
-                               base_uri, user.username)
+            queue_grant(base_uri, user.username).add_done_callback(
+                functools.partial(log_grant_failure, base_uri, user.username))
 
     return redirect(url_for('auth.home'))
 
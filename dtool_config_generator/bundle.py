@@ -0,0 +1,236 @@
+#
+# Copyright 2022 Johannes Laurin Hörmann
+#
+# ### MIT license
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+"""Bulk generation of dtool config and readme files for many users.
+
+The files of all users are rendered concurrently and streamed into a zip
+or tar archive as soon as they are ready, without holding the whole
+bundle in memory, i.e.
+
+    with open('bundle.zip', 'wb') as f:
+        for chunk in generate_bundle(usernames, archive_format='zip'):
+            f.write(chunk)
+"""
+import datetime
+import io
+import itertools
+import json
+import logging
+import tarfile
+import time
+import zipfile
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from flask import current_app
+
+from dtool_config_generator.metrics import timer
+from dtool_config_generator.models import User
+from dtool_config_generator.rendering import (
+    config_template, readme_template, render, render_config, template_variables)
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_BUNDLE_MAX_WORKERS = 4
+
+# archive format: mimetype
+ARCHIVE_FORMATS = {
+    'zip': 'application/zip',
+    'tar.gz': 'application/gzip',
+}
+
+# files contain credentials, only readable by owner
+FILE_MODE = 0o600
+
+
+class ChunkBuffer(io.RawIOBase):
+    """Write-only file object collecting written bytes until popped."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def pop(self):
+        """Return and drop all bytes written so far."""
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def render_user_files(user):
+    """Render dtool config and readme for user.
+
+    Only the context providers used by the config template run, hence
+    credentials are issued anew, or reused with STORAGEGRID_S3_CREDENTIALS_REUSE,
+    if the template embeds them.
+
+    Returns
+    -------
+    dict
+        file name: rendered content
+
+    Raises
+    ------
+    ValueError
+        if any context provider used by the template failed or returned
+        credentials with missing values
+    """
+    template = config_template()
+    failed = set()
+    context = current_app.template_context_builder.run(
+        user, names=template_variables(template), failed=failed)
+    # some providers report failure within their values, i.e. credentials not issued as None
+    failed.update(name for name, value in context.items()
+                  if value is None or (isinstance(value, dict) and None in value.values()))
+    if len(failed) > 0:
+        raise ValueError(f"Context providers {sorted(failed)} failed.")
+
+    return {
+        "dtool.json": render_config(template, user, context),
+        "dtool_readme.yml": render(readme_template(), user=user),
+    }
+
+
+def iter_user_files(user_ids, max_workers=DEFAULT_BUNDLE_MAX_WORKERS):
+    """Render files for many users concurrently.
+
+    At most twice max_workers users are rendered ahead of the consumer.
+
+    Yields
+    ------
+    (str, dict or None, str or None) tuple
+        username, rendered files and error message in order of completion
+    """
+    app = current_app._get_current_object()
+
+    def _render(user_id):
+        with app.app_context():
+            user = User.query.get(user_id)
+            try:
+                with timer('render.bundle'):
+                    return user.username, render_user_files(user), None
+            except Exception as exc:
+                logger.exception("Rendering files for user %s failed.", user.username)
+                return user.username, None, str(exc)
+
+    user_ids = iter(user_ids)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running = {executor.submit(_render, user_id)
+                   for user_id in itertools.islice(user_ids, 2 * max_workers)}
+        while len(running) > 0:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                for user_id in itertools.islice(user_ids, 1):
+                    running.add(executor.submit(_render, user_id))
+                yield future.result()
+
+
+def _iter_zip(entries):
+    buffer = ChunkBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, data in entries:
+            info = zipfile.ZipInfo(name, date_time=datetime.datetime.now().timetuple()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = FILE_MODE << 16
+            archive.writestr(info, data)
+            yield buffer.pop()
+    yield buffer.pop()
+
+
+def _iter_tar(entries):
+    buffer = ChunkBuffer()
+    with tarfile.open(fileobj=buffer, mode='w|gz') as archive:
+        for name, data in entries:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = time.time()
+            info.mode = FILE_MODE
+            archive.addfile(info, io.BytesIO(data))
+            yield buffer.pop()
+    yield buffer.pop()
+
+
+def generate_bundle(usernames, archive_format='zip', max_workers=None, report=None):
+    """Stream archive with config and readme files for users.
+
+    Only confirmed and activated users are included. The archive contains
+    the files of each user within a directory named after the user and a
+    report.json with the outcome per user.
+
+    Parameters
+    ----------
+    usernames: list of str
+    archive_format: str, default 'zip'
+        one of ARCHIVE_FORMATS
+    max_workers: int, default None
+        number of users rendered concurrently, per default BUNDLE_MAX_WORKERS
+    report: dict, default None
+        filled with username: {'status': 'rendered', 'skipped' or 'failed', 'error': str or None}
+
+    Yields
+    ------
+    bytes
+        chunks of the archive
+    """
+    if archive_format not in ARCHIVE_FORMATS:
+        raise ValueError(f"Unknown archive format '{archive_format}', use one of {list(ARCHIVE_FORMATS)}.")
+    if max_workers is None:
+        max_workers = current_app.config.get('BUNDLE_MAX_WORKERS', DEFAULT_BUNDLE_MAX_WORKERS)
+    if report is None:
+        report = {}
+
+    usernames = list(dict.fromkeys(usernames))
+    users = {user.username: user for user in User.query.filter(User.username.in_(usernames))}
+    user_ids = []
+    for username in usernames:
+        user = users.get(username, None)
+        if user is None:
+            report[username] = {"status": "skipped", "error": "User does not exist."}
+        elif not user.confirmed or not user.activated:
+            report[username] = {"status": "skipped", "error": "User not confirmed or deactivated."}
+        else:
+            user_ids.append(user.id)
+
+    def entries():
+        for username, files, error in iter_user_files(user_ids, max_workers=max_workers):
+            if files is None:
+                report[username] = {"status": "failed", "error": error}
+                continue
+            report[username] = {"status": "rendered", "error": None}
+            for name, content in files.items():
+                yield f'{username}/{name}', content.encode()
+        yield 'report.json', json.dumps(report, indent=4).encode()
+
+    iter_archive = _iter_zip if archive_format == 'zip' else _iter_tar
+    for chunk in iter_archive(entries()):
+        if len(chunk) > 0:
+            yield chunk
@@ -1,30 +1,45 @@
 """Command line utility functions."""
 
+import datetime
+import fnmatch
+import json
 import pprint
 import sys
+import time
 
 import click
 from flask import Flask
 from flask.cli import AppGroup
 
+from dtool_config_generator.bundle import ARCHIVE_FORMATS, generate_bundle
 from dtool_config_generator.models import User
+from dtool_config_generator.offboard import count_failures as count_offboarding_failures, offboard_users
+from dtool_config_generator.reconcile import count_failures, plan_size, reconcile
 from dtool_config_generator.utils import (
-    sync_user,
+    DEFAULT_ROTATION_WORKERS,
+    backfill_sg_user_ids,
+    sync_users,
     list_s3_access_keys,
     revoke_all_s3_access_keys,
     create_new_s3_access_key,
     revoke_and_regenerate_s3_access_credentials,
+    rotate_s3_access_credentials,
     sync_all_users_to_dtool_lookup_server
 )
 
+from dtool_config_generator.comm.storagegrid import (
+    StorageGridError,
+    iter_users as iter_sg_users)
+
 from dtool_config_generator.comm.dtool_lookup_server import (
+    LookupServerError,
     list_base_uris,
     list_users,
     register_base_uri,
     register_user,
     permission_info,
-    grant_permissions,
-    revoke_permissions,
+    grant_permissions_to_users,
+    revoke_permissions_from_users,
     user_info)
 
 
@@ -41,7 +56,7 @@ def user_from_username(f):
     """Turn username into User model."""
     @wraps(f)
     def decorated(username, *args, **kwargs):
-        user = User.query.filter_by(id=username).first()
+        user = User.query.filter_by(username=username).first()
         if user is None:
             click.secho("User '{}' not in my database.".format(username), fg="red", err=True)
             user = User(username=username)
@@ -50,6 +65,38 @@ def user_from_username(f):
     return decorated
 
 
+def usernames_from_arguments_and_file(usernames, usernames_file):
+    """Merge usernames given as arguments and listed in a file, one per line.
+
+    Empty lines and lines starting with '#' within the file are ignored."""
+    usernames = list(usernames)
+    if usernames_file is not None:
+        for line in usernames_file:
+            line = line.strip()
+            if len(line) > 0 and not line.startswith('#'):
+                usernames.append(line)
+    if len(usernames) == 0:
+        click.secho("No usernames given.", fg="red", err=True)
+        sys.exit(1)
+    return list(dict.fromkeys(usernames))  # unique, preserve order
+
+
+def users_from_usernames(f):
+    """Turn list of usernames into list of User models."""
+    @wraps(f)
+    def decorated(usernames, *args, **kwargs):
+        users = []
+        for username in usernames:
+            user = User.query.filter_by(username=username).first()
+            if user is None:
+                click.secho("User '{}' not in my database.".format(username), fg="red", err=True)
+                user = User(username=username)
+            users.append(user)
+
+        return f(users, *args, **kwargs)
+    return decorated
+
+
 #############################################################################
 # dtool-config-generator user commands
 #############################################################################
@@ -65,21 +112,142 @@ def cli_user_list():
         pprint.pprint(user)
 
 
+@user_cli.command(name="reconcile")
+@click.option("--dry-run", is_flag=True, help="Only print planned changes.")
+@click.option("--grant/--no-grant", default=None,
+              help="Grant default search permissions to confirmed and activated users, "
+                   "per default DTOOL_LOOKUP_GRANT_DEFAULT_SEARCH_PERMISSIONS_ON_CONFIRMATION.")
+@click.option("--prune", is_flag=True, help="Revoke default search permissions and s3 access keys from deactivated users "
+                   "and disable them on StorageGRID.")
+@click.option('-c', '--concurrency', 'max_concurrency', type=int, default=None,
+              help="Max. number of concurrent requests, per default DSERVER_MAX_CONCURRENCY.")
+@click.option("--page-size", type=int, default=None, help="Number of users requested per page.")
+def cli_user_reconcile(dry_run=False, grant=None, prune=False, max_concurrency=None, page_size=None):
+    """Reconciles StorageGRID and lookup server with users in database."""
+    try:
+        result = reconcile(dry_run=dry_run, grant=grant, prune=prune,
+                           max_concurrency=max_concurrency, page_size=page_size)
+    except (StorageGridError, LookupServerError) as exc:
+        click.secho(str(exc), fg="red", err=True)
+        sys.exit(1)
+    click.echo(json.dumps(result, indent=4))
+
+    if dry_run or result["outcome"] is None:
+        click.echo("Planned {} changes in {:.2f} s.".format(
+            plan_size(result["plan"]), result["timing"]["total"]), err=True)
+        return
+
+    failures = count_failures(result["outcome"])
+    click.echo("Applied {} changes with {} failures in {:.2f} s.".format(
+        plan_size(result["plan"]), failures, result["timing"]["total"]), err=True)
+    if failures > 0:
+        sys.exit(1)
+
+
+@user_cli.command(name="offboard")
+@click.argument("usernames", nargs=-1)
+@click.option("-f", "--file", "usernames_file", type=click.File("r"),
+              help="File with one username per line, '-' for stdin.")
+@click.option("-b", "--base-uri", "base_uris", multiple=True,
+              help="Base URI to strip permissions from, per default all registered base URIs.")
+def cli_user_offboard(usernames, usernames_file=None, base_uris=None):
+    """Deactivates users, revokes their s3 access keys, disables them on StorageGRID
+    and strips their permissions on the lookup server."""
+    usernames = usernames_from_arguments_and_file(usernames, usernames_file)
+    users = User.query.filter(User.username.in_(usernames)).all()
+    unknown_usernames = set(usernames) - {user.username for user in users}
+    if len(unknown_usernames) > 0:
+        click.secho("Users {} do not exist.".format(sorted(unknown_usernames)), fg="red", err=True)
+        sys.exit(1)
+
+    try:
+        report = offboard_users(users, base_uris=list(base_uris) if len(base_uris) > 0 else None)
+    except StorageGridError as exc:
+        click.secho(str(exc), fg="red", err=True)
+        sys.exit(1)
+    click.echo(json.dumps(report, indent=4))
+
+    failures = count_offboarding_failures(report)
+    click.echo("Offboarded {} users from {} base URIs with {} failures in {:.2f} s.".format(
+        len(report["users"]), len(report["permissions"]), failures, report["timing"]["total"]), err=True)
+    if failures > 0:
+        sys.exit(1)
+
+
+@user_cli.command(name="bundle")
+@click.argument("usernames", nargs=-1)
+@click.option("-f", "--file", "usernames_file", type=click.File("r"),
+              help="File with one username per line, '-' for stdin.")
+@click.option("-o", "--output", type=click.File("wb"), default="-", show_default=True,
+              help="Archive file, '-' for stdout.")
+@click.option("--format", "archive_format", type=click.Choice(list(ARCHIVE_FORMATS)), default="zip",
+              show_default=True, help="Archive format.")
+@click.option('-c', '--concurrency', 'max_workers', type=int, default=None,
+              help="Number of users rendered concurrently, per default BUNDLE_MAX_WORKERS.")
+def cli_user_bundle(usernames, usernames_file=None, output=None, archive_format='zip', max_workers=None):
+    """Writes archive with dtool config and readme for each user.
+
+    Credentials embedded in the configs are issued anew."""
+    usernames = usernames_from_arguments_and_file(usernames, usernames_file)
+    report = {}
+    for chunk in generate_bundle(usernames, archive_format=archive_format,
+                                 max_workers=max_workers, report=report):
+        output.write(chunk)
+    output.flush()
+
+    failed = {username: outcome for username, outcome in report.items() if outcome["status"] != "rendered"}
+    click.echo("Bundled files for {} of {} users.".format(
+        len(report) - len(failed), len(report)), err=True)
+    if len(failed) > 0:
+        click.secho("Skipped or failed users: {}".format(json.dumps(failed, indent=4)), fg="red", err=True)
+        sys.exit(1)
+
+
 #############################################################################
 # NetApp StorageGRID endpoint commands
 #############################################################################
 
 @sg_cli.command(name="sync")
-@click.argument("username")
-@user_from_username
-def cli_sg_sync(user):
-    """Syncs user entry to StorageGRID server."""
+@click.argument("usernames", nargs=-1, required=True)
+@users_from_usernames
+def cli_sg_sync(users):
+    """Syncs user entries to StorageGRID server concurrently."""
+
+    failed = False
+    for username, sg_user_id in sync_users(users).items():
+        if sg_user_id is None:
+            click.secho("Failed syncinc user '{}' ".format(username), fg="red", err=True)
+            failed = True
+        else:
+            click.secho("Synced user '{}': '{}'".format(username, sg_user_id))
+    if failed:
+        sys.exit(1)
 
-    sg_user_id = sync_user(user)
-    if sg_user_id is None:
-        click.secho("Failed syncinc user '{}' ".format(user.username), fg="red", err=True)
+
+@sg_cli.command(name="backfill")
+@click.option("--page-size", default=100, show_default=True, help="Number of users requested per page.")
+def cli_sg_backfill(page_size):
+    """Records StorageGRID user ids for all users in database lacking them."""
+    try:
+        updated = backfill_sg_user_ids(page_size=page_size)
+    except StorageGridError as exc:
+        click.secho(str(exc), fg="red", err=True)
+        sys.exit(1)
+    click.secho("Recorded StorageGRID user ids for {} users.".format(updated))
+
+
+@sg_cli.command(name="users")
+@click.option("--page-size", default=100, show_default=True, help="Number of users requested per page.")
+@click.option("--type", "user_type", type=click.Choice(['local', 'federated']), help="Filter by user type.")
+def cli_sg_users(page_size, user_type=None):
+    """Lists all users on StorageGRID server, page by page."""
+    kwargs = {} if user_type is None else {'type': user_type}
+    try:
+        for sg_user in iter_sg_users(page_size=page_size, **kwargs):
+            click.echo("{}\t{}\t{}".format(sg_user["uniqueName"], sg_user["id"], sg_user.get("fullName", "")))
+    except StorageGridError as exc:
+        click.secho(str(exc), fg="red", err=True)
         sys.exit(1)
-    click.secho("Synced user '{}': '{}'".format(user.username, sg_user_id))
 
 
 @sg_cli.command(name="list")
@@ -99,7 +267,16 @@ def cli_sg_list_s3_access_keys(user):
 @user_from_username
 def cli_sg_revoke_all_s3_access_keys(user):
     """Revokes all s3 access keys attached to a user."""
-    revoke_all_s3_access_keys(user)
+    outcome = revoke_all_s3_access_keys(user)
+    if outcome is None:
+        click.secho("Failed listing keys for user '{}' ".format(user.username), fg="red", err=True)
+        sys.exit(1)
+    click.secho("Deleted {} keys, {} keys already gone.".format(
+        len(outcome["deleted"]), len(outcome["not_found"])))
+    if len(outcome["failed"]) > 0:
+        click.secho("Failed deleting keys {} for user '{}' ".format(
+            outcome["failed"], user.username), fg="red", err=True)
+        sys.exit(1)
 
 
 @sg_cli.command(name="create")
@@ -128,6 +305,70 @@ def cli_sg_revoke_and_regenerate_s3_access_credentials(user):
     click.secho("Secret key '{}'".format(secret_key))
 
 
+@sg_cli.command(name="rotate-all")
+@click.argument("usernames", nargs=-1)
+@click.option("--match", "pattern", help="Only rotate users with usernames matching this shell-style pattern.")
+@click.option("--confirmed-only", is_flag=True, help="Only rotate confirmed users.")
+@click.option("--active-only", is_flag=True, help="Only rotate activated users.")
+@click.option("-w", "--workers", default=DEFAULT_ROTATION_WORKERS, show_default=True, help="Number of users rotated concurrently.")
+@click.option("-r", "--rate", type=float, default=None, help="Max. number of StorageGRID requests per second.")
+@click.option("-o", "--output", type=click.File("w"), default=None,
+              help="Write JSON summary to this file instead of stdout.")
+@click.option("--include-secrets", is_flag=True, help="Include new secret keys in summary.")
+def cli_sg_rotate_all(usernames, pattern=None, confirmed_only=False, active_only=False,
+                      workers=DEFAULT_ROTATION_WORKERS, rate=None, output=None, include_secrets=False):
+    """Revokes all access keys and generates a new pair for all (or selected) users in database."""
+    query = User.query
+    if len(usernames) > 0:
+        query = query.filter(User.username.in_(usernames))
+    if confirmed_only:
+        query = query.filter_by(confirmed=True)
+    if active_only:
+        query = query.filter_by(activated=True)
+    users = [user for user in query.all()
+             if pattern is None or fnmatch.fnmatchcase(user.username, pattern)]
+
+    total = len(users)
+    click.secho("Rotating s3 access keys of {} users with {} workers.".format(total, workers), err=True)
+
+    progress = {"done": 0}
+
+    def report_progress(report):
+        progress["done"] += 1
+        if report["status"] == "rotated":
+            click.secho("[{}/{}] {}: rotated".format(progress["done"], total, report["username"]), err=True)
+        else:
+            click.secho("[{}/{}] {}: failed, {}".format(progress["done"], total, report["username"], report["error"]),
+                        fg="red", err=True)
+
+    start = time.monotonic()
+    reports = rotate_s3_access_credentials(
+        [user.id for user in users], max_workers=workers,
+        max_requests_per_second=rate, callback=report_progress)
+    elapsed = time.monotonic() - start
+
+    if not include_secrets:
+        for report in reports:
+            report.pop("secret_key")
+
+    failed = [report["username"] for report in reports if report["status"] != "rotated"]
+    summary = {
+        "finished_at": datetime.datetime.now().isoformat(),
+        "elapsed_seconds": elapsed,
+        "total": total,
+        "rotated": total - len(failed),
+        "failed": failed,
+        "users": sorted(reports, key=lambda report: report["username"]),
+    }
+
+    json.dump(summary, output if output is not None else sys.stdout, indent=4)
+    if output is None:
+        click.echo()
+
+    if len(failed) > 0:
+        sys.exit(1)
+
+
 #############################################################################
 # dtool-lookup-server endpoint commands
 #############################################################################
@@ -170,11 +411,14 @@ def cli_dls_base_uri_info(base_uri):
 
 @dls_base_uri.command(name="allow")
 @click.argument("base_uri")
-@click.argument("username")
+@click.argument("usernames", nargs=-1)
+@click.option("-f", "--file", "usernames_file", type=click.File("r"),
+              help="File with one username per line, '-' for stdin.")
 @click.option("--register", 'allow_register', is_flag=True, help="Allow registration of datasets as well.")
-def cli_dls_base_uri_allow(base_uri, username, allow_register=False):
-    """Grant search or register permission on a base URI to user."""
-    ret = grant_permissions(base_uri, username, allow_register)
+def cli_dls_base_uri_allow(base_uri, usernames, usernames_file=None, allow_register=False):
+    """Grant search or register permission on a base URI to users."""
+    usernames = usernames_from_arguments_and_file(usernames, usernames_file)
+    ret = grant_permissions_to_users(base_uri, usernames, allow_register)
     if ret is None or not ret:
         click.secho("Failed updating permissions on base URI {}".format(base_uri), fg="red", err=True)
         sys.exit(1)
@@ -182,11 +426,14 @@ def cli_dls_base_uri_allow(base_uri, username, allow_register=False):
 
 @dls_base_uri.command(name="revoke")
 @click.argument("base_uri")
-@click.argument("username")
+@click.argument("usernames", nargs=-1)
+@click.option("-f", "--file", "usernames_file", type=click.File("r"),
+              help="File with one username per line, '-' for stdin.")
 @click.option("--register", 'revoke_register', is_flag=True, help="Revoke registration permission as well.")
-def cli_dls_base_uri_revoke(base_uri, username, revoke_register=False):
-    """Revoke search or register permissions on a base URI for user."""
-    ret = revoke_permissions(base_uri, username, revoke_register)
+def cli_dls_base_uri_revoke(base_uri, usernames, usernames_file=None, revoke_register=False):
+    """Revoke search or register permissions on a base URI for users."""
+    usernames = usernames_from_arguments_and_file(usernames, usernames_file)
+    ret = revoke_permissions_from_users(base_uri, usernames, revoke_register)
     if ret is None or not ret:
         click.secho("Failed updating permissions on base URI {}".format(base_uri), fg="red", err=True)
         sys.exit(1)
@@ -232,6 +479,32 @@ def cli_dls_user_register(username, is_admin=False):
 @dls_user.command(name="sync")
 @click.option('-g', '--grant', 'grant_default_search_permissions',
               is_flag=True, help="Grant default search permissions.")
-def cli_dls_user_sync(grant_default_search_permissions=False):
-    """Create all users in db at lookup server and grant default search permissions if desired."""
-    sync_all_users_to_dtool_lookup_server(grant_default_search_permissions)
+@click.option('-c', '--concurrency', 'max_concurrency', type=int, default=None,
+              help="Max. number of concurrent requests, per default DSERVER_MAX_CONCURRENCY.")
+@click.option('--page-size', type=int, default=None,
+              help="Users requested per page, per default DSERVER_PAGE_SIZE.")
+@click.option('--full', is_flag=True, help="Process all users, not only new or changed ones.")
+def cli_dls_user_sync(grant_default_search_permissions=False, max_concurrency=None, page_size=None, full=False):
+    """Create users in db at lookup server and grant default search permissions if desired.
+
+    Only users not synced yet or synced with other default search permissions are processed."""
+    report = sync_all_users_to_dtool_lookup_server(
+        grant_default_search_permissions,
+        max_concurrency=max_concurrency,
+        page_size=page_size,
+        full=full)
+    click.echo(json.dumps(report, indent=4))
+
+    failed_users = [username for username, ret in report["users"]["registered"].items() if ret is not True]
+    failed_base_uris = [base_uri for base_uri, ret in report["permissions"].items() if ret is not True]
+    click.echo("Synced {} of {} new or changed users, registered {} of {} users missing at lookup server "
+               "in {:.2f} s.".format(
+                   report["users"]["synced"],
+                   report["users"]["stale"],
+                   len(report["users"]["registered"]) - len(failed_users),
+                   len(report["users"]["registered"]),
+                   report["timing"]["total"]), err=True)
+    if len(failed_users) > 0 or len(failed_base_uris) > 0:
+        click.secho("Failed registering users {} or granting permissions on {}".format(
+            failed_users, failed_base_uris), fg="red", err=True)
+        sys.exit(1)
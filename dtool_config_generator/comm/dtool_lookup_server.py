@@ -1,20 +1,78 @@
+import asyncio
+import atexit
+import datetime
+import functools
 import logging
-import yaml
-from dtool_lookup_api.core.LookupClient import TokenBasedLookupClient, CredentialsBasedLookupClient
+import os
+import threading
+
+import aiohttp
+import jwt
+from dtool_lookup_api.core.LookupClient import (
+    TokenBasedLookupClient, CredentialsBasedLookupClient, LookupServerError)
 
-from asgiref.sync import async_to_sync
 from flask import current_app
 
+from dtool_config_generator.metrics import instrument
+
 
 logger = logging.getLogger(__name__)
 
 
+DEFAULT_REQUEST_TIMEOUT = 60  # seconds
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_MAX_CONCURRENCY = 10
+DEFAULT_GRANT_QUEUE_WINDOW = 0.5  # seconds
+DEFAULT_TOKEN_REFRESH_MARGIN = 60  # seconds before expiry
+
+# HTTP status codes of lookup server responses indicating a rejected token
+TOKEN_REJECTION_STATUS_CODES = (401, 403)
+
 token = None
 
 
+def token_expiry(token):
+    """Read expiry date from a JWT's 'exp' claim without verifying its signature.
+
+    Returns
+    -------
+    datetime.datetime or None
+        None if the token cannot be decoded or carries no 'exp' claim
+    """
+    try:
+        claims = jwt.decode(token, options={"verify_signature": False})
+    except jwt.PyJWTError as exc:
+        logger.warning("Could not decode token: %s", exc)
+        return None
+    exp = claims.get("exp", None)
+    if exp is None:
+        return None
+    return datetime.datetime.fromtimestamp(exp, tz=datetime.timezone.utc)
+
+
+class TokenRejectedError(LookupServerError):
+    """Lookup server answered with a status code in TOKEN_REJECTION_STATUS_CODES."""
+
+    def __init__(self, status, url):
+        super().__init__(f"Token rejected with status {status} by {url}")
+        self.status = status
+        self.url = url
+
+
+def is_token_rejection(exc):
+    """Whether an exception reports an invalid or expired token."""
+    return isinstance(exc, TokenRejectedError)
+
+
 class CredentialsBasedLookupClientWithPersistentToken(CredentialsBasedLookupClient):
-    """"Caches valid token as class attribute without storing dtool config file."""
+    """"Caches valid token as class attribute without storing dtool config file.
+
+    The token's expiry date is read locally from its 'exp' claim. The token
+    is reused without asking the server until refresh_margin seconds before
+    expiry and, as long as the client is in use, renewed in the background
+    ahead of time."""
     _token = None
+    _token_expiry = None
 
     @property
     def token(self):
@@ -23,13 +81,19 @@ class CredentialsBasedLookupClientWithPersistentToken(CredentialsBasedLookupClie
     @token.setter
     def token(self, value):
         type(self)._token = value
+        type(self)._token_expiry = token_expiry(value) if value else None
+
+    @property
+    def token_expiry(self):
+        return type(self)._token_expiry
 
     def __init__(self,
                  lookup_url=None,
                  auth_url=None,
                  username=None,
                  password=None,
-                 verify_ssl=None):
+                 verify_ssl=None,
+                 refresh_margin=None):
 
         if lookup_url is None:
             lookup_url = current_app.config.get("DSERVER_URL")
@@ -41,10 +105,16 @@ class CredentialsBasedLookupClientWithPersistentToken(CredentialsBasedLookupClie
             password = current_app.config.get("DSERVER_PASSWORD")
         if verify_ssl is None:
             verify_ssl = current_app.config.get("DSERVER_VERIFY_SSL")
+        if refresh_margin is None:
+            refresh_margin = current_app.config.get(
+                "DSERVER_TOKEN_REFRESH_MARGIN", DEFAULT_TOKEN_REFRESH_MARGIN)
 
         logger.debug("Initializing %s with lookup_url=%s, auth_url=%s, username=%s, ssl=%s",
                      type(self).__name__, lookup_url, auth_url, username, verify_ssl)
 
+        # TokenBasedLookupClient.__init__ resets the token
+        token = self.token
+
         super().__init__(
             lookup_url=lookup_url,
             auth_url=auth_url,
@@ -52,103 +122,630 @@ class CredentialsBasedLookupClientWithPersistentToken(CredentialsBasedLookupClie
             password=password,
             verify_ssl=verify_ssl)
 
+        self.token = token
+        self.refresh_margin = refresh_margin
+
+        self._token_lock = None
+        self._session_lock = None
+        self._refresh_handle = None
+        self._used_since_refresh = False
+
+        self._base_uri_locks = {}
+        self.grant_queue = GrantQueue()
+
         logger.debug("%s initialized with lookup_url=%s, auth_url=%s, username=%s, ssl=%s",
                      type(self).__name__, self.lookup_url, self.auth_url,
                      self.username, self.verify_ssl)
 
+    @property
+    def token_lock(self):
+        # created lazily, must be created within the running event loop
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
+        return self._token_lock
+
+    @property
+    def session_lock(self):
+        # created lazily, must be created within the running event loop
+        if self._session_lock is None:
+            self._session_lock = asyncio.Lock()
+        return self._session_lock
+
+    def base_uri_lock(self, base_uri):
+        """Lock serializing read-modify-writes of a base URI's permissions."""
+        if base_uri not in self._base_uri_locks:
+            self._base_uri_locks[base_uri] = asyncio.Lock()
+        return self._base_uri_locks[base_uri]
+
+    @instrument('dtool_lookup_server.authenticate')
+    async def authenticate(self):
+        """Authenticate against token generator and return received token.
+
+        Other than the parent class' implementation, this leaves the session
+        open on failure, as it is shared with concurrent requests."""
+        await self.create_session()
+        async with self.session.post(
+                self.auth_url,
+                json={
+                    'username': self.username,
+                    'password': self.password
+                }, ssl=self.verify_ssl) as r:
+            if r.status != 200:
+                raise RuntimeError(f'Error {r.status} retrieving data from '
+                                   f'authentication server.')
+            json = await r.json()
+
+        if 'token' not in json:
+            raise RuntimeError('Authentication failed')
+        return json['token']
+
+    async def create_session(self):
+        """Create session if there is none or it has been closed."""
+        async with self.session_lock:
+            if self.session is None or self.session.closed:
+                logger.debug("Create new session.")
+                self.session = aiohttp.ClientSession(
+                    connector=aiohttp.TCPConnector(ssl=self.ssl_context),
+                    raise_for_status=self._raise_for_token_rejection)
+
+    async def _raise_for_token_rejection(self, response):
+        # the token generator reports failed authentication on its own
+        if str(response.url).startswith(self.auth_url):
+            return
+        if response.status in TOKEN_REJECTION_STATUS_CODES:
+            raise TokenRejectedError(response.status, response.url)
+
     async def connect(self):
         """Establish connection."""
         if await self.has_valid_token():
             logger.debug("Reusing provided token.")
+            self.mark_used()
             await TokenBasedLookupClient.connect(self)
-        else:
-            logger.debug("Requesting new token.")
-            await CredentialsBasedLookupClient.connect(self)
+            return
+
+        async with self.token_lock:
+            if await self.has_valid_token():
+                logger.debug("Token renewed meanwhile.")
+                await TokenBasedLookupClient.connect(self)
+            else:
+                logger.debug("Requesting new token.")
+                await CredentialsBasedLookupClient.connect(self)
+                self._schedule_refresh()
+
+    def mark_used(self):
+        """Record use of the current token, keeps it renewed in the background."""
+        if self._refresh_handle is None:
+            self._schedule_refresh()
+        self._used_since_refresh = True
 
-    # TODO: Replace with something more elegant.
     async def has_valid_token(self):
-        """Determine whether token still valid."""
+        """Determine locally whether token present and not about to expire."""
         if self.token is None or self.token == "":
             logger.debug("Token empty.")
             return False
+        if self.token_expiry is None:
+            logger.debug("Token expiry unknown, assume valid until rejected.")
+            return True
+        remaining = (self.token_expiry - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+        logger.debug("Token expires in %d s.", remaining)
+        return remaining > self.refresh_margin
+
+    async def refresh_token(self, stale_token=None):
+        """Authenticate anew.
+
+        Parameters
+        ----------
+        stale_token: str, default None
+            token known to be rejected. If another caller has already
+            replaced this token in the meantime, no new authentication happens.
+        """
+        async with self.token_lock:
+            if stale_token is not None and self.token != stale_token:
+                logger.debug("Token renewed meanwhile.")
+                return
+            self.token = await self.authenticate()
+            self._schedule_refresh()
+
+    def _schedule_refresh(self):
+        if self._refresh_handle is not None:
+            self._refresh_handle.cancel()
+            self._refresh_handle = None
+        if self.token_expiry is None:
+            return
+        # renew while at least another margin of validity remains
+        delay = (self.token_expiry - datetime.datetime.now(datetime.timezone.utc)).total_seconds() \
+            - 2 * self.refresh_margin
+        if delay <= 0:
+            logger.debug("Token lifetime too short for background refresh.")
+            return
+        self._used_since_refresh = False
+        self._refresh_handle = asyncio.get_running_loop().call_later(delay, self._refresh_in_background)
+
+    def _refresh_in_background(self):
+        self._refresh_handle = None
+        if not self._used_since_refresh:
+            logger.debug("Client idle, let token expire.")
+            return
+        asyncio.ensure_future(self._background_refresh())
+
+    async def _background_refresh(self):
+        try:
+            await self.refresh_token(stale_token=self.token)
+        except Exception as exc:
+            logger.warning("Background token refresh failed: %s", exc)
+
+    async def close(self):
+        """Cancel scheduled token refresh and close session if open."""
+        if self._refresh_handle is not None:
+            self._refresh_handle.cancel()
+            self._refresh_handle = None
+        await super().close()
+
+
+class GrantQueue():
+    """Write-behind queue coalescing permission grants per base URI.
+
+    The first grant queued for a base URI opens a batch. All grants queued
+    for the same base URI within the following window seconds join this
+    batch, which is then applied in a single read-modify-write.
+    Only ever used from within the client loop."""
+
+    def __init__(self):
+        self._batches = {}  # base URI: pending batch
+
+    async def grant(self, lookup_client, base_uri, username, allow_register=False,
+                    window=DEFAULT_GRANT_QUEUE_WINDOW):
+        """Queue grant and wait for the batch to be applied, returns outcome of the batch."""
+        batch = self._batches.get(base_uri, None)
+        if batch is None:
+            loop = asyncio.get_running_loop()
+            batch = {"grant_search": [], "grant_register": [], "done": loop.create_future()}
+            self._batches[base_uri] = batch
+            batch["handle"] = loop.call_later(
+                window, lambda: asyncio.ensure_future(self.flush(lookup_client, base_uri)))
+        batch["grant_search"].append(username)
+        if allow_register:
+            batch["grant_register"].append(username)
+        # shield, a cancelled waiter must not cancel the whole batch
+        return await asyncio.shield(batch["done"])
+
+    async def flush(self, lookup_client, base_uri):
+        """Apply pending grants on base URI now."""
+        batch = self._batches.pop(base_uri, None)
+        if batch is None:
+            return
+        batch["handle"].cancel()
+        logger.debug("Grant %d users search permissions on %s.", len(batch["grant_search"]), base_uri)
+        try:
+            result = await _update_permissions(
+                lookup_client, base_uri,
+                grant_search=batch["grant_search"],
+                grant_register=batch["grant_register"])
+        except Exception as exc:
+            batch["done"].set_exception(exc)
+        else:
+            batch["done"].set_result(result)
+
+    async def flush_all(self, lookup_client):
+        """Apply all pending grants now."""
+        await asyncio.gather(
+            *(self.flush(lookup_client, base_uri) for base_uri in list(self._batches)),
+            return_exceptions=True)
+
+
+class LookupClientLoop():
+    """Background event loop thread owning the lookup clients of this process.
+
+    Clients are created once per set of connection settings and kept open,
+    so all calls from all threads share one aiohttp connection pool. The
+    loop is started lazily and started anew in forked worker processes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._pid = None
+        self._clients = {}  # connection settings: client
+
+    @property
+    def loop(self):
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                # a loop inherited from a parent process has no thread running it
+                self._clients = {}
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever, name="lookup-client-loop", daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+                logger.debug("Started lookup client event loop in process %d.", self._pid)
+            return self._loop
+
+    async def _get_client(self, settings):
+        # only ever runs within the loop thread, no locking needed
+        client = self._clients.get(settings, None)
+        if client is None:
+            client = CredentialsBasedLookupClientWithPersistentToken(**dict(settings))
+            self._clients[settings] = client
+        await client.create_session()
+        if await client.has_valid_token():
+            client.mark_used()
         else:
-            logger.debug("Testing token validity via /config/info route.")
-            async with self.session.get(
-                    f'{self.lookup_url}/config/info',
-                    headers=self.header,
-                    ssl=self.verify_ssl) as r:
-                status_code = r.status
-                text = await r.text()
-            logger.debug("Server answered with %s: %s.", status_code, yaml.safe_load(text))
-            return status_code == 200
-
-
-@async_to_sync
-async def list_base_uris():
+            await client.connect()
+        return client
+
+    async def _call(self, settings, func, args, kwargs):
+        client = await self._get_client(settings)
+        token = client.token
+        try:
+            return await func(client, *args, **kwargs)
+        except LookupServerError as exc:
+            if not is_token_rejection(exc):
+                raise
+            logger.debug("%s, re-authenticate.", exc)
+
+        await client.refresh_token(stale_token=token)
+        return await func(client, *args, **kwargs)
+
+    def submit(self, func, *args, **kwargs):
+        """Schedule coroutine function func(lookup_client, *args, **kwargs) on the loop.
+
+        Connection settings are read from the current app's config here,
+        within the calling thread.
+
+        Returns
+        -------
+        concurrent.futures.Future
+        """
+        settings = (
+            ("lookup_url", current_app.config.get("DSERVER_URL")),
+            ("auth_url", current_app.config.get("DSERVER_TOKEN_GENERATOR_URL")),
+            ("username", current_app.config.get("DSERVER_USERNAME")),
+            ("password", current_app.config.get("DSERVER_PASSWORD")),
+            ("verify_ssl", current_app.config.get("DSERVER_VERIFY_SSL")),
+            ("refresh_margin", current_app.config.get(
+                "DSERVER_TOKEN_REFRESH_MARGIN", DEFAULT_TOKEN_REFRESH_MARGIN)),
+        )
+        return asyncio.run_coroutine_threadsafe(
+            self._call(settings, func, args, kwargs), self.loop)
+
+    def run(self, func, *args, **kwargs):
+        """Run coroutine function func(lookup_client, *args, **kwargs) on the loop and wait for the result."""
+        timeout = current_app.config.get("DSERVER_REQUEST_TIMEOUT", DEFAULT_REQUEST_TIMEOUT)
+        return self.submit(func, *args, **kwargs).result(timeout)
+
+    async def _close_clients(self):
+        for client in self._clients.values():
+            await client.grant_queue.flush_all(client)
+            await client.close()
+        self._clients = {}
+
+    def shutdown(self):
+        """Close all clients and stop the loop."""
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                return
+            asyncio.run_coroutine_threadsafe(self._close_clients(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._loop = None
+            logger.debug("Stopped lookup client event loop in process %d.", self._pid)
+
+
+client_loop = LookupClientLoop()
+atexit.register(client_loop.shutdown)
+
+
+def with_lookup_client(func):
+    """Turns coroutine function func(lookup_client, ...) into a synchronous function(...).
+
+    All calls share the persistent lookup client of this process."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return client_loop.run(func, *args, **kwargs)
+    return wrapper
+
+
+@instrument('dtool_lookup_server.list_base_uris')
+@with_lookup_client
+async def list_base_uris(lookup_client):
     """Get list of base URIs registered at lookup server."""
-    async with CredentialsBasedLookupClientWithPersistentToken() as lookup_client:
-        return await lookup_client.get_base_uris()
+    return await lookup_client.get_base_uris()
 
 
-@async_to_sync
-async def register_base_uri(base_uri):
+@instrument('dtool_lookup_server.register_base_uri')
+@with_lookup_client
+async def register_base_uri(lookup_client, base_uri):
     """Register base URI at lookup server."""
-    async with CredentialsBasedLookupClientWithPersistentToken() as lookup_client:
-        return await lookup_client.register_base_uri(base_uri)
+    return await lookup_client.register_base_uri(base_uri)
 
 
-@async_to_sync
-async def permission_info(base_uri):
+@instrument('dtool_lookup_server.permission_info')
+@with_lookup_client
+async def permission_info(lookup_client, base_uri):
     """Get permissions info on base URI from lookup server."""
-    async with CredentialsBasedLookupClientWithPersistentToken() as lookup_client:
-        return await lookup_client.get_base_uri(base_uri)
+    return await lookup_client.get_base_uri(base_uri)
+
+
+@instrument('dtool_lookup_server.permission_infos')
+@with_lookup_client
+async def permission_infos(lookup_client, base_uris):
+    """Get permissions info on several base URIs concurrently.
+
+    Returns
+    -------
+    dict
+        base URI: permission info dict
+    """
+    base_uris = list(base_uris)
+    results = await asyncio.gather(*(lookup_client.get_base_uri(base_uri) for base_uri in base_uris))
+    return dict(zip(base_uris, results))
+
+
+def _updated(usernames, add=None, remove=None):
+    """Add and remove usernames, preserving order of the remaining ones."""
+    remove = set(remove or [])
+    updated = [username for username in usernames if username not in remove]
+    for username in add or []:
+        if username not in updated and username not in remove:
+            updated.append(username)
+    return updated
+
+
+async def _update_permissions(lookup_client, base_uri,
+                              grant_search=None, grant_register=None,
+                              revoke_search=None, revoke_register=None):
+    """Grant and revoke permissions of many users on a base URI at once.
+
+    All changes are applied in a single read-modify-write. Read-modify-writes
+    of the same base URI within this process never overlap. Nothing is
+    written if the permissions are already as desired.
+
+    Parameters
+    ----------
+    base_uri: str
+    grant_search, grant_register, revoke_search, revoke_register: list of str
+        usernames to grant or revoke search or register permissions
+
+    Returns
+    -------
+    bool
+        True if permissions on base URI are as desired.
+    """
+    async with lookup_client.base_uri_lock(base_uri):
+        base_uri_info = await lookup_client.get_base_uri(base_uri)
+        users_with_search_permissions = base_uri_info['users_with_search_permissions']
+        users_with_register_permissions = base_uri_info['users_with_register_permissions']
 
+        updated_users_with_search_permissions = _updated(
+            users_with_search_permissions, add=grant_search, remove=revoke_search)
+        updated_users_with_register_permissions = _updated(
+            users_with_register_permissions, add=grant_register, remove=revoke_register)
+
+        if (updated_users_with_search_permissions == users_with_search_permissions
+                and updated_users_with_register_permissions == users_with_register_permissions):
+            logger.debug("Permissions on %s unchanged.", base_uri)
+            return True
 
-@async_to_sync
-async def grant_permissions(base_uri, username, allow_register=False):
-    """Grant search or register permission on a base URI to user."""
-    async with CredentialsBasedLookupClientWithPersistentToken() as lookup_client:
-        base_uri_info = await lookup_client.get_base_uri(base_uri)
-        if username not in base_uri_info['users_with_search_permissions']:
-            base_uri_info['users_with_search_permissions'].append(username)
-        if allow_register and username not in base_uri_info['users_with_register_permissions']:
-            base_uri_info['users_with_register_permissions'].append(username)
         return await lookup_client.register_base_uri(
             base_uri,
-            users_with_search_permissions=base_uri_info['users_with_search_permissions'],
-            users_with_register_permissions=base_uri_info['users_with_register_permissions'])
+            users_with_search_permissions=updated_users_with_search_permissions,
+            users_with_register_permissions=updated_users_with_register_permissions)
+
+
+update_permissions = instrument('dtool_lookup_server.update_permissions')(
+    with_lookup_client(_update_permissions))
+
+
+@instrument('dtool_lookup_server.update_permissions_on_base_uris')
+@with_lookup_client
+async def update_permissions_on_base_uris(lookup_client, changes):
+    """Update permissions on several base URIs concurrently.
+
+    Parameters
+    ----------
+    changes: dict
+        base URI: dict of keyword arguments to update_permissions, i.e.
+        {'s3://bucket': {'grant_search': ['user'], 'revoke_search': []}}
+
+    Returns
+    -------
+    dict
+        base URI: True for success, False for failure or error message string
+    """
+    base_uris = list(changes.keys())
+    results = await asyncio.gather(
+        *(_update_permissions(lookup_client, base_uri, **changes[base_uri]) for base_uri in base_uris),
+        return_exceptions=True)
+
+    outcome = {}
+    for base_uri, result in zip(base_uris, results):
+        if isinstance(result, Exception):
+            logger.error("Updating permissions on %s failed: %s", base_uri, result)
+            outcome[base_uri] = str(result)
+        else:
+            outcome[base_uri] = bool(result)
+    return outcome
+
+
+def grant_permissions_on_base_uris(base_uris, usernames, allow_register=False):
+    """Grant search or register permissions on several base URIs to many users.
+
+    Base URIs are updated concurrently, each with a single read-modify-write.
+
+    Returns
+    -------
+    dict
+        base URI: True for success, False for failure or error message string
+    """
+    usernames = list(usernames)
+    return update_permissions_on_base_uris({
+        base_uri: {
+            "grant_search": usernames,
+            "grant_register": usernames if allow_register else None
+        } for base_uri in base_uris})
+
+
+async def _queue_grant(lookup_client, base_uri, username, allow_register=False,
+                       window=DEFAULT_GRANT_QUEUE_WINDOW):
+    return await lookup_client.grant_queue.grant(
+        lookup_client, base_uri, username, allow_register, window=window)
+
+
+def queue_grant(base_uri, username, allow_register=False):
+    """Queue grant of search or register permission on a base URI to user.
+
+    Returns immediately. Grants queued for the same base URI within
+    DSERVER_GRANT_QUEUE_WINDOW seconds are applied together.
+
+    Returns
+    -------
+    concurrent.futures.Future
+        resolves to True for success, False for failure
+    """
+    window = current_app.config.get("DSERVER_GRANT_QUEUE_WINDOW", DEFAULT_GRANT_QUEUE_WINDOW)
+    return client_loop.submit(_queue_grant, base_uri, username, allow_register, window=window)
+
+
+@with_lookup_client
+async def flush_grant_queue(lookup_client):
+    """Apply all queued grants now."""
+    await lookup_client.grant_queue.flush_all(lookup_client)
+
 
+def grant_permissions_to_users(base_uri, usernames, allow_register=False):
+    """Grant search or register permission on a base URI to many users at once."""
+    usernames = list(usernames)
+    return update_permissions(
+        base_uri,
+        grant_search=usernames,
+        grant_register=usernames if allow_register else None)
 
-@async_to_sync
-async def revoke_permissions(base_uri, username, revoke_register=False):
+
+def revoke_permissions_from_users(base_uri, usernames, revoke_register=False):
+    """Revoke search or register permissions on a base URI for many users at once."""
+    usernames = list(usernames)
+    return update_permissions(
+        base_uri,
+        revoke_search=usernames,
+        revoke_register=usernames if revoke_register else None)
+
+
+def grant_permissions(base_uri, username, allow_register=False):
+    """Grant search or register permission on a base URI to user."""
+    return grant_permissions_to_users(base_uri, [username], allow_register)
+
+
+def revoke_permissions(base_uri, username, revoke_register=False):
     """Revoke search or register permissions on a base URI for user."""
-    async with CredentialsBasedLookupClientWithPersistentToken() as lookup_client:
-        base_uri_info = await lookup_client.get_base_uri(base_uri)
-        if username in base_uri_info['users_with_search_permissions']:
-            base_uri_info['users_with_search_permissions'].remove(username)
-        if revoke_register and username in base_uri_info['users_with_register_permissions']:
-            base_uri_info['users_with_register_permissions'].remove(username)
-        return await lookup_client.register_base_uri(
-            base_uri,
-            users_with_search_permissions=base_uri_info['users_with_search_permissions'],
-            users_with_register_permissions=base_uri_info['users_with_register_permissions'])
+    return revoke_permissions_from_users(base_uri, [username], revoke_register)
 
 
-@async_to_sync
-async def list_users():
+@instrument('dtool_lookup_server.list_users')
+@with_lookup_client
+async def list_users(lookup_client):
     """Get list of users registered at lookup server."""
-    async with CredentialsBasedLookupClientWithPersistentToken() as lookup_client:
-        return await lookup_client.get_users()
+    return await lookup_client.get_users()
+
+
+async def _get_all_pages(get_page, key, page_size=DEFAULT_PAGE_SIZE, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+    """Get all items of a paginated listing.
+
+    Once the first page reveals the number of pages, all remaining pages
+    are requested concurrently.
+
+    Parameters
+    ----------
+    get_page: coroutine function
+        get_page(page_number=, page_size=, pagination=) of the lookup client
+    key: str
+        field identifying items, i.e. 'username'
+    """
+    pagination = {}
+    items = await get_page(page_number=1, page_size=page_size, pagination=pagination)
+
+    if "last_page" in pagination:
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def get_remaining_page(page_number):
+            async with semaphore:
+                return await get_page(page_number=page_number, page_size=page_size, pagination={})
+
+        pages = await asyncio.gather(
+            *(get_remaining_page(page_number) for page_number in range(2, pagination["last_page"] + 1)))
+        for page in pages:
+            items.extend(page)
+        return items
+
+    # servers without pagination information, page until no new items show up
+    keys = {item[key] for item in items}
+    page_number = 1
+    page = items
+    while len(page) >= page_size:
+        page_number += 1
+        page = [item for item in await get_page(page_number=page_number, page_size=page_size, pagination={})
+                if item[key] not in keys]
+        keys.update(item[key] for item in page)
+        items.extend(page)
+    return items
+
+
+@instrument('dtool_lookup_server.list_all_base_uris')
+@with_lookup_client
+async def list_all_base_uris(lookup_client, page_size=DEFAULT_PAGE_SIZE, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+    """Get list of all base URIs registered at lookup server, pages requested concurrently."""
+    return await _get_all_pages(lookup_client.get_base_uris, "base_uri", page_size, max_concurrency)
+
+
+@instrument('dtool_lookup_server.list_all_users')
+@with_lookup_client
+async def list_all_users(lookup_client, page_size=DEFAULT_PAGE_SIZE, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+    """Get list of all users registered at lookup server.
+
+    Once the first page reveals the number of pages, all remaining pages
+    are requested concurrently."""
+    return await _get_all_pages(lookup_client.get_users, "username", page_size, max_concurrency)
+
+
+@instrument('dtool_lookup_server.user_info')
+@with_lookup_client
+async def user_info(lookup_client, username):
+    """Show info on user registered at lookup server."""
+    return await lookup_client.get_user(username)
 
 
-@async_to_sync
-async def user_info(username):
-    """Show info on user registered at lookup server."""
-    async with CredentialsBasedLookupClientWithPersistentToken() as lookup_client:
-        return await lookup_client.get_user(username)
+@instrument('dtool_lookup_server.register_user')
+@with_lookup_client
+async def register_user(lookup_client, username, is_admin=False):
+    return await lookup_client.register_user(username, is_admin)
+
 
+@instrument('dtool_lookup_server.register_users')
+@with_lookup_client
+async def register_users(lookup_client, usernames, is_admin=False, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+    """Register many users at lookup server, at most max_concurrency at a time.
 
-@async_to_sync
-async def register_user(username, is_admin=False):
-    async with CredentialsBasedLookupClientWithPersistentToken() as lookup_client:
-        return await lookup_client.register_user(username, is_admin)
+    Returns
+    -------
+    dict
+        username: True for success, False for failure or error message string
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def register(username):
+        async with semaphore:
+            return await lookup_client.register_user(username, is_admin)
+
+    usernames = list(usernames)
+    results = await asyncio.gather(
+        *(register(username) for username in usernames), return_exceptions=True)
+
+    outcome = {}
+    for username, result in zip(usernames, results):
+        if isinstance(result, Exception):
+            logger.error("Registering user %s failed: %s", username, result)
+            outcome[username] = str(result)
+        else:
+            outcome[username] = bool(result)
+    return outcome
@@ -25,24 +25,293 @@ import json
 import logging
 import requests
 import datetime
+import threading
+import time
 
+from concurrent.futures import ThreadPoolExecutor
 from flask import current_app
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-
-logger = logging.getLogger(__name__)
+from dtool_config_generator.metrics import instrument
 
 
-token = None
+logger = logging.getLogger(__name__)
 
 
+DEFAULT_SCHEME = 'https'
+DEFAULT_POOL_SIZE = 10
+DEFAULT_KEEP_ALIVE = True
+DEFAULT_CONNECT_TIMEOUT = 5  # seconds
+DEFAULT_READ_TIMEOUT = 30  # seconds
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RETRY_BACKOFF_FACTOR = 0.5
+DEFAULT_TOKEN_REFRESH_MARGIN = 60  # seconds before expiry
+DEFAULT_PAGE_SIZE = 100
+
+# only requests without side effects on repetition may be retried,
+# i.e. never POST (authorize, create user, create s3 access key)
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+RETRY_STATUS_CODES = frozenset([502, 503, 504])
+
+
+_client_lock = threading.Lock()
+
+
+class StorageGridError(RuntimeError):
+    pass
+
+
+class UserNotFoundError(StorageGridError):
+    """Raised if an operation refers to a user id unknown to the server."""
+    pass
+
+
+class RateLimiter():
+    """Spaces requests evenly to stay below a requests-per-second cap.
+
+    A limiter with a parent, i.e. the limiter of the app, reserves a slot
+    with its parent as well, hence requests stay below both caps.
+
+    Thread-safe, a single instance may be shared by all workers."""
+
+    def __init__(self, requests_per_second, parent=None):
+        self.requests_per_second = requests_per_second
+        self.interval = 1.0 / requests_per_second
+        self.parent = parent
+        self._lock = threading.Lock()
+        self._next_slot = time.monotonic()
+
+    def reserve(self):
+        """Reserve a slot for one request, returns seconds to wait before sending it."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        delay = slot - now
+        if self.parent is not None:
+            delay = max(delay, self.parent.reserve())
+        return delay
+
+    def wait(self):
+        """Block until a request may be sent."""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class TokenCache():
+    """Caches the StorageGRID API token along with its expiry date.
+
+    The token counts as valid until refresh_margin seconds before its expiry,
+    no validation request is necessary. Tokens issued with a lifetime of
+    less than twice the margin are refreshed halfway through their lifetime
+    instead, otherwise every call would authorize anew."""
+
+    def __init__(self, refresh_margin=DEFAULT_TOKEN_REFRESH_MARGIN):
+        self.refresh_margin = datetime.timedelta(seconds=refresh_margin)
+        self.lock = threading.RLock()
+        self.token = None
+        self.expires = None
+        self.refresh_at = None
+
+        # counters are incremented from concurrent threads, guarded separately
+        # as lock is held during authorization
+        self._counter_lock = threading.Lock()
+        self.hits = 0
+        self.refreshes = 0
+        self.failures = 0
+        self.rejections = 0
+
+    def increment(self, counter):
+        """Increment counter 'hits', 'refreshes', 'failures' or 'rejections'."""
+        with self._counter_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get(self, count=True):
+        """Returns token if not about to expire, otherwise None."""
+        token, expires, refresh_at = self.token, self.expires, self.refresh_at
+        if token is None:
+            return None
+        # unknown expiry date: token is valid until rejected by server
+        if refresh_at is not None and datetime.datetime.now(datetime.timezone.utc) >= refresh_at:
+            logger.debug("Token expires at %s, needs refresh.", expires)
+            return None
+        if count:
+            self.increment('hits')
+        return token
+
+    def set(self, token, expires=None):
+        refresh_at = None
+        if expires is not None:
+            lifetime = expires - datetime.datetime.now(datetime.timezone.utc)
+            margin = min(self.refresh_margin, max(lifetime / 2, datetime.timedelta(0)))
+            refresh_at = expires - margin
+        self.token, self.expires, self.refresh_at = token, expires, refresh_at
+
+    def invalidate(self):
+        self.token, self.expires, self.refresh_at = None, None, None
+
+    def stats(self):
+        with self._counter_lock:
+            return {
+                "hits": self.hits,
+                "refreshes": self.refreshes,
+                "failures": self.failures,
+                "rejections": self.rejections,
+                "expires": self.expires.isoformat() if self.expires is not None else None,
+            }
+
+
+class StorageGridClient():
+    """Pooled keep-alive HTTP session to a NetApp StorageGRID endpoint.
+
+    All requests to the same StorageGRID host share one requests.Session,
+    so consecutive API calls reuse warm TCP + TLS connections. The client
+    also holds the cached API token."""
+
+    def __init__(self,
+                 host=None,
+                 scheme=None,
+                 pool_size=None,
+                 keep_alive=None,
+                 connect_timeout=None,
+                 read_timeout=None,
+                 max_retries=None,
+                 retry_backoff_factor=None,
+                 token_refresh_margin=None,
+                 max_requests_per_second=None):
+
+        if host is None:
+            host = current_app.config.get("STORAGEGRID_HOST")
+        if scheme is None:
+            scheme = current_app.config.get("STORAGEGRID_SCHEME", DEFAULT_SCHEME)
+        if pool_size is None:
+            pool_size = current_app.config.get("STORAGEGRID_POOL_SIZE", DEFAULT_POOL_SIZE)
+        if keep_alive is None:
+            keep_alive = current_app.config.get("STORAGEGRID_KEEP_ALIVE", DEFAULT_KEEP_ALIVE)
+        if connect_timeout is None:
+            connect_timeout = current_app.config.get("STORAGEGRID_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT)
+        if read_timeout is None:
+            read_timeout = current_app.config.get("STORAGEGRID_READ_TIMEOUT", DEFAULT_READ_TIMEOUT)
+        if max_retries is None:
+            max_retries = current_app.config.get("STORAGEGRID_MAX_RETRIES", DEFAULT_MAX_RETRIES)
+        if retry_backoff_factor is None:
+            retry_backoff_factor = current_app.config.get(
+                "STORAGEGRID_RETRY_BACKOFF_FACTOR", DEFAULT_RETRY_BACKOFF_FACTOR)
+        if token_refresh_margin is None:
+            token_refresh_margin = current_app.config.get(
+                "STORAGEGRID_TOKEN_REFRESH_MARGIN", DEFAULT_TOKEN_REFRESH_MARGIN)
+        if max_requests_per_second is None:
+            max_requests_per_second = current_app.config.get(
+                "STORAGEGRID_MAX_REQUESTS_PER_SECOND", None)
+
+        self.host = host
+        self.scheme = scheme
+        self.pool_size = int(pool_size)
+        self.keep_alive = bool(keep_alive)
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = int(max_retries)
+        self.retry_backoff_factor = retry_backoff_factor
+
+        self.session = self._create_session()
+        self.token_cache = TokenCache(refresh_margin=token_refresh_margin)
+        self.rate_limiter = None
+        if max_requests_per_second:
+            self.rate_limiter = RateLimiter(max_requests_per_second)
+
+        logger.debug("%s initialized with host=%s, pool_size=%s, keep_alive=%s, timeout=%s, max_retries=%s",
+                     type(self).__name__, self.host, self.pool_size, self.keep_alive,
+                     self.timeout, self.max_retries)
+
+    def _create_session(self):
+        retry = Retry(
+            total=self.max_retries,
+            allowed_methods=IDEMPOTENT_METHODS,
+            status_forcelist=RETRY_STATUS_CODES,
+            backoff_factor=self.retry_backoff_factor,
+            raise_on_status=False)
+
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_size,
+            max_retries=retry,
+            pool_block=False)
+
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    def url(self, route):
+        """Full URL of an API route, i.e. '/org/users'."""
+        return f'{self.scheme}://{self.host}/api/v3{route}'
+
+    def request(self, method, url, timeout=None, **kwargs):
+        """Send request via pooled session.
+
+        Parameters
+        ----------
+        method: str
+            HTTP method
+        url: str
+            full URL, see StorageGridClient.url
+        timeout: float or (float, float) tuple, default None
+            connect and read timeout in seconds, per default use configured values
+
+        Returns
+        -------
+        requests.Response
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if self.rate_limiter is not None:
+            self.rate_limiter.wait()
+        return self.session.request(method, url, timeout=timeout, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request('PATCH', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def close(self):
+        """Close all pooled connections."""
+        self.session.close()
+
+
+def get_client():
+    """Get the StorageGRID client attached to the current app, create if necessary."""
+    client = current_app.extensions.get('storagegrid_client')
+    if client is None:
+        with _client_lock:
+            client = current_app.extensions.get('storagegrid_client')
+            if client is None:
+                client = StorageGridClient()
+                current_app.extensions['storagegrid_client'] = client
+    return client
+
+
+@instrument('storagegrid.authorize')
 def authorize():
     """Returns a valid token in case of success, otherwise None."""
-    host = current_app.config.get("STORAGEGRID_HOST")
+    client = get_client()
     account_id = current_app.config.get("STORAGEGRID_ACCOUNT_ID")
     username = current_app.config.get("STORAGEGRID_USERNAME")
     password = current_app.config.get("STORAGEGRID_PASSWORD")
 
-    url = f'https://{host}/api/v3/authorize'
+    url = client.url('/authorize')
 
     logger.debug("Authorize via %s", url)
 
@@ -54,7 +323,7 @@ def authorize():
         "csrfToken": False
     }
 
-    response = requests.post(url, json=request_data)
+    response = client.post(url, json=request_data)
     # sample response.json:
     # {
     #     "responseTime": "2022-08-02T22:34:41.141Z",
@@ -73,33 +342,27 @@ def authorize():
         return None
 
 
+@instrument('storagegrid.check_token')
 def check_token(token):
     """Check validity of token for NetApp STorageGRID endpoint.
 
     Parameters
     ----------
-    token: string, default None
-        if None, use cached global token
+    token: string
 
     Returns
     -------
     bool
     """
 
-
-    host = current_app.config.get("STORAGEGRID_HOST")
+    client = get_client()
 
     # use access-restricted config route to check health
-    url = f'https://{host}/api/v3/org/config'
+    url = client.url('/org/config')
 
     logger.debug("Check token via %s", url)
 
-    headers = {
-        "Accept": "application/json",
-        "Authorization": f"Bearer {token}"
-    }
-
-    response = requests.get(url, headers=headers)
+    response = client.get(url, headers=headers(token))
     # sample response:
     # {
     #     'responseTime': '2022-10-23T19:14:21.636Z',
@@ -134,11 +397,94 @@ def check_token(token):
     return response.status_code == 200
 
 
-def headers():
-    global token
-    # get new token if no token cached or token not valid anymore
-    if token is None or not check_token(token):
-        token = authorize()
+@instrument('storagegrid.token_expiry')
+def token_expiry(token):
+    """Query expiry date of token from NetApp StorageGRID endpoint.
+
+    Parameters
+    ----------
+    token: string
+
+    Returns
+    -------
+    datetime.datetime (timezone-aware) or None
+    """
+    client = get_client()
+
+    url = client.url('/org/config')
+
+    logger.debug("Query token expiry via %s", url)
+
+    response = client.get(url, headers=headers(token))
+    if response.status_code != 200:
+        logger.warning("Querying token expiry failed.")
+        return None
+
+    # see check_token for a sample response
+    expires = response.json().get("data", {}).get("token", {}).get("expires", None)
+    if expires is None:
+        logger.warning("Server did not report token expiry.")
+        return None
+
+    return parse_datetime(expires)
+
+
+def parse_datetime(s):
+    """Parse ISO 8601 UTC timestamps as returned by StorageGRID, i.e. '2022-10-24T11:14:21.000Z'."""
+    if s.endswith('Z'):
+        s = s[:-1] + '+00:00'
+    return datetime.datetime.fromisoformat(s)
+
+
+@instrument('storagegrid.refresh_token')
+def refresh_token(stale_token=None):
+    """Authorize anew and cache the token along with its expiry date.
+
+    Parameters
+    ----------
+    stale_token: string, default None
+        token known to be invalid. If another thread has already replaced
+        this token in the meantime, no new authorization happens.
+
+    Returns
+    -------
+    str or None
+    """
+    token_cache = get_client().token_cache
+    with token_cache.lock:
+        cached_token = token_cache.get(count=False)
+        if cached_token is not None and cached_token != stale_token:
+            return cached_token
+
+        new_token = authorize()
+        if new_token is None:
+            token_cache.increment('failures')
+            token_cache.invalidate()
+            return None
+
+        token_cache.set(new_token, token_expiry(new_token))
+        token_cache.increment('refreshes')
+        logger.debug("Cached new token expiring at %s.", token_cache.expires)
+        return new_token
+
+
+def get_token():
+    """Returns cached token, only authorizes anew shortly before expiry."""
+    token = get_client().token_cache.get()
+    if token is None:
+        token = refresh_token()
+    return token
+
+
+def token_stats():
+    """Token cache hit, refresh and failure counters."""
+    return get_client().token_cache.stats()
+
+
+def headers(token=None):
+    """HTTP headers authorized with token, per default the cached token."""
+    if token is None:
+        token = get_token()
     headers = {
         "Accept": "application/json",
         "Authorization": f"Bearer {token}"
@@ -146,6 +492,25 @@ def headers():
     return headers
 
 
+def authorized_request(method, url, **kwargs):
+    """Send authorized request, re-authorize once if the server rejects the token.
+
+    Returns
+    -------
+    requests.Response
+    """
+    client = get_client()
+    token = get_token()
+    response = client.request(method, url, headers=headers(token), **kwargs)
+    if response.status_code == 401:
+        logger.debug("Token rejected, re-authorize.")
+        client.token_cache.increment('rejections')
+        token = refresh_token(stale_token=token)
+        response = client.request(method, url, headers=headers(token), **kwargs)
+    return response
+
+
+@instrument('storagegrid.list_users')
 def list_users(limit=25, **kwargs):
     """List users.
 
@@ -166,15 +531,15 @@ def list_users(limit=25, **kwargs):
     -------
     list of dict or None
     """
-    host = current_app.config.get("STORAGEGRID_HOST")
+    client = get_client()
 
     params = {'limit': limit, **kwargs}
 
-    url = f'https://{host}/api/v3/org/users'
+    url = client.url('/org/users')
 
     logger.debug("List users via %s", url)
 
-    response = requests.get(url, params=params, headers=headers())
+    response = authorized_request('GET', url, params=params)
     response_data = response.json()
     if response_data.get("status") == "success":
         logger.debug("Listing users successful.")
@@ -186,6 +551,66 @@ def list_users(limit=25, **kwargs):
         return None
 
 
+def iter_users(page_size=DEFAULT_PAGE_SIZE, prefetch=True, **kwargs):
+    """Iterate lazily over all users using marker-style pagination.
+
+    While the current page is consumed, the next page is already requested
+    in the background. At most two pages are held in memory at any time.
+
+    Parameters
+    ----------
+    page_size: int
+        number of users requested per page
+    prefetch: bool, default True
+        request next page in the background
+    type: string
+        filter by user type 'local' or 'federated'
+    order: string
+        'asc' or 'desc'
+
+    Yields
+    ------
+    dict
+
+    Raises
+    ------
+    StorageGridError
+        if a page cannot be retrieved
+    """
+    app = current_app._get_current_object()
+
+    def fetch_page(marker):
+        with app.app_context():
+            params = dict(kwargs)
+            if marker is not None:
+                params['marker'] = marker
+            page = list_users(limit=page_size, **params)
+        if page is None:
+            raise StorageGridError(f"Listing users after marker {marker} failed.")
+        return page
+
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    try:
+        next_page = executor.submit(fetch_page, None) if prefetch else None
+        page = next_page.result() if prefetch else fetch_page(None)
+        while len(page) > 0:
+            is_last_page = len(page) < page_size
+            if not is_last_page:
+                marker = page[-1]["userURN"]
+                if prefetch:
+                    next_page = executor.submit(fetch_page, marker)
+
+            yield from page
+
+            if is_last_page:
+                break
+            page = next_page.result() if prefetch else fetch_page(marker)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+@instrument('storagegrid.get_user_by_short_name')
 def get_user_by_short_name(short_name):
     """Get user by short name.
 
@@ -199,13 +624,13 @@ def get_user_by_short_name(short_name):
     dict or None
     """
 
-    host = current_app.config.get("STORAGEGRID_HOST")
+    client = get_client()
 
-    url = f'https://{host}/api/v3/org/users/user/{short_name}'
+    url = client.url(f'/org/users/user/{short_name}')
 
     logger.debug("Query user via %s", url)
 
-    response = requests.get(url, headers=headers())
+    response = authorized_request('GET', url)
     response_data = response.json()
     # sample response:
     # {
@@ -230,6 +655,7 @@ def get_user_by_short_name(short_name):
         return None
 
 
+@instrument('storagegrid.get_user_by_id')
 def get_user_by_id(id):
     """Get user by id.
 
@@ -243,13 +669,13 @@ def get_user_by_id(id):
     dict
     """
 
-    host = current_app.config.get("STORAGEGRID_HOST")
+    client = get_client()
 
-    url = f'https://{host}/api/v3/org/users/{id}'
+    url = client.url(f'/org/users/{id}')
 
     logger.debug("Query user via %s", url)
 
-    response = requests.get(url, headers=headers())
+    response = authorized_request('GET', url)
     response_data = response.json()
     # sample response:
     # {
@@ -274,6 +700,7 @@ def get_user_by_id(id):
         return None
 
 
+@instrument('storagegrid.check_health')
 def check_health():
     """Check health of NetApp STorageGRID endpoint.
 
@@ -282,20 +709,21 @@ def check_health():
     bool
     """
 
-    host = current_app.config.get("STORAGEGRID_HOST")
+    client = get_client()
 
-    url = f'https://{host}/api/v3/versions'
+    url = client.url('/versions')
 
 
     logger.debug("Check health via %s", url)
 
-    response = requests.get(url)
+    response = client.get(url)
     # response_data = response.json()
     # sample response:
     # {'responseTime': '2022-10-23T19:02:50.082Z', 'status': 'success', 'apiVersion': '3.4', 'data': [2, 3]}
     return response.status_code == 200
 
 
+@instrument('storagegrid.create_user')
 def create_user(unique_name, full_name, member_of=None, disable=False):
     """Create new user.
 
@@ -316,9 +744,9 @@ def create_user(unique_name, full_name, member_of=None, disable=False):
     dict or None
     """
 
-    host = current_app.config.get("STORAGEGRID_HOST")
+    client = get_client()
 
-    url = f'https://{host}/api/v3/org/users'
+    url = client.url('/org/users')
 
     request_data = {
         'uniqueName': unique_name,
@@ -331,7 +759,7 @@ def create_user(unique_name, full_name, member_of=None, disable=False):
 
     logger.debug("Create new user via %s", url)
 
-    response = requests.post(url, json=request_data, headers=headers())
+    response = authorized_request('POST', url, json=request_data)
     response_data = response.json()
     # sample response:
     # {
@@ -354,6 +782,65 @@ def create_user(unique_name, full_name, member_of=None, disable=False):
         return None
 
 
+@instrument('storagegrid.update_user')
+def update_user(id, full_name=None, member_of=None, disable=None):
+    """Update user by id.
+
+    Parameters
+    ----------
+    id: string (uuid)
+        user id
+    full_name: string, default: None
+        the human-readable name for the User, unchanged if None
+    member_of: list of strings (uuids), default: None
+        Group memberships for this User, unchanged if None
+    disable: bool, default: None
+        if true, the local User cannot sign in, unchanged if None
+
+    Returns
+    -------
+    dict or None
+
+    Raises
+    ------
+    UserNotFoundError
+        if no user with this id exists
+    """
+
+    client = get_client()
+
+    url = client.url(f'/org/users/{id}')
+
+    request_data = {}
+    if full_name is not None:
+        request_data['fullName'] = full_name
+    if member_of is not None:
+        request_data['memberOf'] = member_of
+    if disable is not None:
+        request_data['disable'] = disable
+
+    logger.debug("Update user via %s", url)
+
+    response = authorized_request('PATCH', url, json=request_data)
+    if response.status_code == 404:
+        raise UserNotFoundError(id)
+    response_data = response.json()
+    if response_data.get("status") == "success":
+        logger.debug("User update successful.")
+        return response_data.get("data", None)
+    else:
+        logger.warning("User update failed.")
+        logger.debug(json.dumps(
+            response_data, indent=4))
+        return None
+
+
+def disable_user(id):
+    """Disable sign-in of local user by id, returns updated user dict or None."""
+    return update_user(id, disable=True)
+
+
+@instrument('storagegrid.delete_user')
 def delete_user(id):
     """Get user by id.
 
@@ -367,16 +854,17 @@ def delete_user(id):
     bool
     """
 
-    host = current_app.config.get("STORAGEGRID_HOST")
+    client = get_client()
 
-    url = f'https://{host}/api/v3/org/users/{id}'
+    url = client.url(f'/org/users/{id}')
 
     logger.debug("Delete user via %s", url)
 
-    response = requests.delete(url, headers=headers())
+    response = authorized_request('DELETE', url)
     return response.status_code == 204
 
 
+@instrument('storagegrid.list_s3_access_keys')
 def list_s3_access_keys(user_id):
     """List s3 access keys for user id.
 
@@ -388,15 +876,22 @@ def list_s3_access_keys(user_id):
     Returns
     -------
     list of dict or None
+
+    Raises
+    ------
+    UserNotFoundError
+        if no user with this id exists
     """
 
-    host = current_app.config.get("STORAGEGRID_HOST")
+    client = get_client()
 
-    url = f'https://{host}/api/v3/org/users/{user_id}/s3-access-keys'
+    url = client.url(f'/org/users/{user_id}/s3-access-keys')
 
     logger.debug("List s3 access keys for user via %s", url)
 
-    response = requests.get(url, headers=headers())
+    response = authorized_request('GET', url)
+    if response.status_code == 404:
+        raise UserNotFoundError(user_id)
     response_data = response.json()
     # sample response:
     # [
@@ -432,11 +927,16 @@ def _create_s3_access_key(user_id, expires):
     Returns
     -------
     dict
+
+    Raises
+    ------
+    UserNotFoundError
+        if no user with this id exists
     """
 
-    host = current_app.config.get("STORAGEGRID_HOST")
+    client = get_client()
 
-    url = f'https://{host}/api/v3/org/users/{user_id}/s3-access-keys'
+    url = client.url(f'/org/users/{user_id}/s3-access-keys')
 
     request_data = {
         'expires': expires
@@ -444,7 +944,9 @@ def _create_s3_access_key(user_id, expires):
 
     logger.debug("Create s3 access keys for user via %s", url)
 
-    response = requests.post(url, json=request_data, headers=headers())
+    response = authorized_request('POST', url, json=request_data)
+    if response.status_code == 404:
+        raise UserNotFoundError(user_id)
     response_data = response.json()
     # sample response:
     #  {
@@ -467,6 +969,7 @@ def _create_s3_access_key(user_id, expires):
         return None
 
 
+@instrument('storagegrid.create_s3_access_key')
 def create_s3_access_key(user_id, timedelta):
     """
     Create s3 access key for user id.
@@ -486,6 +989,7 @@ def create_s3_access_key(user_id, timedelta):
     return _create_s3_access_key(user_id, expiry_date.isoformat())
 
 
+@instrument('storagegrid.delete_s3_access_key')
 def delete_s3_access_key(user_id, access_key):
     """Delete s3 access key by user id and access key
 
@@ -500,11 +1004,11 @@ def delete_s3_access_key(user_id, access_key):
     bool
     """
 
-    host = current_app.config.get("STORAGEGRID_HOST")
+    client = get_client()
 
-    url = f'https://{host}/api/v3/org/users/{user_id}/s3-access-keys/{access_key}'
+    url = client.url(f'/org/users/{user_id}/s3-access-keys/{access_key}')
 
     logger.debug("Delete s3 access key via %s", url)
 
-    response = requests.delete(url, headers=headers())
+    response = authorized_request('DELETE', url)
     return response.status_code == 204
@@ -0,0 +1,337 @@
+#
+# Copyright 2022 Johannes Laurin Hörmann
+#
+# ### MIT license
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+"""Asynchronous NetApp StorageGRID client for concurrent API calls."""
+import asyncio
+import datetime
+import json
+import logging
+
+import aiohttp
+from flask import current_app
+
+import dtool_config_generator.comm.storagegrid as sg
+
+from dtool_config_generator.metrics import instrument
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_MAX_CONCURRENCY = 10
+
+
+class AsyncStorageGridClient():
+    """Asynchronous counterpart to the functions in comm.storagegrid.
+
+    All requests issued within one
+
+        async with AsyncStorageGridClient() as client:
+            ...
+
+    block share one aiohttp connection pool and at most max_concurrency
+    requests are in flight at the same time. The API token and the rate
+    limit are shared with the synchronous client of the current app."""
+
+    def __init__(self,
+                 host=None,
+                 scheme=None,
+                 pool_size=None,
+                 max_concurrency=None,
+                 connect_timeout=None,
+                 read_timeout=None,
+                 token_cache=None,
+                 rate_limiter=None):
+
+        sync_client = sg.get_client()
+
+        if host is None:
+            host = sync_client.host
+        if scheme is None:
+            scheme = sync_client.scheme
+        if pool_size is None:
+            pool_size = sync_client.pool_size
+        if max_concurrency is None:
+            max_concurrency = current_app.config.get(
+                "STORAGEGRID_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)
+        if connect_timeout is None:
+            connect_timeout = sync_client.timeout[0]
+        if read_timeout is None:
+            read_timeout = sync_client.timeout[1]
+        if token_cache is None:
+            token_cache = sync_client.token_cache
+        if rate_limiter is None:
+            rate_limiter = sync_client.rate_limiter
+
+        self.host = host
+        self.scheme = scheme
+        self.pool_size = int(pool_size)
+        self.max_concurrency = int(max_concurrency)
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.token_cache = token_cache
+        self.rate_limiter = rate_limiter
+
+        # credentials are read here, app context may not be available later on
+        self._credentials = {
+            "accountId": current_app.config.get("STORAGEGRID_ACCOUNT_ID"),
+            "username": current_app.config.get("STORAGEGRID_USERNAME"),
+            "password": current_app.config.get("STORAGEGRID_PASSWORD"),
+            "cookie": True,
+            "csrfToken": False
+        }
+
+        self.session = None
+        self._semaphore = None
+        self._token_lock = None
+
+        logger.debug("%s initialized with host=%s, pool_size=%s, max_concurrency=%s",
+                     type(self).__name__, self.host, self.pool_size, self.max_concurrency)
+
+    async def __aenter__(self):
+        # semaphore and lock must be created within the running event loop
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._token_lock = asyncio.Lock()
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.pool_size),
+            timeout=self.timeout)
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            logger.debug("%s: %s", exc_type, exc_value)
+        await self.close()
+        return False
+
+    async def close(self):
+        """Close session if open."""
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+    def url(self, route):
+        """Full URL of an API route, i.e. '/org/users'."""
+        return f'{self.scheme}://{self.host}/api/v3{route}'
+
+    async def _send(self, method, route, token=None, **kwargs):
+        headers = {"Accept": "application/json"}
+        if token is not None:
+            headers["Authorization"] = f"Bearer {token}"
+        async with self._semaphore:
+            if self.rate_limiter is not None:
+                await asyncio.sleep(self.rate_limiter.reserve())
+            async with self.session.request(method, self.url(route), headers=headers, **kwargs) as r:
+                if r.status == 204:
+                    return r.status, None
+                try:
+                    return r.status, await r.json(content_type=None)
+                except (aiohttp.ContentTypeError, json.JSONDecodeError):
+                    return r.status, None
+
+    @instrument('storagegrid_async.authorize')
+    async def authorize(self):
+        """Returns a valid token in case of success, otherwise None."""
+        logger.debug("Authorize via %s", self.url('/authorize'))
+        _, response_data = await self._send('POST', '/authorize', json=self._credentials)
+        if response_data is not None and response_data.get("status") == "success":
+            logger.debug("Authorization successful.")
+            return response_data.get("data", None)
+        logger.warning("Authorization failed.")
+        logger.debug(json.dumps(response_data, indent=4))
+        return None
+
+    @instrument('storagegrid_async.token_expiry')
+    async def token_expiry(self, token):
+        """Query expiry date of token, see comm.storagegrid.token_expiry."""
+        status, response_data = await self._send('GET', '/org/config', token=token)
+        if status != 200 or response_data is None:
+            logger.warning("Querying token expiry failed.")
+            return None
+        expires = response_data.get("data", {}).get("token", {}).get("expires", None)
+        if expires is None:
+            logger.warning("Server did not report token expiry.")
+            return None
+        return sg.parse_datetime(expires)
+
+    @instrument('storagegrid_async.refresh_token')
+    async def refresh_token(self, stale_token=None):
+        """Authorize anew and cache the token, see comm.storagegrid.refresh_token."""
+        async with self._token_lock:
+            cached_token = self.token_cache.get(count=False)
+            if cached_token is not None and cached_token != stale_token:
+                return cached_token
+
+            new_token = await self.authorize()
+            if new_token is None:
+                self.token_cache.increment('failures')
+                self.token_cache.invalidate()
+                return None
+
+            self.token_cache.set(new_token, await self.token_expiry(new_token))
+            self.token_cache.increment('refreshes')
+            return new_token
+
+    async def get_token(self):
+        """Returns cached token, only authorizes anew shortly before expiry."""
+        token = self.token_cache.get()
+        if token is None:
+            token = await self.refresh_token()
+        return token
+
+    async def request(self, method, route, **kwargs):
+        """Send authorized request, re-authorize once if the server rejects the token.
+
+        Parameters
+        ----------
+        method: str
+            HTTP method
+        route: str
+            API route, i.e. '/org/users'
+
+        Returns
+        -------
+        (int, dict or None) tuple
+            HTTP status code and parsed JSON response if any
+        """
+        token = await self.get_token()
+        status, response_data = await self._send(method, route, token=token, **kwargs)
+        if status == 401:
+            logger.debug("Token rejected, re-authorize.")
+            self.token_cache.increment('rejections')
+            token = await self.refresh_token(stale_token=token)
+            status, response_data = await self._send(method, route, token=token, **kwargs)
+        return status, response_data
+
+    async def _request_data(self, method, route, description, not_found=None, **kwargs):
+        status, response_data = await self.request(method, route, **kwargs)
+        if status == 404 and not_found is not None:
+            raise sg.UserNotFoundError(not_found)
+        if response_data is not None and response_data.get("status") == "success":
+            logger.debug("%s successful.", description)
+            return response_data.get("data", None)
+        logger.warning("%s failed.", description)
+        logger.debug(json.dumps(response_data, indent=4))
+        return None
+
+    async def gather(self, *aws):
+        """Await all awaitables concurrently.
+
+        Requests in flight are bounded by max_concurrency. Exceptions are
+        logged and returned in place of the respective results."""
+        results = await asyncio.gather(*aws, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error("Concurrent StorageGRID request failed: %s", result)
+        return results
+
+    @instrument('storagegrid_async.get_user_by_short_name')
+    async def get_user_by_short_name(self, short_name):
+        """Get user by short name, see comm.storagegrid.get_user_by_short_name."""
+        return await self._request_data('GET', f'/org/users/user/{short_name}', "User query")
+
+    @instrument('storagegrid_async.get_user_by_id')
+    async def get_user_by_id(self, id):
+        """Get user by id, see comm.storagegrid.get_user_by_id."""
+        return await self._request_data('GET', f'/org/users/{id}', "User query")
+
+    @instrument('storagegrid_async.create_user')
+    async def create_user(self, unique_name, full_name, member_of=None, disable=False):
+        """Create new user, see comm.storagegrid.create_user."""
+        request_data = {
+            'uniqueName': unique_name,
+            'fullName': full_name
+        }
+        if member_of is not None:
+            request_data['memberOf'] = member_of
+        if disable:
+            request_data['disable'] = True
+        return await self._request_data('POST', '/org/users', "User creation", json=request_data)
+
+    @instrument('storagegrid_async.update_user')
+    async def update_user(self, id, full_name=None, member_of=None, disable=None):
+        """Update user by id, see comm.storagegrid.update_user."""
+        request_data = {}
+        if full_name is not None:
+            request_data['fullName'] = full_name
+        if member_of is not None:
+            request_data['memberOf'] = member_of
+        if disable is not None:
+            request_data['disable'] = disable
+        return await self._request_data(
+            'PATCH', f'/org/users/{id}', "User update", not_found=id, json=request_data)
+
+    async def disable_user(self, id):
+        """Disable sign-in of local user by id, see comm.storagegrid.disable_user."""
+        return await self.update_user(id, disable=True)
+
+    @instrument('storagegrid_async.list_s3_access_keys')
+    async def list_s3_access_keys(self, user_id):
+        """List s3 access keys for user id, see comm.storagegrid.list_s3_access_keys."""
+        return await self._request_data(
+            'GET', f'/org/users/{user_id}/s3-access-keys', "Listing s3 access keys",
+            not_found=user_id)
+
+    @instrument('storagegrid_async.create_s3_access_key')
+    async def create_s3_access_key(self, user_id, timedelta):
+        """Create s3 access key for user id, see comm.storagegrid.create_s3_access_key."""
+        expiry_date = datetime.datetime.now() + timedelta
+        return await self._request_data(
+            'POST', f'/org/users/{user_id}/s3-access-keys', "S3 access key creation",
+            not_found=user_id, json={'expires': expiry_date.isoformat()})
+
+    @instrument('storagegrid_async.delete_s3_access_key')
+    async def delete_s3_access_key(self, user_id, access_key):
+        """Delete s3 access key by user id and access key, see comm.storagegrid.delete_s3_access_key."""
+        status, _ = await self._delete_s3_access_key(user_id, access_key)
+        return status == 204
+
+    async def _delete_s3_access_key(self, user_id, access_key):
+        return await self.request('DELETE', f'/org/users/{user_id}/s3-access-keys/{access_key}')
+
+    @instrument('storagegrid_async.delete_s3_access_keys')
+    async def delete_s3_access_keys(self, user_id, access_keys):
+        """Delete several s3 access keys of a user concurrently.
+
+        Parameters
+        ----------
+        user_id: string (uuid)
+            user id
+        access_keys: list of str
+
+        Returns
+        -------
+        dict
+            lists of access keys 'deleted', 'not_found' and 'failed'
+        """
+        results = await self.gather(
+            *(self._delete_s3_access_key(user_id, access_key) for access_key in access_keys))
+
+        outcome = {"deleted": [], "not_found": [], "failed": []}
+        for access_key, result in zip(access_keys, results):
+            if isinstance(result, Exception):
+                outcome["failed"].append(access_key)
+            elif result[0] == 204:
+                outcome["deleted"].append(access_key)
+            elif result[0] == 404:
+                outcome["not_found"].append(access_key)
+            else:
+                outcome["failed"].append(access_key)
+        return outcome
@@ -35,6 +35,20 @@ class Config():
 
     DTOOL_CONFIG_TEMPLATE = os.path.join(os.path.dirname(__file__), 'templates', 'dtool.json')
     DTOOL_README_TEMPLATE = os.path.join(os.path.dirname(__file__), 'templates', 'dtool_readme.yml')
+    # recompile templates above if modified on disk, otherwise compile only once per process
+    DTOOL_TEMPLATE_AUTO_RELOAD = True
+    # directory for compiled templates shared between processes, per default none
+    DTOOL_TEMPLATE_BYTECODE_CACHE_DIR = None
+    # number of config templates kept pre-rendered per user and template version, without secrets
+    PRERENDER_CACHE_SIZE = 1024
+    # total number of characters of rendered readme templates kept in memory
+    README_CACHE_SIZE = 4 * 1024 * 1024
+    # seconds to wait for each template context provider, i.e. credentials generation
+    TEMPLATE_CONTEXT_PROVIDER_TIMEOUT = 60
+    # max. number of template context providers running concurrently
+    TEMPLATE_CONTEXT_MAX_WORKERS = 4
+    # number of users rendered concurrently for config bundles
+    BUNDLE_MAX_WORKERS = 4
 
     USER_CONFIRMATION_EMAIL_SENDER = 'admin@dtool.config.generator'
     USER_CONFIRMATION_EMAIL_RECIPIENT = 'admin@dtool.config.generator'
@@ -48,15 +62,26 @@ class Config():
     DSERVER_USERNAME = 'testuser'
     DSERVER_PASSWORD = 'test_password'
     DSERVER_VERIFY_SSL = False
+    # seconds to wait for any single lookup server operation
+    DSERVER_REQUEST_TIMEOUT = 60
+    # reuse the lookup server token until this many seconds before it expires
+    DSERVER_TOKEN_REFRESH_MARGIN = 60
+    # max. number of concurrent requests to the lookup server in bulk operations
+    DSERVER_MAX_CONCURRENCY = 10
+    # number of users requested per page when listing all lookup server users
+    DSERVER_PAGE_SIZE = 100
 
     # activating these will create a user and grant default permissions on the
     # lookup server side whenever the admin confirms a user
     DSERVER_REGISTER_USER_ON_CONFIRMATION = False
     DTOOL_LOOKUP_GRANT_DEFAULT_SEARCH_PERMISSIONS_ON_CONFIRMATION = False
     DTOOL_LOOKUP_DEFAULT_SEARCH_PERMISSIONS = ['s3://test-bucket', 'smb://test-share']
+    # grants on confirmation are queued and applied together per base URI after this many seconds
+    DSERVER_GRANT_QUEUE_WINDOW = 0.5
 
     # storagegrid s3 default options
     STORAGEGRID_HOST = 'localhost'
+    STORAGEGRID_SCHEME = 'https'
     STORAGEGRID_ACCOUNT_ID = '123456789'
     STORAGEGRID_USERNAME = 'admin'
     STORAGEGRID_PASSWORD = 'password'
@@ -67,6 +92,34 @@ class Config():
 
     STORAGEGRID_S3_CREDENTIALS_EMBEDDED_IN_CONFIG = False
 
+    # keep issued s3 credentials encrypted with SECRET_KEY and serve them again instead of rotating
+    STORAGEGRID_S3_CREDENTIALS_REUSE = False
+    # seconds after issuing within which stored s3 credentials are served again
+    STORAGEGRID_S3_CREDENTIALS_REUSE_WINDOW = 3600
+    # stored s3 credentials expiring within this many seconds are rotated instead
+    STORAGEGRID_S3_CREDENTIALS_MIN_VALIDITY = 3600
+
+    # storagegrid http connection pool options
+    STORAGEGRID_POOL_SIZE = 10  # max. number of pooled keep-alive connections
+    STORAGEGRID_KEEP_ALIVE = True
+    STORAGEGRID_CONNECT_TIMEOUT = 5  # seconds
+    STORAGEGRID_READ_TIMEOUT = 30  # seconds
+    STORAGEGRID_MAX_RETRIES = 3  # only idempotent requests are retried
+    STORAGEGRID_RETRY_BACKOFF_FACTOR = 0.5
+
+    # max. number of concurrent requests issued by the asynchronous storagegrid client
+    STORAGEGRID_MAX_CONCURRENCY = 10
+
+    # global cap on requests per second to the storagegrid api, None for no limit
+    STORAGEGRID_MAX_REQUESTS_PER_SECOND = None
+
+    # refresh the cached storagegrid api token this many seconds before it expires
+    STORAGEGRID_TOKEN_REFRESH_MARGIN = 60
+
+    # metrics options
+    # bearer token granting access to /config/metrics/prometheus without login, i.e. for scrapers
+    METRICS_BEARER_TOKEN = None
+
     # flask-admin default options
     FLASK_ADMIN_SWATCH = 'cerulean'
 
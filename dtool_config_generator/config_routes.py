@@ -21,14 +21,17 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 #
+import hmac
 import json
 
-from flask import current_app, flash, jsonify, redirect, url_for
-from flask_login import login_required
+from flask import current_app, flash, jsonify, redirect, request, url_for
+from flask_login import current_user, login_required
 from flask_smorest import Blueprint
 
 import dtool_config_generator
+import dtool_config_generator.comm.storagegrid as sg
 
+from dtool_config_generator.metrics import registry
 from dtool_config_generator.utils import admin_required, send_test_mail
 
 bp = Blueprint("config", __name__, url_prefix="/config")
@@ -47,6 +50,7 @@ def to_dict(obj):
     """Convert configuration into dict."""
     exclusions = [
         "JWT_PRIVATE_KEY",
+        "METRICS_BEARER_TOKEN",
     ]  # config keys to exclude
     d = {"version": dtool_config_generator.__version__}
     for k, v in obj.items():
@@ -75,3 +79,39 @@ def test_mail():
     send_test_mail()
     flash("Sent test mail.")
     return redirect(url_for('auth.home'))
+
+
+def has_metrics_bearer_token():
+    """Whether request carries the configured METRICS_BEARER_TOKEN."""
+    metrics_bearer_token = current_app.config.get("METRICS_BEARER_TOKEN", None)
+    if not metrics_bearer_token:
+        return False
+    return hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {metrics_bearer_token}")
+
+
+@bp.route("/metrics", methods=["GET"])
+@login_required
+@admin_required
+def server_metrics():
+    """Return call counts, error counts and latencies of upstream calls as JSON."""
+    metrics = registry.as_dict()
+    metrics["storagegrid_token"] = sg.token_stats()
+    return jsonify(metrics)
+
+
+@bp.route("/metrics/prometheus", methods=["GET"])
+def prometheus_metrics():
+    """Return metrics in Prometheus text format.
+
+    Accessible with the configured METRICS_BEARER_TOKEN or as logged-in admin."""
+    if not has_metrics_bearer_token():
+        if not current_user.is_authenticated or not current_user.is_admin:
+            return current_app.login_manager.unauthorized()
+
+    text = registry.as_prometheus_text()
+    for key, value in sg.token_stats().items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            metric = f"dtool_config_generator_storagegrid_token_{key}_total"
+            text += f"# TYPE {metric} counter\n{metric} {value}\n"
+    return current_app.response_class(text, mimetype="text/plain; version=0.0.4")
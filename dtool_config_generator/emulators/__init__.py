@@ -0,0 +1,73 @@
+#
+# Copyright 2022 Johannes Laurin Hörmann
+#
+# ### MIT license
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+"""In-process stand-ins for the upstream services, for tests and benchmarks."""
+import logging
+import threading
+
+from werkzeug.serving import make_server
+
+
+logger = logging.getLogger(__name__)
+
+
+class EmulatorServer():
+    """Serves a WSGI app from a background thread on localhost.
+
+    Use as context manager:
+
+        with EmulatorServer(app) as server:
+            requests.get(f'http://{server.host}/...')
+    """
+
+    def __init__(self, app, host='127.0.0.1', port=0):
+        self.app = app
+        self._server = make_server(host, port, app, threaded=True)
+        self._thread = None
+
+    @property
+    def host(self):
+        """host:port the server listens on."""
+        return f'{self._server.host}:{self._server.port}'
+
+    @property
+    def url(self):
+        return f'http://{self.host}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        logger.debug("%s serving on %s", type(self).__name__, self.url)
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._thread.join()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
@@ -0,0 +1,406 @@
+#
+# Copyright 2022 Johannes Laurin Hörmann
+#
+# ### MIT license
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+"""Emulated dtool-lookup-server (dserver) and token generator.
+
+Implements the token generator and the /config/info, /users and /base-uris
+routes used by dtool_lookup_api and comm.dtool_lookup_server, with
+configurable latency, error injection and token expiry, i.e.
+
+    from dtool_config_generator.emulators import EmulatorServer
+    from dtool_config_generator.emulators.dtool_lookup_server import create_app
+
+    with EmulatorServer(create_app(latency=0.01)) as server:
+        app.config["DSERVER_URL"] = server.url
+        app.config["DSERVER_TOKEN_GENERATOR_URL"] = f"{server.url}/token"
+        ...
+
+Run standalone with
+
+    python -m dtool_config_generator.emulators.dtool_lookup_server --port 5000
+"""
+import argparse
+import collections
+import functools
+import json
+import logging
+import math
+import random
+import threading
+import time
+import urllib.parse
+
+import jwt
+from flask import Blueprint, Flask, current_app, g, jsonify, request
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_USERNAME = 'testuser'
+DEFAULT_PASSWORD = 'test_password'
+DEFAULT_TOKEN_LIFETIME = 3600  # seconds
+DEFAULT_SECRET = 'dtool-lookup-server-emulator-secret'
+JWT_ALGORITHM = 'HS256'
+
+
+class DtoolLookupServerEmulator():
+    """State and behaviour of an emulated lookup server.
+
+    Parameters
+    ----------
+    username, password: str
+        credentials of the admin user accepted by the token generator
+    latency: float
+        seconds added to every request
+    error_rate: float
+        probability of answering any request with error_status
+    error_status: int
+        HTTP status code of randomly injected errors
+    token_lifetime: float
+        seconds until an issued token expires
+    seed: int, default None
+        seed for random errors
+    secret: str
+        key tokens are signed with
+    """
+
+    def __init__(self,
+                 username=DEFAULT_USERNAME,
+                 password=DEFAULT_PASSWORD,
+                 latency=0.0,
+                 error_rate=0.0,
+                 error_status=503,
+                 token_lifetime=DEFAULT_TOKEN_LIFETIME,
+                 seed=None,
+                 secret=DEFAULT_SECRET):
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.token_lifetime = token_lifetime
+        self.secret = secret
+
+        self.lock = threading.RLock()
+        self.users = {}  # username: user dict
+        self.base_uris = {}  # base URI: permissions dict
+        self.request_counts = collections.Counter()  # endpoint: number of requests
+        self.tokens_valid_after = 0  # tokens issued before are rejected
+
+        self._random = random.Random(seed)
+        self._injected_errors = collections.deque()
+
+        self.add_user(username, is_admin=True)
+
+    def add_user(self, username, is_admin=False):
+        """Add user directly, returns user dict."""
+        with self.lock:
+            user = {"username": username, "is_admin": is_admin}
+            self.users[username] = user
+        return dict(user)
+
+    def add_base_uri(self, base_uri, users_with_search_permissions=None, users_with_register_permissions=None):
+        """Add base URI directly, returns permissions dict."""
+        with self.lock:
+            base_uri_info = {
+                "base_uri": base_uri,
+                "users_with_search_permissions": list(users_with_search_permissions or []),
+                "users_with_register_permissions": list(users_with_register_permissions or []),
+            }
+            self.base_uris[base_uri] = base_uri_info
+        return dict(base_uri_info)
+
+    def issue_token(self, username):
+        now = time.time()
+        return jwt.encode(
+            {"sub": username, "iat": now, "exp": int(now + self.token_lifetime)},
+            self.secret, algorithm=JWT_ALGORITHM)
+
+    def identity(self, token):
+        """Username the token was issued to, raises jwt.PyJWTError if invalid."""
+        claims = jwt.decode(token, self.secret, algorithms=[JWT_ALGORITHM])
+        if claims.get("iat", 0) < self.tokens_valid_after:
+            raise jwt.ExpiredSignatureError("Token has been revoked")
+        return claims["sub"]
+
+    def expire_tokens(self):
+        """Invalidate all issued tokens."""
+        with self.lock:
+            self.tokens_valid_after = time.time()
+
+    def fail_next(self, n=1, status=503):
+        """Answer the next n requests with status."""
+        with self.lock:
+            self._injected_errors.extend([status] * n)
+
+    def next_error(self):
+        """Status code of an error to inject into the current request or None."""
+        with self.lock:
+            if len(self._injected_errors) > 0:
+                return self._injected_errors.popleft()
+            if self.error_rate > 0 and self._random.random() < self.error_rate:
+                return self.error_status
+        return None
+
+    def count(self, endpoint):
+        with self.lock:
+            self.request_counts[endpoint] += 1
+
+
+def _emulator():
+    return current_app.emulator
+
+
+def _error(status_code, status):
+    """Error response as rendered by flask-smorest."""
+    return jsonify(code=status_code, status=status), status_code
+
+
+def _jwt_error(message):
+    """Error response as rendered by flask-jwt-extended."""
+    return jsonify(msg=message), 401
+
+
+def _paginated(items, sort_key):
+    page = request.args.get("page", 1, type=int)
+    page_size = request.args.get("page_size", 10, type=int)
+    sort = request.args.get("sort", sort_key)
+    descending = sort.startswith('-')
+
+    items = sorted(items, key=lambda item: item[sort_key], reverse=descending)
+    last_page = max(1, math.ceil(len(items) / page_size))
+    response = jsonify(items[(page - 1) * page_size:page * page_size])
+    pagination = {
+        "total": len(items),
+        "total_pages": last_page,
+        "first_page": 1,
+        "last_page": last_page,
+        "page": page,
+    }
+    if page > 1:
+        pagination["previous_page"] = page - 1
+    if page < last_page:
+        pagination["next_page"] = page + 1
+    response.headers["X-Pagination"] = json.dumps(pagination)
+    response.headers["X-Sort"] = json.dumps({"sort": {sort_key: -1 if descending else 1}})
+    return response
+
+
+def jwt_required(admin=False):
+    """Answer 401 unless request carries a valid token, 403 if admin required but user is none."""
+    def decorator(f):
+        @functools.wraps(f)
+        def decorated(*args, **kwargs):
+            emulator = _emulator()
+            authorization = request.headers.get("Authorization", "")
+            if not authorization.startswith("Bearer "):
+                return _jwt_error("Missing Authorization Header")
+            try:
+                username = emulator.identity(authorization[len("Bearer "):])
+            except jwt.ExpiredSignatureError:
+                return _jwt_error("Token has expired")
+            except jwt.PyJWTError:
+                return _jwt_error("Signature verification failed")
+            user = emulator.users.get(username, None)
+            if user is None or (admin and not user["is_admin"]):
+                return _error(403, "Forbidden")
+            g.username = username
+            return f(*args, **kwargs)
+        return decorated
+    return decorator
+
+
+bp = Blueprint("dtool_lookup_server", __name__)
+
+
+@bp.before_app_request
+def emulate_conditions():
+    emulator = _emulator()
+    emulator.count(request.endpoint)
+    if emulator.latency > 0:
+        time.sleep(emulator.latency)
+    status_code = emulator.next_error()
+    if status_code is not None:
+        logger.debug("Inject error %s into %s %s", status_code, request.method, request.path)
+        return _error(status_code, "Injected error")
+    return None
+
+
+@bp.route("/token", methods=["POST"])
+def token():
+    emulator = _emulator()
+    request_data = request.get_json(silent=True) or {}
+    if request_data.get("username") != emulator.username or request_data.get("password") != emulator.password:
+        return jsonify(error="Authentication failed"), 401
+    return jsonify(token=emulator.issue_token(emulator.username))
+
+
+@bp.route("/config/info", methods=["GET"])
+@jwt_required()
+def config_info():
+    return jsonify(config={"version": "emulated", "jsonify_prettyprint_regular": True})
+
+
+@bp.route("/config/versions", methods=["GET"])
+@jwt_required()
+def config_versions():
+    return jsonify(versions={"dserver": "emulated"})
+
+
+@bp.route("/me", methods=["GET"])
+@jwt_required()
+def me():
+    return jsonify(_emulator().users[g.username])
+
+
+@bp.route("/users", methods=["GET"])
+@jwt_required(admin=True)
+def list_users():
+    emulator = _emulator()
+    with emulator.lock:
+        users = [dict(user) for user in emulator.users.values()]
+    return _paginated(users, "username")
+
+
+@bp.route("/users/<username>", methods=["GET"])
+@jwt_required(admin=True)
+def get_user(username):
+    user = _emulator().users.get(urllib.parse.unquote_plus(username), None)
+    if user is None:
+        return _error(404, "Not Found")
+    return jsonify(user)
+
+
+@bp.route("/users/<username>", methods=["PUT"])
+@jwt_required(admin=True)
+def put_user(username):
+    emulator = _emulator()
+    username = urllib.parse.unquote_plus(username)
+    request_data = request.get_json(silent=True) or {}
+    with emulator.lock:
+        exists = username in emulator.users
+        emulator.add_user(username, is_admin=request_data.get("is_admin", False))
+    return "", 200 if exists else 201
+
+
+@bp.route("/users/<username>", methods=["DELETE"])
+@jwt_required(admin=True)
+def delete_user(username):
+    emulator = _emulator()
+    with emulator.lock:
+        if emulator.users.pop(urllib.parse.unquote_plus(username), None) is None:
+            return _error(404, "Not Found")
+    return "", 200
+
+
+@bp.route("/base-uris", methods=["GET"])
+@jwt_required(admin=True)
+def list_base_uris():
+    emulator = _emulator()
+    with emulator.lock:
+        base_uris = [dict(base_uri_info) for base_uri_info in emulator.base_uris.values()]
+    return _paginated(base_uris, "base_uri")
+
+
+@bp.route("/base-uris/<path:base_uri>", methods=["GET"])
+@jwt_required(admin=True)
+def get_base_uri(base_uri):
+    base_uri_info = _emulator().base_uris.get(urllib.parse.unquote_plus(base_uri), None)
+    if base_uri_info is None:
+        return _error(404, "Not Found")
+    return jsonify(base_uri_info)
+
+
+@bp.route("/base-uris/<path:base_uri>", methods=["PUT"])
+@jwt_required(admin=True)
+def put_base_uri(base_uri):
+    emulator = _emulator()
+    base_uri = urllib.parse.unquote_plus(base_uri)
+    request_data = request.get_json(silent=True) or {}
+    with emulator.lock:
+        exists = base_uri in emulator.base_uris
+        emulator.add_base_uri(
+            base_uri,
+            users_with_search_permissions=request_data.get("users_with_search_permissions", []),
+            users_with_register_permissions=request_data.get("users_with_register_permissions", []))
+    return "", 200 if exists else 201
+
+
+@bp.route("/base-uris/<path:base_uri>", methods=["DELETE"])
+@jwt_required(admin=True)
+def delete_base_uri(base_uri):
+    emulator = _emulator()
+    with emulator.lock:
+        if emulator.base_uris.pop(urllib.parse.unquote_plus(base_uri), None) is None:
+            return _error(404, "Not Found")
+    return "", 200
+
+
+def create_app(emulator=None, **kwargs):
+    """Create emulator WSGI app.
+
+    Parameters
+    ----------
+    emulator: DtoolLookupServerEmulator, default None
+        emulator state, per default created with kwargs
+    **kwargs:
+        passed on to DtoolLookupServerEmulator
+
+    Returns
+    -------
+    flask.Flask
+        app with DtoolLookupServerEmulator attached as app.emulator
+    """
+    if emulator is None:
+        emulator = DtoolLookupServerEmulator(**kwargs)
+    app = Flask(__name__)
+    app.emulator = emulator
+    app.register_blueprint(bp)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="probability of injected errors")
+    parser.add_argument('--token-lifetime', type=float, default=DEFAULT_TOKEN_LIFETIME, help="seconds")
+    parser.add_argument('--users', type=int, default=0, help="number of users to create initially")
+    parser.add_argument('--base-uri', action='append', default=[], help="base URI to create initially")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    app = create_app(latency=args.latency, error_rate=args.error_rate,
+                     token_lifetime=args.token_lifetime, seed=args.seed)
+    for i in range(args.users):
+        app.emulator.add_user(f'user-{i:06d}')
+    for base_uri in args.base_uri:
+        app.emulator.add_base_uri(base_uri)
+
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
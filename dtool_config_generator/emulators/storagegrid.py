@@ -0,0 +1,474 @@
+#
+# Copyright 2022 Johannes Laurin Hörmann
+#
+# ### MIT license
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+"""Emulated NetApp StorageGRID tenant management API.
+
+Implements the subset of the /api/v3 routes used by comm.storagegrid and
+comm.storagegrid_async, with configurable latency, error injection and
+token expiry, i.e.
+
+    from dtool_config_generator.emulators import EmulatorServer
+    from dtool_config_generator.emulators.storagegrid import create_app
+
+    with EmulatorServer(create_app(latency=0.01)) as server:
+        app.config["STORAGEGRID_HOST"] = server.host
+        app.config["STORAGEGRID_SCHEME"] = "http"
+        ...
+
+Run standalone with
+
+    python -m dtool_config_generator.emulators.storagegrid --port 8443
+"""
+import argparse
+import collections
+import datetime
+import functools
+import logging
+import random
+import secrets
+import threading
+import time
+import uuid
+
+from flask import Blueprint, Flask, current_app, jsonify, request
+
+
+logger = logging.getLogger(__name__)
+
+
+API_VERSION = "3.4"
+
+DEFAULT_ACCOUNT_ID = '123456789'
+DEFAULT_USERNAME = 'admin'
+DEFAULT_PASSWORD = 'password'
+DEFAULT_TOKEN_LIFETIME = 16 * 3600  # seconds
+DEFAULT_LIST_LIMIT = 25
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _isoformat(dt):
+    """Format as StorageGRID does, i.e. '2022-10-24T11:14:21.000Z'."""
+    return dt.astimezone(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.') + f'{dt.microsecond // 1000:03d}Z'
+
+
+class StorageGridEmulator():
+    """State and behaviour of an emulated StorageGRID tenant.
+
+    Parameters
+    ----------
+    account_id, username, password: str
+        credentials accepted by /authorize
+    latency: float
+        seconds added to every request
+    error_rate: float
+        probability of answering any request with error_status
+    error_status: int
+        HTTP status code of randomly injected errors
+    token_lifetime: float
+        seconds until an issued token expires
+    seed: int, default None
+        seed for random errors and generated ids
+    """
+
+    def __init__(self,
+                 account_id=DEFAULT_ACCOUNT_ID,
+                 username=DEFAULT_USERNAME,
+                 password=DEFAULT_PASSWORD,
+                 latency=0.0,
+                 error_rate=0.0,
+                 error_status=503,
+                 token_lifetime=DEFAULT_TOKEN_LIFETIME,
+                 seed=None):
+        self.account_id = account_id
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.token_lifetime = token_lifetime
+
+        self.lock = threading.RLock()
+        self.users = {}  # user id: user dict
+        self.s3_access_keys = {}  # user id: {key id: key dict}
+        self.tokens = {}  # token: expiry date
+        self.request_counts = collections.Counter()  # endpoint: number of requests
+
+        self._random = random.Random(seed)
+        self._injected_errors = collections.deque()
+
+    def _uuid(self):
+        return str(uuid.UUID(int=self._random.getrandbits(128), version=4))
+
+    def add_user(self, short_name, full_name=None, member_of=None, disable=False, federated=False):
+        """Add user directly, returns user dict."""
+        prefix = 'federated-user' if federated else 'user'
+        with self.lock:
+            user_id = self._uuid()
+            user = {
+                "id": user_id,
+                "accountId": self.account_id,
+                "fullName": full_name if full_name is not None else short_name,
+                "uniqueName": f'{prefix}/{short_name}',
+                "userURN": f'urn:sgws:identity::{self.account_id}:{prefix}/{short_name}',
+                "federated": federated,
+                "memberOf": member_of,
+                "disable": disable
+            }
+            self.users[user_id] = user
+            self.s3_access_keys[user_id] = {}
+        return dict(user)
+
+    def get_user_by_unique_name(self, unique_name):
+        with self.lock:
+            for user in self.users.values():
+                if user["uniqueName"] == unique_name:
+                    return user
+        return None
+
+    def add_s3_access_key(self, user_id, expires=None):
+        """Add s3 access key directly, returns key dict including secret."""
+        with self.lock:
+            user = self.users[user_id]
+            access_key = ''.join(self._random.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789') for _ in range(20))
+            s3_access_key = {
+                "id": 'SGKH' + self._uuid().replace('-', ''),
+                "accountId": self.account_id,
+                "displayName": '*' * 16 + access_key[-4:],
+                "userURN": user["userURN"],
+                "userUUID": user_id,
+                "expires": expires,
+                "accessKey": access_key,
+                "secretAccessKey": self._uuid().replace('-', '') + self._uuid().replace('-', '')[:8],
+            }
+            self.s3_access_keys[user_id][s3_access_key["id"]] = s3_access_key
+        return dict(s3_access_key)
+
+    def issue_token(self):
+        with self.lock:
+            token = secrets.token_hex(16)
+            self.tokens[token] = _now() + datetime.timedelta(seconds=self.token_lifetime)
+        return token
+
+    def token_expiry(self, token):
+        """Expiry date of token if valid, otherwise None."""
+        with self.lock:
+            expires = self.tokens.get(token, None)
+        if expires is None or expires <= _now():
+            return None
+        return expires
+
+    def expire_tokens(self):
+        """Invalidate all issued tokens."""
+        with self.lock:
+            self.tokens.clear()
+
+    def fail_next(self, n=1, status=503, endpoint=None):
+        """Answer the next n requests with status.
+
+        Only requests to endpoint, i.e. 'storagegrid.create_s3_access_key', if given."""
+        with self.lock:
+            self._injected_errors.extend([(endpoint, status)] * n)
+
+    def next_error(self, endpoint=None):
+        """Status code of an error to inject into the current request to endpoint or None."""
+        with self.lock:
+            for injected_endpoint, status in self._injected_errors:
+                if injected_endpoint is None or injected_endpoint == endpoint:
+                    self._injected_errors.remove((injected_endpoint, status))
+                    return status
+            if self.error_rate > 0 and self._random.random() < self.error_rate:
+                return self.error_status
+        return None
+
+    def count(self, endpoint):
+        with self.lock:
+            self.request_counts[endpoint] += 1
+
+
+def _emulator():
+    return current_app.emulator
+
+
+def _response(status, data=None, status_code=200):
+    response_data = {
+        "responseTime": _isoformat(_now()),
+        "status": status,
+        "apiVersion": API_VERSION,
+    }
+    if status == "success":
+        response_data["data"] = data
+    else:
+        response_data["code"] = status_code
+        response_data["message"] = {"text": data, "key": data}
+    return jsonify(response_data), status_code
+
+
+def _success(data, status_code=200):
+    return _response("success", data, status_code)
+
+
+def _error(status_code, text):
+    return _response("error", text, status_code)
+
+
+def _public_s3_access_key(s3_access_key):
+    return {k: v for k, v in s3_access_key.items() if k not in ("accessKey", "secretAccessKey")}
+
+
+def authorized(f):
+    """Answer 401 unless request carries a valid bearer token."""
+    @functools.wraps(f)
+    def decorated(*args, **kwargs):
+        authorization = request.headers.get("Authorization", "")
+        token = authorization[len("Bearer "):] if authorization.startswith("Bearer ") else None
+        if token is None or _emulator().token_expiry(token) is None:
+            return _error(401, "Unauthorized")
+        return f(*args, **kwargs)
+    return decorated
+
+
+bp = Blueprint("storagegrid", __name__, url_prefix="/api/v3")
+
+
+@bp.before_app_request
+def emulate_conditions():
+    emulator = _emulator()
+    emulator.count(request.endpoint)
+    if emulator.latency > 0:
+        time.sleep(emulator.latency)
+    status_code = emulator.next_error(request.endpoint)
+    if status_code is not None:
+        logger.debug("Inject error %s into %s %s", status_code, request.method, request.path)
+        return _error(status_code, "Injected error")
+    return None
+
+
+@bp.route("/versions", methods=["GET"])
+def versions():
+    return _success([2, 3])
+
+
+@bp.route("/authorize", methods=["POST"])
+def authorize():
+    emulator = _emulator()
+    request_data = request.get_json(silent=True) or {}
+    if (str(request_data.get("accountId")) != str(emulator.account_id)
+            or request_data.get("username") != emulator.username
+            or request_data.get("password") != emulator.password):
+        return _error(401, "Invalid credentials")
+    return _success(emulator.issue_token())
+
+
+@bp.route("/org/config", methods=["GET"])
+@authorized
+def org_config():
+    emulator = _emulator()
+    token = request.headers["Authorization"][len("Bearer "):]
+    return _success({
+        "auto-logout": 900,
+        "user": {
+            "id": "00000000-0000-0000-0000-000000000000",
+            "username": emulator.username,
+            "uniqueName": f"user/{emulator.username}",
+            "fullName": emulator.username,
+            "federated": False
+        },
+        "token": {"expires": _isoformat(emulator.token_expiry(token))},
+        "permissions": {"rootAccess": True},
+        "deactivatedFeatures": {},
+        "account": {
+            "id": emulator.account_id,
+            "name": "emulated-tenant",
+            "capabilities": ["management", "s3"],
+        },
+        "restrictedPort": False
+    })
+
+
+@bp.route("/org/users", methods=["GET"])
+@authorized
+def list_users():
+    emulator = _emulator()
+    limit = request.args.get("limit", DEFAULT_LIST_LIMIT, type=int)
+    marker = request.args.get("marker", None)
+    include_marker = request.args.get("includeMarker", "false").lower() == "true"
+    user_type = request.args.get("type", None)
+    descending = request.args.get("order", "asc") == "desc"
+
+    with emulator.lock:
+        users = sorted(emulator.users.values(), key=lambda user: user["userURN"], reverse=descending)
+    if user_type is not None:
+        users = [user for user in users if user["federated"] == (user_type == "federated")]
+    if marker is not None:
+        urns = [user["userURN"] for user in users]
+        if marker not in urns:
+            return _error(400, "Invalid marker")
+        start = urns.index(marker)
+        users = users[start if include_marker else start + 1:]
+    return _success(users[:limit])
+
+
+@bp.route("/org/users", methods=["POST"])
+@authorized
+def create_user():
+    emulator = _emulator()
+    request_data = request.get_json(silent=True) or {}
+    unique_name = request_data.get("uniqueName", "")
+    prefix, _, short_name = unique_name.partition('/')
+    if prefix not in ("user", "federated-user") or short_name == "" or "fullName" not in request_data:
+        return _error(422, "Invalid user")
+    if emulator.get_user_by_unique_name(unique_name) is not None:
+        return _error(409, "User exists")
+    user = emulator.add_user(
+        short_name, full_name=request_data["fullName"],
+        member_of=request_data.get("memberOf", None),
+        disable=request_data.get("disable", False),
+        federated=(prefix == "federated-user"))
+    return _success(user, 201)
+
+
+@bp.route("/org/users/user/<short_name>", methods=["GET"])
+@authorized
+def get_user_by_short_name(short_name):
+    user = _emulator().get_user_by_unique_name(f'user/{short_name}')
+    if user is None:
+        return _error(404, "User not found")
+    return _success(user)
+
+
+@bp.route("/org/users/<user_id>", methods=["GET"])
+@authorized
+def get_user_by_id(user_id):
+    user = _emulator().users.get(user_id, None)
+    if user is None:
+        return _error(404, "User not found")
+    return _success(user)
+
+
+@bp.route("/org/users/<user_id>", methods=["PATCH"])
+@authorized
+def update_user(user_id):
+    emulator = _emulator()
+    request_data = request.get_json(silent=True) or {}
+    with emulator.lock:
+        user = emulator.users.get(user_id, None)
+        if user is None:
+            return _error(404, "User not found")
+        for key in ("fullName", "memberOf", "disable"):
+            if key in request_data:
+                user[key] = request_data[key]
+        return _success(dict(user))
+
+
+@bp.route("/org/users/<user_id>", methods=["DELETE"])
+@authorized
+def delete_user(user_id):
+    emulator = _emulator()
+    with emulator.lock:
+        if emulator.users.pop(user_id, None) is None:
+            return _error(404, "User not found")
+        emulator.s3_access_keys.pop(user_id, None)
+    return "", 204
+
+
+@bp.route("/org/users/<user_id>/s3-access-keys", methods=["GET"])
+@authorized
+def list_s3_access_keys(user_id):
+    emulator = _emulator()
+    with emulator.lock:
+        if user_id not in emulator.users:
+            return _error(404, "User not found")
+        s3_access_keys = [_public_s3_access_key(s3_access_key)
+                          for s3_access_key in emulator.s3_access_keys[user_id].values()]
+    return _success(s3_access_keys)
+
+
+@bp.route("/org/users/<user_id>/s3-access-keys", methods=["POST"])
+@authorized
+def create_s3_access_key(user_id):
+    emulator = _emulator()
+    request_data = request.get_json(silent=True) or {}
+    if user_id not in emulator.users:
+        return _error(404, "User not found")
+    return _success(emulator.add_s3_access_key(user_id, expires=request_data.get("expires", None)), 201)
+
+
+@bp.route("/org/users/<user_id>/s3-access-keys/<access_key>", methods=["DELETE"])
+@authorized
+def delete_s3_access_key(user_id, access_key):
+    emulator = _emulator()
+    with emulator.lock:
+        if user_id not in emulator.users:
+            return _error(404, "User not found")
+        if emulator.s3_access_keys[user_id].pop(access_key, None) is None:
+            return _error(404, "Access key not found")
+    return "", 204
+
+
+def create_app(emulator=None, **kwargs):
+    """Create emulator WSGI app.
+
+    Parameters
+    ----------
+    emulator: StorageGridEmulator, default None
+        emulator state, per default created with kwargs
+    **kwargs:
+        passed on to StorageGridEmulator
+
+    Returns
+    -------
+    flask.Flask
+        app with StorageGridEmulator attached as app.emulator
+    """
+    if emulator is None:
+        emulator = StorageGridEmulator(**kwargs)
+    app = Flask(__name__)
+    app.emulator = emulator
+    app.register_blueprint(bp)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8443)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="probability of injected errors")
+    parser.add_argument('--token-lifetime', type=float, default=DEFAULT_TOKEN_LIFETIME, help="seconds")
+    parser.add_argument('--users', type=int, default=0, help="number of users to create initially")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    app = create_app(latency=args.latency, error_rate=args.error_rate,
+                     token_lifetime=args.token_lifetime, seed=args.seed)
+    for i in range(args.users):
+        app.emulator.add_user(f'user-{i:06d}', full_name=f'User {i}')
+
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
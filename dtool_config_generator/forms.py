@@ -22,12 +22,13 @@
 # SOFTWARE.
 #
 from flask_wtf import FlaskForm
-from wtforms import StringField
+from wtforms import BooleanField, StringField
 from wtforms.validators import DataRequired
 
 
 class ConfirmationForm(FlaskForm):
-    pass
+    # only offered if issued credentials are reused
+    rotate = BooleanField('Issue new access credentials, invalidating previous ones')
 
 
 class ProfileForm(FlaskForm):
@@ -22,17 +22,19 @@
 # SOFTWARE.
 #
 """Routes for generating dtool config and readme template files."""
-import os.path
 import logging
 
-from flask import current_app, flash, render_template, stream_with_context
+from flask import current_app, flash, render_template, request, stream_with_context
 from flask_login import login_required, current_user
-from flask_smorest import Blueprint
-
-from jinja2 import Environment, FileSystemLoader
+from flask_smorest import Blueprint, abort
 
+from dtool_config_generator.bundle import ARCHIVE_FORMATS, generate_bundle
 from dtool_config_generator.forms import ConfirmationForm
-from dtool_config_generator.utils import confirmation_required
+from dtool_config_generator.metrics import registry, timer
+from dtool_config_generator.rendering import (
+    config_template, readme_etag, readme_template, render_config, render_readme, template_variables)
+from dtool_config_generator.utils import admin_required, confirmation_required
+from dtool_config_generator.vault import discard_credentials, reuse_enabled
 
 
 logger = logging.getLogger(__name__)
@@ -41,50 +43,23 @@ logger = logging.getLogger(__name__)
 bp = Blueprint("generate", __name__, template_folder='templates', url_prefix="/generate")
 
 
-@stream_with_context
-def stream_config_template(**context):
-    if 'DTOOL_CONFIG_TEMPLATE' in current_app.config:
-        dtool_config_template = current_app.config['DTOOL_CONFIG_TEMPLATE']
-        logger.debug("Use DTOOL_CONFIG_TEMPLATE=%s", dtool_config_template)
-        template_dir = os.path.dirname(dtool_config_template)
-        template_name = os.path.basename(dtool_config_template)
-
-        env = Environment(loader=FileSystemLoader(template_dir))
-        t = env.get_template(template_name)
-    else:
-        logger.debug("Use default template directory")
-        current_app.update_template_context(context)
-        t = current_app.jinja_env.get_template('dtool.json')
-
-    logger.debug("Render with context %s", context)
-    rv = t.stream(**context)
-    rv.enable_buffering(5)
-    return rv
-
-
-@stream_with_context
-def stream_readme_template(**context):
-    if 'DTOOL_README_TEMPLATE' in current_app.config:
-        template_dir = os.path.dirname(current_app.config['DTOOL_README_TEMPLATE'])
-        template_name = os.path.basename(current_app.config['DTOOL_README_TEMPLATE'])
-
-        env = Environment(loader=FileSystemLoader(template_dir))
-        t = env.get_template(template_name)
-    else:
-        current_app.update_template_context(**context)
-        t = current_app.jinja_env.get_template('dtool_readme.yml')
-
-    rv = t.stream(**context)
-    rv.enable_buffering(5)
-    return rv
+def generate_config(rotate=False):
+    """Returns filled-out config template.
 
-
-def generate_config():
-    """Streams back filled-out config template."""
+    Credentials stored for reuse are discarded beforehand if rotate."""
     logger.debug("Generate config for %s", current_user.username)
-    extended_context = current_app.template_context_builder.run()
+    if rotate:
+        discard_credentials([current_user.id])
+    template = config_template()
+    with timer('context.build'):
+        # only run providers for variables the template actually uses
+        extended_context = current_app.template_context_builder.run(
+            current_user._get_current_object(), names=template_variables(template))
+    with timer('render.config'):
+        # static parts are pre-rendered per user and template version
+        rendered = render_config(template, current_user._get_current_object(), extended_context)
     return current_app.response_class(
-        stream_config_template(user=current_user, **extended_context),
+        rendered,
         mimetype='application/json',
         headers={"Content-Disposition": "attachment;filename=dtool.json"}
     )
@@ -96,26 +71,79 @@ def generate_config():
 def config():
     """Generate dtool config for user."""
     form = ConfirmationForm()
+    reuse_credentials = reuse_enabled()
 
     if form.validate_on_submit():
-        return generate_config()
-
-    flash("""
-        The generated dool.json config file will contain
-        storage infrastructure access
-        credentials. Don't lose it, keep it safe.
-        Regenerating a config file will invalidate all
-        previously issued access credentials.""")
-    return render_template('generate/confirm.html', form=form)
+        return generate_config(rotate=reuse_credentials and form.rotate.data)
+
+    if reuse_credentials:
+        flash("""
+            The generated dool.json config file will contain
+            storage infrastructure access
+            credentials. Don't lose it, keep it safe.
+            Recently issued access credentials are reused,
+            unless you request new ones, which will invalidate
+            all previously issued access credentials.""")
+    else:
+        flash("""
+            The generated dool.json config file will contain
+            storage infrastructure access
+            credentials. Don't lose it, keep it safe.
+            Regenerating a config file will invalidate all
+            previously issued access credentials.""")
+    return render_template('generate/confirm.html', form=form, reuse_credentials=reuse_credentials)
 
 
 @bp.route("/readme", methods=["GET"])
 @login_required
 @confirmation_required
 def readme():
-    """Generate dtool readme template for user."""
+    """Generate dtool readme template for user.
+
+    Answers If-None-Match with 304 Not Modified as long as neither the
+    template nor the user's profile changed."""
+    template = readme_template()
+    user = current_user._get_current_object()
+    etag = readme_etag(template, user)
+    if etag is not None and request.if_none_match.contains_weak(etag):
+        registry.increment('render.readme.not_modified')
+        response = current_app.response_class(status=304)
+    else:
+        with timer('render.readme'):
+            rendered = render_readme(template, user, etag)
+        response = current_app.response_class(
+            rendered,
+            mimetype='application/yaml',
+            headers={"Content-Disposition": "attachment;filename=dtool_readme.yml"}
+        )
+
+    if etag is not None:
+        # per-user content, clients must revalidate
+        response.set_etag(etag)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    return response
+
+
+@bp.route("/bundle", methods=["POST"])
+@login_required
+@admin_required
+def bundle():
+    """Stream archive with dtool configs and readme templates for many users.
+
+    Expects JSON {"usernames": [...], "format": "zip" or "tar.gz"}.
+    Credentials embedded in the configs are issued anew."""
+    request_data = request.get_json(silent=True) or {}
+    usernames = request_data.get("usernames", None)
+    archive_format = request_data.get("format", "zip")
+    if not isinstance(usernames, list) or len(usernames) == 0:
+        abort(400, message="Provide list of 'usernames'.")
+    if archive_format not in ARCHIVE_FORMATS:
+        abort(400, message=f"'format' must be one of {list(ARCHIVE_FORMATS)}.")
+
+    logger.debug("Generate bundle for %d users", len(usernames))
     return current_app.response_class(
-        stream_readme_template(user=current_user),
-        mimetype='application/yaml',
-        headers={"Content-Disposition": "attachment;filename=dtool_readme.yml"}
+        stream_with_context(generate_bundle(usernames, archive_format)),
+        mimetype=ARCHIVE_FORMATS[archive_format],
+        headers={"Content-Disposition": f"attachment;filename=dtool-bundle.{archive_format}"}
     )
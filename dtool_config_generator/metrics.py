@@ -0,0 +1,272 @@
+#
+# Copyright 2022 Johannes Laurin Hörmann
+#
+# ### MIT license
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+"""Call counts, error counts and latency histograms of upstream calls.
+
+Wrap functions with
+
+    @instrument('storagegrid.list_users')
+    def list_users(...):
+        ...
+
+or time arbitrary blocks with
+
+    with timer('render.config'):
+        ...
+
+Metrics are collected process-wide within the default registry and exposed
+via the config blueprint as JSON and in Prometheus text format."""
+import asyncio
+import bisect
+import contextlib
+import functools
+import logging
+import math
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+# latency histogram bucket upper bounds in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# outcomes of an instrumented call
+SUCCESS = "success"
+FAILURE = "failure"  # call returned None or False, the convention for failure within comm
+ERROR = "error"  # call raised an exception
+
+OUTCOMES = (SUCCESS, FAILURE, ERROR)
+
+PROMETHEUS_PREFIX = "dtool_config_generator"
+
+
+class Histogram():
+    """Cumulative latency histogram with fixed buckets."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def cumulative_counts(self):
+        """(upper bound, number of observations <= upper bound) tuples."""
+        cumulative = 0
+        for upper_bound, count in zip(self.buckets + (math.inf,), self.counts):
+            cumulative += count
+            yield upper_bound, cumulative
+
+    def quantile(self, q):
+        """Estimate quantile as upper bound of the bucket it falls into."""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        for upper_bound, cumulative in self.cumulative_counts():
+            if cumulative >= rank:
+                return min(upper_bound, self.max)
+        return self.max
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count > 0 else None,
+            "min": self.min if self.count > 0 else None,
+            "max": self.max if self.count > 0 else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": {
+                str(upper_bound): cumulative for upper_bound, cumulative in self.cumulative_counts()},
+        }
+
+
+class MetricsRegistry():
+    """Thread-safe collection of per-operation counters and histograms."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._calls = {}  # operation: {outcome: count}
+        self._histograms = {}  # operation: Histogram
+        self._counters = {}  # name: count
+
+    def observe(self, operation, duration, outcome=SUCCESS):
+        """Record one call of operation."""
+        with self._lock:
+            calls = self._calls.setdefault(operation, {o: 0 for o in OUTCOMES})
+            calls[outcome] += 1
+            histogram = self._histograms.get(operation, None)
+            if histogram is None:
+                histogram = self._histograms[operation] = Histogram(self.buckets)
+            histogram.observe(duration)
+
+    def increment(self, name, value=1):
+        """Increment a plain counter."""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def reset(self):
+        with self._lock:
+            self._calls.clear()
+            self._histograms.clear()
+            self._counters.clear()
+
+    def as_dict(self):
+        """Snapshot of all metrics as JSON-serializable dict."""
+        with self._lock:
+            operations = {}
+            for operation in sorted(self._calls):
+                calls = self._calls[operation]
+                operations[operation] = {
+                    "calls": sum(calls.values()),
+                    "failures": calls[FAILURE],
+                    "errors": calls[ERROR],
+                    "latency": self._histograms[operation].as_dict(),
+                }
+            return {
+                "operations": operations,
+                "counters": dict(sorted(self._counters.items())),
+            }
+
+    def as_prometheus_text(self, prefix=PROMETHEUS_PREFIX):
+        """Snapshot of all metrics in Prometheus text exposition format."""
+        lines = [
+            f"# HELP {prefix}_calls_total Number of calls by operation and outcome.",
+            f"# TYPE {prefix}_calls_total counter",
+        ]
+        with self._lock:
+            for operation in sorted(self._calls):
+                for outcome, count in self._calls[operation].items():
+                    lines.append(
+                        f'{prefix}_calls_total{{operation="{operation}",outcome="{outcome}"}} {count}')
+
+            lines += [
+                f"# HELP {prefix}_call_duration_seconds Latency of calls by operation.",
+                f"# TYPE {prefix}_call_duration_seconds histogram",
+            ]
+            for operation in sorted(self._histograms):
+                histogram = self._histograms[operation]
+                for upper_bound, cumulative in histogram.cumulative_counts():
+                    le = "+Inf" if math.isinf(upper_bound) else repr(upper_bound)
+                    lines.append(
+                        f'{prefix}_call_duration_seconds_bucket{{operation="{operation}",le="{le}"}} {cumulative}')
+                lines.append(
+                    f'{prefix}_call_duration_seconds_sum{{operation="{operation}"}} {histogram.sum}')
+                lines.append(
+                    f'{prefix}_call_duration_seconds_count{{operation="{operation}"}} {histogram.count}')
+
+            for name in sorted(self._counters):
+                metric = f"{prefix}_{name.replace('.', '_')}_total"
+                lines += [f"# TYPE {metric} counter", f"{metric} {self._counters[name]}"]
+
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def _outcome(result):
+    return FAILURE if result is None or result is False else SUCCESS
+
+
+def instrument(operation, registry=registry):
+    """Decorator recording calls, failures, errors and latency of a function.
+
+    Works for plain functions and coroutine functions alike.
+
+    Parameters
+    ----------
+    operation: str
+        label, i.e. 'storagegrid.list_users'
+    registry: MetricsRegistry
+        registry to record to, per default the module-wide one
+    """
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    result = await func(*args, **kwargs)
+                except BaseException:
+                    registry.observe(operation, time.perf_counter() - start, ERROR)
+                    raise
+                registry.observe(operation, time.perf_counter() - start, _outcome(result))
+                return result
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except BaseException:
+                registry.observe(operation, time.perf_counter() - start, ERROR)
+                raise
+            registry.observe(operation, time.perf_counter() - start, _outcome(result))
+            return result
+        return wrapper
+
+    return decorator
+
+
+@contextlib.contextmanager
+def timer(operation, registry=registry):
+    """Context manager recording latency of a block, errors if it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        registry.observe(operation, time.perf_counter() - start, ERROR)
+        raise
+    registry.observe(operation, time.perf_counter() - start, SUCCESS)
+
+
+def timed_iter(operation, iterable, registry=registry):
+    """Wrap iterable, i.e. a template stream, recording the time spent producing its items."""
+    elapsed = 0.0
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            registry.observe(operation, elapsed + time.perf_counter() - start, SUCCESS)
+            return
+        except BaseException:
+            registry.observe(operation, elapsed + time.perf_counter() - start, ERROR)
+            raise
+        elapsed += time.perf_counter() - start
+        yield item
@@ -21,11 +21,18 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 #
+import hashlib
+import json
+
 from dtool_config_generator import db
 
 from flask_login import UserMixin
 
 
+# fields of User that templates may render
+PROFILE_FIELDS = ('username', 'name', 'email', 'orcid')
+
+
 # Declare an Object Model for the user, and make it comply with the
 # flask-login UserMixin mixin.
 class User(UserMixin, db.Model):
@@ -81,6 +88,30 @@ class User(UserMixin, db.Model):
         unique=False
     )
 
+    # immutable NetApp StorageGRID user id and URN, recorded at first sync
+    sg_user_id = db.Column(
+        db.String(36),
+        unique=True,
+        nullable=True
+    )
+
+    sg_user_urn = db.Column(
+        db.String(256),
+        unique=False,
+        nullable=True
+    )
+
+    # time of and hash of default permissions granted at last sync to lookup server
+    dls_synced_at = db.Column(
+        db.DateTime(),
+        nullable=True
+    )
+
+    dls_permission_hash = db.Column(
+        db.String(64),
+        nullable=True
+    )
+
     @property
     def is_active(self):
         return self.activated
@@ -89,7 +120,54 @@ class User(UserMixin, db.Model):
     def is_confirmed(self):
         return self.confirmed
 
+    @property
+    def fingerprint(self):
+        """Hash of PROFILE_FIELDS, identifies cached renderings.
+
+        Bookkeeping columns like sg_user_id or dls_synced_at are left out,
+        hence syncs do not invalidate cached renderings."""
+        values = [getattr(self, field) for field in PROFILE_FIELDS]
+        return hashlib.sha256(json.dumps(values, default=str).encode()).hexdigest()
+
     def __repr__(self):
         return "<User {}, id={}, dn={}, activated={}, confirmed={}, is_admin={}, name={}, email={}, orcid={}>".format(
             self.username, self.id, self.dn, self.activated, self.confirmed, self.is_admin, self.name, self.email,
             self.orcid)
+
+
+class StoredS3AccessCredentials(db.Model):
+    """S3 access credentials last issued to a user, encrypted, for reuse."""
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('user.id', ondelete='CASCADE'),
+        index=True,
+        unique=True,
+        nullable=False
+    )
+
+    # Fernet token of access key and secret key, see vault
+    encrypted_credentials = db.Column(
+        db.LargeBinary(),
+        nullable=False
+    )
+
+    issued_at = db.Column(
+        db.DateTime(),
+        nullable=False
+    )
+
+    expires_at = db.Column(
+        db.DateTime(),
+        nullable=True
+    )
+
+    def __repr__(self):
+        return "<StoredS3AccessCredentials user_id={}, issued_at={}, expires_at={}>".format(
+            self.user_id, self.issued_at, self.expires_at)
+
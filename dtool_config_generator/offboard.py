@@ -0,0 +1,173 @@
+#
+# Copyright 2022 Johannes Laurin Hörmann
+#
+# ### MIT license
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+"""Offboard departing users from StorageGRID and the lookup server.
+
+For a batch of users, all of
+
+* deactivating the users in the database,
+* revoking all their s3 access keys and disabling their StorageGRID users,
+* stripping their search and register permissions from all base URIs,
+
+are carried out in one go, StorageGRID and lookup server in parallel:
+
+    report = offboard_users(User.query.filter(User.username.in_(usernames)).all())
+"""
+import asyncio
+import logging
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import async_to_sync
+from flask import current_app
+
+import dtool_config_generator.comm.storagegrid as sg
+import dtool_config_generator.comm.dtool_lookup_server as dls
+
+from dtool_config_generator.comm.storagegrid_async import AsyncStorageGridClient
+from dtool_config_generator.extensions import db
+from dtool_config_generator.reconcile import _in_app_context
+from dtool_config_generator.vault import discard_credentials
+
+
+logger = logging.getLogger(__name__)
+
+
+async def _revoke_keys_and_disable_user(client, user_id):
+    async def revoke_all_s3_access_keys():
+        s3_access_keys = await client.list_s3_access_keys(user_id)
+        if s3_access_keys is None:
+            return None
+        return await client.delete_s3_access_keys(
+            user_id, [s3_access_key["id"] for s3_access_key in s3_access_keys])
+
+    s3_access_keys, sg_user = await asyncio.gather(
+        revoke_all_s3_access_keys(), client.disable_user(user_id))
+    return {
+        "sg_user_id": user_id,
+        "s3_access_keys": s3_access_keys,
+        "disabled": sg_user is not None and sg_user.get("disable", False) is True,
+    }
+
+
+@async_to_sync
+async def _offboard_sg_users(usernames_and_ids):
+    async with AsyncStorageGridClient() as client:
+        async def offboard(username, user_id):
+            if user_id is not None:
+                try:
+                    return await _revoke_keys_and_disable_user(client, user_id)
+                except sg.UserNotFoundError:
+                    logger.warning("StorageGRID user id %s recorded for user %s not found, look up anew.",
+                                   user_id, username)
+            sg_user = await client.get_user_by_short_name(username)
+            if sg_user is None:
+                logger.debug("User %s does not exist on StorageGRID.", username)
+                return {"sg_user_id": None, "s3_access_keys": None, "disabled": None}
+            return await _revoke_keys_and_disable_user(client, sg_user["id"])
+
+        results = await client.gather(
+            *(offboard(username, user_id) for username, user_id in usernames_and_ids))
+
+    return [{"error": str(result)} if isinstance(result, Exception) else result for result in results]
+
+
+def _strip_permissions(usernames, base_uris=None):
+    if base_uris is None:
+        base_uris = [base_uri_info["base_uri"] for base_uri_info in dls.list_all_base_uris(
+            page_size=current_app.config.get('DSERVER_PAGE_SIZE', dls.DEFAULT_PAGE_SIZE),
+            max_concurrency=current_app.config.get('DSERVER_MAX_CONCURRENCY', dls.DEFAULT_MAX_CONCURRENCY))]
+    if len(base_uris) == 0:
+        return {}
+    return dls.update_permissions_on_base_uris({
+        base_uri: {"revoke_search": usernames, "revoke_register": usernames}
+        for base_uri in base_uris})
+
+
+def offboard_users(users, base_uris=None):
+    """Deactivate users, revoke their credentials and strip their permissions.
+
+    Users are deactivated first. Then, StorageGRID and lookup server are
+    processed in parallel. On StorageGRID, s3 access keys are revoked and
+    the user is disabled concurrently for all users. On the lookup server,
+    each base URI is updated for all users in a single read-modify-write.
+
+    Parameters
+    ----------
+    users: list of User
+    base_uris: list of str, default None
+        base URIs to strip permissions from, per default all base URIs
+        registered at the lookup server
+
+    Returns
+    -------
+    dict
+        report with keys 'users' (username: outcome of StorageGRID steps and
+        deactivation), 'permissions' (base URI: outcome) and 'timing' (seconds per step)
+    """
+    app = current_app._get_current_object()
+    usernames = sorted(user.username for user in users)
+    report = {"users": {}, "permissions": {}, "timing": {}}
+    start = time.perf_counter()
+
+    for user in users:
+        user.activated = False
+    db.session.commit()
+    discard_credentials(user.id for user in users)
+    report["timing"]["deactivate"] = time.perf_counter() - start
+
+    step_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        permissions_future = executor.submit(
+            _in_app_context, app, _strip_permissions, usernames, base_uris)
+
+        sg_outcome = _offboard_sg_users([(user.username, user.sg_user_id) for user in users])
+        report["timing"]["storagegrid"] = time.perf_counter() - step_start
+
+        try:
+            report["permissions"] = permissions_future.result()
+        except Exception as exc:
+            logger.exception("Stripping permissions of users %s failed.", usernames)
+            report["permissions"] = {"*": str(exc)}
+        report["timing"]["lookup_server"] = time.perf_counter() - step_start
+
+    for user, outcome in zip(users, sg_outcome):
+        report["users"][user.username] = {"deactivated": True, **outcome}
+
+    report["timing"]["total"] = time.perf_counter() - start
+    return report
+
+
+def count_failures(report):
+    """Number of failed steps within report of offboard_users."""
+    failures = 0
+    for outcome in report["users"].values():
+        if "error" in outcome:
+            failures += 1
+        elif outcome["sg_user_id"] is not None and (
+                outcome["s3_access_keys"] is None
+                or len(outcome["s3_access_keys"]["failed"]) > 0
+                or not outcome["disabled"]):
+            failures += 1
+    return failures + sum(1 for ret in report["permissions"].values() if ret is not True)
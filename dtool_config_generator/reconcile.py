@@ -0,0 +1,348 @@
+#
+# Copyright 2022 Johannes Laurin Hörmann
+#
+# ### MIT license
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+"""Reconcile the local user database with StorageGRID and the lookup server.
+
+The local User table is the source of truth. The desired state of
+StorageGRID users and lookup server users and permissions is derived from
+it and compared against the actual state of both services, fetched in
+parallel with a few bulk list calls. Only the resulting minimal set of
+changes is applied, with bounded concurrency:
+
+    plan = reconcile(dry_run=True)["plan"]
+"""
+import logging
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import async_to_sync
+from flask import current_app
+
+import dtool_config_generator.comm.storagegrid as sg
+import dtool_config_generator.comm.dtool_lookup_server as dls
+
+from dtool_config_generator.comm.storagegrid_async import AsyncStorageGridClient
+from dtool_config_generator.extensions import db
+from dtool_config_generator.models import User
+
+
+logger = logging.getLogger(__name__)
+
+
+def _in_app_context(app, func, *args, **kwargs):
+    with app.app_context():
+        return func(*args, **kwargs)
+
+
+def fetch_state(base_uris, page_size=None):
+    """Fetch actual state of database, StorageGRID and lookup server in parallel.
+
+    Parameters
+    ----------
+    base_uris: list of str
+        base URIs to query permissions on
+    page_size: int, default None
+        users requested per page from both services
+
+    Returns
+    -------
+    dict
+        with keys 'local' (username: dict), 'storagegrid' (short name: StorageGRID user dict),
+        'lookup_server_users' (set of usernames) and 'search_permissions' (base URI: set of usernames)
+    """
+    app = current_app._get_current_object()
+    if page_size is None:
+        page_size = sg.DEFAULT_PAGE_SIZE
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        sg_users_future = executor.submit(
+            _in_app_context, app, lambda: list(sg.iter_users(page_size=page_size, type='local')))
+        dls_users_future = executor.submit(
+            _in_app_context, app, dls.list_all_users, page_size=page_size)
+        permissions_future = executor.submit(
+            _in_app_context, app, dls.permission_infos, base_uris)
+
+        local = {
+            user.username: {
+                "name": user.name,
+                "managed": user.confirmed and user.activated,
+                "activated": user.activated,
+                "sg_user_id": user.sg_user_id,
+                "sg_user_urn": user.sg_user_urn,
+            } for user in User.query.all()}
+
+        storagegrid = {}
+        for sg_user in sg_users_future.result():
+            prefix, _, short_name = sg_user.get("uniqueName", "").partition('/')
+            if prefix == 'user':
+                storagegrid[short_name] = sg_user
+
+        lookup_server_users = {user["username"] for user in dls_users_future.result()}
+        search_permissions = {
+            base_uri: set(info["users_with_search_permissions"])
+            for base_uri, info in permissions_future.result().items()}
+
+    return {
+        "local": local,
+        "storagegrid": storagegrid,
+        "lookup_server_users": lookup_server_users,
+        "search_permissions": search_permissions,
+    }
+
+
+def plan_changes(state, grant=True, prune=False):
+    """Compute minimal changes turning the actual into the desired state.
+
+    Confirmed and activated users are desired to exist on StorageGRID, to be
+    registered at the lookup server, and, if grant is set, to have search
+    permissions on the default base URIs. With prune, search permissions of
+    deactivated users on the default base URIs are revoked, and deactivated
+    users still enabled on StorageGRID have their s3 access keys revoked and
+    are disabled. Keys of users already disabled are not looked at again.
+    Nothing is ever deleted on StorageGRID or the lookup server.
+
+    Returns
+    -------
+    dict
+        with keys 'storagegrid_create' (list of username, full name tuples),
+        'storagegrid_record' (username: StorageGRID user id and URN),
+        'storagegrid_forget' (list of usernames with stale StorageGRID ids),
+        'storagegrid_disable' (username: StorageGRID user id),
+        'lookup_server_register' (list of usernames) and
+        'lookup_server_permissions' (base URI: keyword arguments to update_permissions)
+    """
+    local = state["local"]
+    storagegrid = state["storagegrid"]
+
+    managed = sorted(username for username, user in local.items() if user["managed"])
+    deactivated = sorted(username for username, user in local.items() if not user["activated"])
+
+    plan = {
+        "storagegrid_create": [
+            (username, local[username]["name"] or username)
+            for username in managed if username not in storagegrid],
+        "storagegrid_record": {
+            username: {"sg_user_id": storagegrid[username]["id"],
+                       "sg_user_urn": storagegrid[username].get("userURN", None)}
+            for username, user in sorted(local.items())
+            if username in storagegrid and user["sg_user_id"] != storagegrid[username]["id"]},
+        "storagegrid_forget": [
+            username for username, user in sorted(local.items())
+            if user["sg_user_id"] is not None and username not in storagegrid],
+        "storagegrid_disable": {},
+        "lookup_server_register": [
+            username for username in managed if username not in state["lookup_server_users"]],
+        "lookup_server_permissions": {},
+    }
+
+    if prune:
+        plan["storagegrid_disable"] = {
+            username: storagegrid[username]["id"] for username in deactivated
+            if username in storagegrid and not storagegrid[username].get("disable", False)}
+
+    for base_uri, users_with_search_permissions in state["search_permissions"].items():
+        changes = {}
+        if grant:
+            grant_search = [username for username in managed if username not in users_with_search_permissions]
+            if len(grant_search) > 0:
+                changes["grant_search"] = grant_search
+        if prune:
+            revoke_search = [username for username in deactivated if username in users_with_search_permissions]
+            if len(revoke_search) > 0:
+                changes["revoke_search"] = revoke_search
+        if len(changes) > 0:
+            plan["lookup_server_permissions"][base_uri] = changes
+
+    return plan
+
+
+def plan_size(plan):
+    """Number of individual changes within plan."""
+    return (len(plan["storagegrid_create"])
+            + len(plan["storagegrid_record"])
+            + len(plan["storagegrid_forget"])
+            + len(plan["storagegrid_disable"])
+            + len(plan["lookup_server_register"])
+            + sum(len(usernames)
+                  for changes in plan["lookup_server_permissions"].values()
+                  for usernames in changes.values()))
+
+
+@async_to_sync
+async def _create_sg_users(usernames_and_full_names, member_of=None):
+    async with AsyncStorageGridClient() as client:
+        results = await client.gather(
+            *(client.create_user(unique_name=f'user/{username}', full_name=full_name, member_of=member_of)
+              for username, full_name in usernames_and_full_names))
+    return [None if isinstance(result, Exception) else result for result in results]
+
+
+@async_to_sync
+async def _disable_sg_users(usernames_and_ids):
+    # offboard imports from this module
+    from dtool_config_generator.offboard import _revoke_keys_and_disable_user
+
+    async with AsyncStorageGridClient() as client:
+        results = await client.gather(
+            *(_revoke_keys_and_disable_user(client, user_id) for _, user_id in usernames_and_ids))
+    return {username: {"error": str(result)} if isinstance(result, Exception) else result
+            for (username, _), result in zip(usernames_and_ids, results)}
+
+
+def _apply_storagegrid_changes(plan):
+    outcome = {"created": {}, "recorded": [], "forgotten": [], "disabled": {}}
+
+    users = {user.username: user for user in User.query.filter(User.username.in_(
+        set(plan["storagegrid_record"]) | set(plan["storagegrid_forget"])
+        | {username for username, _ in plan["storagegrid_create"]}))}
+
+    for username in plan["storagegrid_forget"]:
+        users[username].sg_user_id = None
+        users[username].sg_user_urn = None
+        outcome["forgotten"].append(username)
+    # flush first, a forgotten id may be recorded for another user below
+    db.session.flush()
+
+    for username, sg_user in plan["storagegrid_record"].items():
+        users[username].sg_user_id = sg_user["sg_user_id"]
+        users[username].sg_user_urn = sg_user["sg_user_urn"]
+        outcome["recorded"].append(username)
+    db.session.commit()
+
+    if len(plan["storagegrid_create"]) > 0:
+        member_of = current_app.config.get('STORAGEGRID_DEFAULT_GROUP_UUID', None)
+        if member_of is not None:
+            member_of = [member_of]
+        sg_users = _create_sg_users(plan["storagegrid_create"], member_of)
+        for (username, _), sg_user in zip(plan["storagegrid_create"], sg_users):
+            if sg_user is None:
+                outcome["created"][username] = False
+                continue
+            users[username].sg_user_id = sg_user["id"]
+            users[username].sg_user_urn = sg_user.get("userURN", None)
+            outcome["created"][username] = True
+        db.session.commit()
+
+    if len(plan["storagegrid_disable"]) > 0:
+        outcome["disabled"] = _disable_sg_users(sorted(plan["storagegrid_disable"].items()))
+
+    return outcome
+
+
+def _apply_lookup_server_changes(plan, max_concurrency):
+    outcome = {"registered": {}, "permissions": {}}
+    if len(plan["lookup_server_register"]) > 0:
+        outcome["registered"] = dls.register_users(
+            plan["lookup_server_register"], max_concurrency=max_concurrency)
+    # users must be registered before they appear in permissions
+    if len(plan["lookup_server_permissions"]) > 0:
+        outcome["permissions"] = dls.update_permissions_on_base_uris(plan["lookup_server_permissions"])
+    return outcome
+
+
+def apply_changes(plan, max_concurrency=None):
+    """Apply planned changes, StorageGRID and lookup server in parallel.
+
+    Returns
+    -------
+    dict
+        with keys 'storagegrid' and 'lookup_server', each mapping change type
+        to the affected usernames or per-item outcome
+    """
+    app = current_app._get_current_object()
+    if max_concurrency is None:
+        max_concurrency = current_app.config.get('DSERVER_MAX_CONCURRENCY', dls.DEFAULT_MAX_CONCURRENCY)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        lookup_server_future = executor.submit(
+            _in_app_context, app, _apply_lookup_server_changes, plan, max_concurrency)
+        storagegrid_outcome = _apply_storagegrid_changes(plan)
+        lookup_server_outcome = lookup_server_future.result()
+
+    return {"storagegrid": storagegrid_outcome, "lookup_server": lookup_server_outcome}
+
+
+def count_failures(outcome):
+    """Number of failed items within outcome of apply_changes."""
+    return (sum(1 for ret in outcome["storagegrid"]["created"].values() if ret is not True)
+            + sum(1 for ret in outcome["storagegrid"]["disabled"].values()
+                  if "error" in ret or ret["s3_access_keys"] is None
+                  or len(ret["s3_access_keys"]["failed"]) > 0 or not ret["disabled"])
+            + sum(1 for ret in outcome["lookup_server"]["registered"].values() if ret is not True)
+            + sum(1 for ret in outcome["lookup_server"]["permissions"].values() if ret is not True))
+
+
+def reconcile(dry_run=False, grant=None, prune=False, base_uris=None,
+              max_concurrency=None, page_size=None):
+    """Fetch actual state, plan minimal changes and apply them unless dry_run.
+
+    Parameters
+    ----------
+    dry_run: bool, default False
+        only plan, do not apply changes
+    grant: bool, default None
+        grant search permissions on base_uris to confirmed and activated users,
+        per default DTOOL_LOOKUP_GRANT_DEFAULT_SEARCH_PERMISSIONS_ON_CONFIRMATION
+    prune: bool, default False
+        revoke search permissions on base_uris from deactivated users,
+        revoke their s3 access keys and disable them on StorageGRID
+    base_uris: list of str, default None
+        per default DTOOL_LOOKUP_DEFAULT_SEARCH_PERMISSIONS
+    max_concurrency: int, default None
+        max. number of concurrent lookup server requests, per default DSERVER_MAX_CONCURRENCY
+    page_size: int, default None
+        users requested per page from both services
+
+    Returns
+    -------
+    dict
+        with keys 'plan', 'outcome' (None for dry run) and 'timing' (seconds per step)
+    """
+    if grant is None:
+        grant = current_app.config.get('DTOOL_LOOKUP_GRANT_DEFAULT_SEARCH_PERMISSIONS_ON_CONFIRMATION', False)
+    if base_uris is None:
+        base_uris = current_app.config.get('DTOOL_LOOKUP_DEFAULT_SEARCH_PERMISSIONS', [])
+    if isinstance(base_uris, str):
+        base_uris = [base_uris]
+    if not grant and not prune:
+        base_uris = []
+
+    timing = {}
+    start = time.perf_counter()
+    state = fetch_state(base_uris, page_size=page_size)
+    timing["fetch"] = time.perf_counter() - start
+
+    step_start = time.perf_counter()
+    plan = plan_changes(state, grant=grant, prune=prune)
+    timing["plan"] = time.perf_counter() - step_start
+    logger.debug("Planned %d changes.", plan_size(plan))
+
+    outcome = None
+    if not dry_run and plan_size(plan) > 0:
+        step_start = time.perf_counter()
+        outcome = apply_changes(plan, max_concurrency=max_concurrency)
+        timing["apply"] = time.perf_counter() - step_start
+
+    timing["total"] = time.perf_counter() - start
+    return {"plan": plan, "outcome": outcome, "timing": timing}
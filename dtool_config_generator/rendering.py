@@ -0,0 +1,368 @@
+#
+# Copyright 2022 Johannes Laurin Hörmann
+#
+# ### MIT license
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+"""Jinja templates for dtool config and readme files and their rendering."""
+import collections
+import hashlib
+import logging
+import os.path
+import re
+import threading
+import weakref
+
+from flask import current_app
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, meta
+
+from dtool_config_generator.metrics import registry
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_PRERENDER_CACHE_SIZE = 1024  # entries
+DEFAULT_README_CACHE_SIZE = 4 * 1024 * 1024  # characters
+
+
+# one environment per template directory and settings for the process lifetime
+_template_environments = {}
+_template_environments_lock = threading.Lock()
+
+
+def template_environment(template_dir):
+    """Jinja environment for templates in template_dir.
+
+    Environments are kept for the process lifetime, hence each template is
+    compiled only once. With DTOOL_TEMPLATE_AUTO_RELOAD, templates modified
+    on disk are recompiled. If DTOOL_TEMPLATE_BYTECODE_CACHE_DIR is set,
+    compiled templates are cached there across processes."""
+    auto_reload = current_app.config.get('DTOOL_TEMPLATE_AUTO_RELOAD', True)
+    bytecode_cache_dir = current_app.config.get('DTOOL_TEMPLATE_BYTECODE_CACHE_DIR', None)
+    key = (os.path.abspath(template_dir), auto_reload, bytecode_cache_dir)
+
+    with _template_environments_lock:
+        env = _template_environments.get(key, None)
+        if env is None:
+            logger.debug("Create template environment for %s", template_dir)
+            bytecode_cache = None
+            if bytecode_cache_dir is not None:
+                bytecode_cache = FileSystemBytecodeCache(bytecode_cache_dir)
+            env = Environment(
+                loader=FileSystemLoader(template_dir),
+                auto_reload=auto_reload,
+                bytecode_cache=bytecode_cache)
+            _template_environments[key] = env
+    return env
+
+
+# analysis of compiled templates, dropped with the templates
+_template_analyses = weakref.WeakKeyDictionary()
+_template_analyses_lock = threading.Lock()
+
+
+def _analyze(template):
+    """Variables, source hash and names of referenced templates of template itself.
+
+    Referenced template names are None if not all of them are known."""
+    with _template_analyses_lock:
+        if template in _template_analyses:
+            return _template_analyses[template]
+
+    env = template.environment
+    analysis = (None, None, None)
+    if template.name is not None:
+        source, _, _ = env.loader.get_source(env, template.name)
+        ast = env.parse(source)
+        references = list(meta.find_referenced_templates(ast))
+        analysis = (
+            frozenset(meta.find_undeclared_variables(ast)),
+            hashlib.sha256(source.encode()).hexdigest(),
+            None if None in references else references)
+    logger.debug("Template %s uses variables %s and references %s",
+                 template.name, analysis[0], analysis[2])
+
+    with _template_analyses_lock:
+        _template_analyses[template] = analysis
+    return analysis
+
+
+def template_variables(template):
+    """Names of all undeclared variables used by template and the templates it includes.
+
+    Each compiled template is analyzed only once.
+
+    Returns
+    -------
+    set of str or None
+        None if the variables cannot be determined, i.e. due to dynamic includes
+    """
+    variables, _, references = _analyze(template)
+    if references is None:
+        return None
+    variables = set(variables)
+    for name in references:
+        referenced_variables = template_variables(template.environment.get_template(name))
+        if referenced_variables is None:
+            return None
+        variables |= referenced_variables
+    return variables
+
+
+def template_hash(template):
+    """Hash of the sources of template and the templates it includes.
+
+    Returns
+    -------
+    str or None
+        None if not all sources are known, i.e. due to dynamic includes
+    """
+    _, source_hash, references = _analyze(template)
+    if references is None:
+        return None
+    h = hashlib.sha256(source_hash.encode())
+    for name in references:
+        referenced_hash = template_hash(template.environment.get_template(name))
+        if referenced_hash is None:
+            return None
+        h.update(referenced_hash.encode())
+    return h.hexdigest()
+
+
+def config_template():
+    """Custom DTOOL_CONFIG_TEMPLATE or default dtool config template."""
+    if 'DTOOL_CONFIG_TEMPLATE' in current_app.config:
+        dtool_config_template = current_app.config['DTOOL_CONFIG_TEMPLATE']
+        logger.debug("Use DTOOL_CONFIG_TEMPLATE=%s", dtool_config_template)
+        template_dir = os.path.dirname(dtool_config_template)
+        template_name = os.path.basename(dtool_config_template)
+        return template_environment(template_dir).get_template(template_name)
+
+    logger.debug("Use default template directory")
+    return current_app.jinja_env.get_template('dtool.json')
+
+
+def readme_template():
+    """Custom DTOOL_README_TEMPLATE or default dtool readme template."""
+    if 'DTOOL_README_TEMPLATE' in current_app.config:
+        template_dir = os.path.dirname(current_app.config['DTOOL_README_TEMPLATE'])
+        template_name = os.path.basename(current_app.config['DTOOL_README_TEMPLATE'])
+        return template_environment(template_dir).get_template(template_name)
+
+    return current_app.jinja_env.get_template('dtool_readme.yml')
+
+
+def render(template, **context):
+    """Render template to string, with the app's context processors for default templates."""
+    if template.environment is current_app.jinja_env:
+        current_app.update_template_context(context)
+    return template.render(**context)
+
+
+class LRUCache():
+    """Thread-safe least recently used cache.
+
+    The sum of getsize(value) over all entries is bounded by maxsize,
+    per default the number of entries."""
+
+    def __init__(self, maxsize=128, getsize=None):
+        self.maxsize = maxsize
+        self.getsize = getsize if getsize is not None else (lambda value: 1)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()  # key: (value, size)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        size = self.getsize(value)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous[1]
+            if size > self.maxsize:
+                return
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.maxsize:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+def app_cache(name, maxsize, getsize=None):
+    """LRUCache of the current app by name, created on first use."""
+    cache = current_app.extensions.get(name, None)
+    if cache is None:
+        cache = current_app.extensions.setdefault(name, LRUCache(maxsize, getsize))
+    return cache
+
+
+SECRET_MARKER_PATTERN = re.compile('\x00secret:([^\x00]+)\x00')
+
+
+class SecretPlaceholder():
+    """Stands in for a secret value when pre-rendering, renders as marker.
+
+    Attribute and item access yield placeholders for nested values. All
+    other uses of the value within the template raise TypeError."""
+
+    def __init__(self, path, rendered_paths):
+        self._path = path
+        self._rendered_paths = rendered_paths
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return SecretPlaceholder(f'{self._path}.{name}', self._rendered_paths)
+
+    def __getitem__(self, key):
+        return SecretPlaceholder(f'{self._path}.{key}', self._rendered_paths)
+
+    def __str__(self):
+        self._rendered_paths.append(self._path)
+        return f'\x00secret:{self._path}\x00'
+
+    def __bool__(self):
+        raise TypeError("Secret placeholder used in condition.")
+
+    def __iter__(self):
+        raise TypeError("Secret placeholder iterated.")
+
+    def __len__(self):
+        raise TypeError("Secret placeholder measured.")
+
+
+def prerender(template, user, secret_names):
+    """Render template for user with markers in place of secrets.
+
+    Raises
+    ------
+    TypeError or ValueError
+        if the template does more than print the secrets, i.e. applies
+        filters or conditions to them
+    """
+    rendered_paths = []
+    placeholders = {name: SecretPlaceholder(name, rendered_paths) for name in secret_names}
+    prerendered = render(template, user=user, **placeholders)
+    if SECRET_MARKER_PATTERN.findall(prerendered) != rendered_paths:
+        raise ValueError("Template modifies secrets.")
+    return prerendered
+
+
+def splice(prerendered, env, secrets):
+    """Replace markers within pre-rendered template by secrets, as rendering would."""
+    def resolve(match):
+        name, *attributes = match.group(1).split('.')
+        value = secrets.get(name, None)
+        for attribute in attributes:
+            value = env.getattr(value, attribute)
+        return str(value)
+    return SECRET_MARKER_PATTERN.sub(resolve, prerendered)
+
+
+def render_config(template, user, secrets):
+    """Render config template for user with secrets.
+
+    The template is rendered once per user fingerprint and template
+    version with markers in place of the secrets, i.e. the values of
+    template context providers, and cached. Afterwards, only secrets are
+    spliced in. Templates that do more than print secrets are always
+    rendered fully.
+
+    Parameters
+    ----------
+    template: jinja2.Template
+    user: User
+    secrets: dict
+        name: value of all variables that change on each rendering
+    """
+    version = template_hash(template)
+    if version is None or user.id is None:
+        return render(template, user=user, **secrets)
+
+    cache = app_cache('dtool_config_generator.prerender', current_app.config.get(
+        'PRERENDER_CACHE_SIZE', DEFAULT_PRERENDER_CACHE_SIZE))
+    key = (version, user.fingerprint, tuple(sorted(secrets.keys())))
+    prerendered = cache.get(key, None)
+    if prerendered is None:
+        registry.increment('render.prerender.misses')
+        try:
+            prerendered = prerender(template, user, secrets.keys())
+        except (TypeError, ValueError) as exc:
+            logger.debug("Template %s cannot be pre-rendered: %s", template.name, exc)
+            prerendered = False
+        cache.set(key, prerendered)
+    else:
+        registry.increment('render.prerender.hits')
+
+    if prerendered is False:
+        return render(template, user=user, **secrets)
+    return splice(prerendered, template.environment, secrets)
+
+
+def readme_etag(template, user):
+    """ETag of readme template rendered for user.
+
+    Derived from template version and user fingerprint, hence cheap to
+    compute without rendering. None if the template version is unknown
+    or the user not stored yet."""
+    version = template_hash(template)
+    if version is None or user.id is None:
+        return None
+    return hashlib.sha256(f'{version}:{user.fingerprint}'.encode()).hexdigest()
+
+
+def render_readme(template, user, etag=None):
+    """Render readme template for user.
+
+    Renderings are cached by etag, see readme_etag, in an LRU cache bounded
+    by README_CACHE_SIZE characters in total."""
+    if etag is None:
+        return render(template, user=user)
+
+    cache = app_cache('dtool_config_generator.readmes', current_app.config.get(
+        'README_CACHE_SIZE', DEFAULT_README_CACHE_SIZE), getsize=len)
+    rendered = cache.get(etag, None)
+    if rendered is None:
+        registry.increment('render.readme.misses')
+        rendered = render(template, user=user)
+        cache.set(etag, rendered)
+    else:
+        registry.increment('render.readme.hits')
+    return rendered
@@ -21,24 +21,48 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 #
+import collections
+import asyncio
 import datetime
+import hashlib
+import json
 import logging
+import math
+import time
 
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from asgiref.sync import async_to_sync, sync_to_async
 from flask import current_app, flash, redirect, url_for
 from flask_admin import AdminIndexView, expose
+from flask_admin.actions import action
+from flask_admin.contrib.sqla import ModelView
 from flask_login import current_user
 from flask_mail import Message
 from functools import wraps
+from sqlalchemy import inspect
 
-from dtool_config_generator.extensions import mail
+from dtool_config_generator.extensions import db, mail
+from dtool_config_generator.metrics import registry, timer
 
 import dtool_config_generator.comm.storagegrid as sg
 import dtool_config_generator.comm.dtool_lookup_server as dls
 
+from dtool_config_generator.comm.storagegrid_async import AsyncStorageGridClient
+
 from dtool_config_generator.models import User
+from dtool_config_generator.offboard import count_failures as count_offboarding_failures, offboard_users
+
+import dtool_config_generator.vault as vault
 
 
 DEFAULT_S3_ACCESS_KEY_VALIDITY_PERIOD = 86400
+DEFAULT_ROTATION_WORKERS = 4
+DEFAULT_TEMPLATE_CONTEXT_PROVIDER_TIMEOUT = 60  # seconds
+DEFAULT_TEMPLATE_CONTEXT_MAX_WORKERS = 4
+
+# providers with side effects, i.e. rotating credentials, must not be abandoned
+NO_TIMEOUT = math.inf
 
 logger = logging.getLogger(__name__)
 
@@ -57,44 +81,226 @@ class DtoolConfigGeneratorAdminIndexView(AdminIndexView):
         return super().index()
 
 
+class UserModelView(ModelView):
+    """User admin view with bulk actions."""
+
+    @action('offboard', 'Offboard',
+            'Deactivate selected users, revoke their credentials and strip their permissions?')
+    def action_offboard(self, ids):
+        users = User.query.filter(User.id.in_(ids)).all()
+        try:
+            report = offboard_users(users)
+        except Exception as exc:
+            logger.exception("Offboarding users failed.")
+            flash(f'Offboarding users failed: {exc}', 'error')
+            return
+        failures = count_offboarding_failures(report)
+        if failures > 0:
+            logger.error("Offboarding report: %s", json.dumps(report))
+            flash(f'Offboarded {len(users)} users with {failures} failures, see log for details.', 'error')
+        else:
+            flash(f'Offboarded {len(users)} users.', 'success')
+
+
+ContextProvider = collections.namedtuple('ContextProvider', ['func', 'requires', 'timeout', 'expose', 'threaded'])
+
+
 class TemplateContextBuilder():
-    """Builds """
+    """Builds template context from registered provider functions.
+
+    Providers are called with the user the context is built for and the
+    values of the providers they require as keyword arguments, i.e.
+
+        builder.register(sync_user, name="sg_user_id", expose=False)
+        builder.register(s3_access_credentials_as_context, name="s3_credentials",
+                         requires=["sg_user_id"])
+
+    Each value is computed once per run. Providers run concurrently in
+    worker threads as soon as all their requirements are available.
+    Workers use their own app context and database session, hence
+    providers writing to the database, i.e. recording synced ids, must be
+    registered with threaded=False. They run in the calling thread."""
     def __init__(self, app=None):
-        self._func_dict = {}
+        self._providers = {}
 
         if app is not None:
             self.init_app(app)
 
     def init_app(self, app):
-        """
-        Configures an application. This registers an `after_request` call, and
-        attaches this `LoginManager` to it as `app.login_manager`.
-        :param app: The :class:`flask.Flask` object to configure.
-        :type app: :class:`flask.Flask`
-        :param add_context_processor: Whether to add a context processor to
-            the app that adds a `current_user` variable to the template.
-            Defaults to ``True``.
-        :type add_context_processor: bool
-        """
+        """Attach this builder to app as app.template_context_builder.
+
+        Views and the bundle generation build template contexts via
+        current_app.template_context_builder."""
         app.template_context_builder = self
 
-    def register(self, func, name=None):
+    def register(self, func, name=None, requires=None, timeout=None, expose=True, threaded=True):
         """Register a context builder function.
 
         Parameters
         ----------
-        func: a function with some return value
+        func: a function func(user, **requirements) with some return value
         name: a unique name for the context attribute, per default name of func
+        requires: list of str, default None
+            names of previously registered providers whose values func
+            receives as keyword arguments
+        timeout: float, default None
+            seconds to wait for func, per default TEMPLATE_CONTEXT_PROVIDER_TIMEOUT.
+            A provider that times out is only marked failed, it keeps running
+            in the background. Use NO_TIMEOUT for providers with side effects
+            whose outcome must not be discarded, i.e. issuing new credentials.
+        expose: bool, default True
+            make value available within template context, otherwise only
+            to other providers
+        threaded: bool, default True
+            run func in a worker thread with its own app context and
+            database session. Otherwise, func runs in the calling thread,
+            with the caller's user instance and session, and is never
+            abandoned, its timeout does not apply. Providers writing to
+            the database must not be threaded, as concurrent sessions
+            cannot share an in-memory SQLite database and may find a
+            file database locked.
         """
         if name is None:
             name = func.__name__
-        if name in self._func_dict:
-            raise ValueError("'%s' already registered.", name)
-        self._func_dict[name] = func
+        if name in self._providers:
+            raise ValueError(f"'{name}' already registered.")
+        requires = list(requires or [])
+        for requirement in requires:
+            if requirement not in self._providers:
+                raise ValueError(f"'{name}' requires '{requirement}', which is not registered.")
+        self._providers[name] = ContextProvider(func, requires, timeout, expose, threaded)
+
+    @staticmethod
+    def _call(app, name, func, user, user_id, kwargs):
+        with app.app_context():
+            # user instances must not be shared between threads and their sessions,
+            # only transient users without id are passed on as is
+            if user_id is not None:
+                user = User.query.get(user_id)
+            with timer(f'context.provider.{name}'):
+                return func(user, **kwargs)
+
+    def required_providers(self, names=None):
+        """Names of exposed providers within names and all providers they require.
+
+        All providers if names is None."""
+        if names is None:
+            return set(self._providers.keys())
+        required = set()
+        stack = [name for name, provider in self._providers.items() if provider.expose and name in names]
+        while len(stack) > 0:
+            name = stack.pop()
+            if name not in required:
+                required.add(name)
+                stack.extend(self._providers[name].requires)
+        return required
+
+    def run(self, user=None, names=None, failed=None):
+        """Run providers for user.
+
+        Providers that fail or exceed their timeout yield None, providers
+        requiring them are skipped.
+
+        Parameters
+        ----------
+        user: User, default None
+        names: set of str, default None
+            only run providers of these names and their requirements,
+            i.e. the variables used by a template, per default all providers
+        failed: set, default None
+            filled with the names of providers that failed, timed out or
+            were skipped since their requirements failed
+
+        Returns
+        -------
+        dict
+            name: value of all exposed providers run
+        """
+        app = current_app._get_current_object()
+        default_timeout = current_app.config.get(
+            'TEMPLATE_CONTEXT_PROVIDER_TIMEOUT', DEFAULT_TEMPLATE_CONTEXT_PROVIDER_TIMEOUT)
+        max_workers = current_app.config.get(
+            'TEMPLATE_CONTEXT_MAX_WORKERS', DEFAULT_TEMPLATE_CONTEXT_MAX_WORKERS)
+
+        required = self.required_providers(names)
+        for name in self._providers:
+            if name not in required:
+                logger.debug("Skip context provider '%s', not required.", name)
+                registry.increment(f'context.provider.{name}.skipped')
+
+        # read here, workers accessing an expired user would load it via this thread's session
+        user_id = user.id if user is not None else None
+
+        values = {}
+        if failed is None:
+            failed = set()
+        # registration order is a valid execution order
+        pending = {name: provider for name, provider in self._providers.items() if name in required}
+        running = {}  # future: (name, deadline)
+
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            while len(pending) > 0 or len(running) > 0:
+                ready = []  # not threaded
+                for name, provider in list(pending.items()):
+                    if any(requirement in failed for requirement in provider.requires):
+                        logger.warning("Skip context provider '%s', requirements failed.", name)
+                        failed.add(name)
+                        del pending[name]
+                    elif all(requirement in values for requirement in provider.requires):
+                        kwargs = {requirement: values[requirement] for requirement in provider.requires}
+                        if not provider.threaded:
+                            ready.append((name, provider.func, kwargs))
+                        else:
+                            timeout = provider.timeout if provider.timeout is not None else default_timeout
+                            future = executor.submit(self._call, app, name, provider.func, user, user_id, kwargs)
+                            running[future] = (name, time.monotonic() + timeout)
+                        del pending[name]
+
+                # threaded providers submitted above keep running meanwhile
+                for name, func, kwargs in ready:
+                    try:
+                        with timer(f'context.provider.{name}'):
+                            values[name] = func(user, **kwargs)
+                    except Exception:
+                        logger.exception("Context provider '%s' failed.", name)
+                        failed.add(name)
+                if len(ready) > 0:
+                    # requirements of pending providers may be available now
+                    continue
+
+                if len(running) == 0:
+                    continue
+                next_deadline = min(deadline for _, deadline in running.values())
+                wait_timeout = None if next_deadline == NO_TIMEOUT else max(0, next_deadline - time.monotonic())
+                done, _ = wait(running, timeout=wait_timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, _ = running.pop(future)
+                    try:
+                        values[name] = future.result()
+                    except Exception:
+                        logger.exception("Context provider '%s' failed.", name)
+                        failed.add(name)
+
+                now = time.monotonic()
+                for future, (name, deadline) in list(running.items()):
+                    if deadline <= now:
+                        logger.error("Context provider '%s' timed out.", name)
+                        failed.add(name)
+                        del running[future]
+        finally:
+            # do not wait for timed out providers, cancel those not started yet
+            for future in running:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+        # providers may have modified the user within their own sessions
+        if user is not None and inspect(user).persistent:
+            db.session.expire(user)
 
-    def run(self, *args, **kwargs):
         return {
-            name: func(*args, **kwargs) for name, func in self._func_dict.items()}
+            name: values.get(name, None)
+            for name, provider in self._providers.items() if provider.expose and name in required}
 
 
 def send_test_mail():
@@ -178,15 +384,38 @@ def admin_required(func):
 # NetApp StorageGRID endpoint utility functions
 #############################################################################
 
+def record_sg_user(user, sg_user):
+    """Records StorageGRID user id and URN on user, persisted if user in database."""
+    user.sg_user_id = sg_user["id"]
+    user.sg_user_urn = sg_user.get("userURN", None)
+    if inspect(user).persistent:
+        db.session.commit()
+
+
+def forget_sg_user(user):
+    """Drops recorded StorageGRID user id and URN."""
+    user.sg_user_id = None
+    user.sg_user_urn = None
+    if inspect(user).persistent:
+        db.session.commit()
+
+
 def sync_user(user):
     """Syncs user entry to StorageGRID server
 
+    The StorageGRID user id recorded on the user is used as is, without
+    querying the server. Otherwise, the user is looked up by name or created
+    and the id recorded.
+
     Returns
     -------
     StorageGRID user id or None for failure."""
+    if user.sg_user_id is not None:
+        return user.sg_user_id
+
     sg_user = sg.get_user_by_short_name(user.username)
     if sg_user is None:
-        logger.debug("User %s does not exist on StorageGRID, create.")
+        logger.debug("User %s does not exist on StorageGRID, create.", user.username)
 
         member_of = current_app.config.get('STORAGEGRID_DEFAULT_GROUP_UUID', None)
         if member_of is not None:
@@ -201,48 +430,164 @@ def sync_user(user):
             logger.error("Sync user failed.")
             return None
 
+    record_sg_user(user, sg_user)
     return sg_user["id"]
 
 
-def list_s3_access_keys(user):
-    user_id = sync_user(user)
-    return sg.list_s3_access_keys(user_id)
+def call_with_sg_user_id(user, func, *args, **kwargs):
+    """Calls func(sg_user_id, *args, **kwargs) for user.
 
+    If the server does not know the recorded StorageGRID user id anymore,
+    the user is synced anew and func called once more.
 
-def revoke_all_s3_access_keys(user):
-    """Revokes all s3 access keys attached to a user."""
+    Returns
+    -------
+    return value of func or None if user cannot be synced"""
     user_id = sync_user(user)
-    s3_access_keys = sg.list_s3_access_keys(user_id)
-    if s3_access_keys is None:
-        logger.debug("User %s has no access keys")
-        return
-
-    for s3_access_key in s3_access_keys:
-        if not sg.delete_s3_access_key(
-                user_id=user_id, access_key=s3_access_key["id"]):
-            logger.error("Failed deleting s3 access key %s for user %s",
-                         s3_access_key["id"], user.username)
-        else:
-            logger.debug("Deleted s3 access key %s for user %s",
-                         s3_access_key["id"], user.username)
+    if user_id is None:
+        return None
+    try:
+        return func(user_id, *args, **kwargs)
+    except sg.UserNotFoundError:
+        logger.warning("StorageGRID user id %s recorded for user %s not found, sync anew.",
+                       user_id, user.username)
+        forget_sg_user(user)
 
+    user_id = sync_user(user)
+    if user_id is None:
+        return None
+    return func(user_id, *args, **kwargs)
 
-def create_new_s3_access_key(user):
-    """Creates new s3 access key - secret key pair attached to a user.
+
+def sync_users(users):
+    """Syncs several user entries to StorageGRID server concurrently.
+
+    Only users without recorded StorageGRID user id are looked up.
 
     Returns
     -------
-    access_key, secret_key tuple or None, None on failure
+    dict of username: StorageGRID user id or None for failure."""
+    member_of = current_app.config.get('STORAGEGRID_DEFAULT_GROUP_UUID', None)
+    if member_of is not None:
+        member_of = [member_of]
+
+    unsynced_users = [user for user in users if user.sg_user_id is None]
+    sg_users = _sync_users(
+        [(user.username, user.name) for user in unsynced_users], member_of)
+    for user, sg_user in zip(unsynced_users, sg_users):
+        if sg_user is not None:
+            record_sg_user(user, sg_user)
+
+    return {user.username: user.sg_user_id for user in users}
+
+
+@async_to_sync
+async def _sync_users(usernames_and_full_names, member_of=None):
+    async with AsyncStorageGridClient() as client:
+        async def _sync_user(username, full_name):
+            sg_user = await client.get_user_by_short_name(username)
+            if sg_user is None:
+                logger.debug("User %s does not exist on StorageGRID, create.", username)
+                sg_user = await client.create_user(
+                    unique_name=f'user/{username}',
+                    full_name=full_name,
+                    member_of=member_of)
+            if sg_user is None:
+                logger.error("Sync user %s failed.", username)
+            return sg_user
+
+        results = await client.gather(
+            *(_sync_user(username, full_name) for username, full_name in usernames_and_full_names))
+
+    return [None if isinstance(result, Exception) else result for result in results]
+
+
+def backfill_sg_user_ids(page_size=sg.DEFAULT_PAGE_SIZE):
+    """Records StorageGRID user ids for all users in database lacking them.
+
+    Streams through all users on the StorageGRID server instead of looking
+    up each user individually.
+
+    Returns
+    -------
+    int: number of users updated"""
+    users = {user.username: user for user in User.query.filter(User.sg_user_id.is_(None))}
+    if len(users) == 0:
+        return 0
+
+    updated = 0
+    for sg_user in sg.iter_users(page_size=page_size):
+        prefix, _, short_name = sg_user.get("uniqueName", "").partition('/')
+        if prefix != 'user' or short_name not in users:
+            continue
+        user = users.pop(short_name)
+        user.sg_user_id = sg_user["id"]
+        user.sg_user_urn = sg_user.get("userURN", None)
+        updated += 1
+        if len(users) == 0:
+            break
+
+    db.session.commit()
+    logger.debug("Recorded StorageGRID user ids for %d users, %d users not found.", updated, len(users))
+    return updated
+
+
+def list_s3_access_keys(user):
+    return call_with_sg_user_id(user, sg.list_s3_access_keys)
+
+
+def revoke_all_s3_access_keys(user):
+    """Revokes all s3 access keys attached to a user concurrently.
+
+    Returns
+    -------
+    dict or None
+        lists of access keys 'deleted', 'not_found' and 'failed',
+        None if access keys could not be listed
     """
+    outcome = call_with_sg_user_id(user, _revoke_all_s3_access_keys)
+    if outcome is None:
+        logger.error("Failed listing s3 access keys for user %s", user.username)
+        return None
+
+    logger.debug("Revoked s3 access keys for user %s: %s", user.username, outcome)
+    if user.id is not None:
+        vault.discard_credentials([user.id])
+    if len(outcome["failed"]) > 0:
+        logger.error("Failed deleting s3 access keys %s for user %s",
+                     outcome["failed"], user.username)
+    return outcome
+
+
+@async_to_sync
+async def _revoke_all_s3_access_keys(user_id):
+    async with AsyncStorageGridClient() as client:
+        s3_access_keys = await client.list_s3_access_keys(user_id)
+        if s3_access_keys is None:
+            return None
+        return await client.delete_s3_access_keys(
+            user_id, [s3_access_key["id"] for s3_access_key in s3_access_keys])
+
+
+def s3_access_key_validity_period():
+    """Validity period of newly created s3 access keys as timedelta."""
     seconds = int(current_app.config.get(
         'STORAGEGRID_DEFAULT_S3_ACCESS_KEY_VALIDITY_PERIOD',
         DEFAULT_S3_ACCESS_KEY_VALIDITY_PERIOD))
-    timedelta = datetime.timedelta(seconds=seconds)
+    return datetime.timedelta(seconds=seconds)
 
-    user_id = sync_user(user)
-    if user_id is None:
+
+def create_new_s3_access_key(user):
+    """Creates new s3 access key - secret key pair attached to a user.
+
+    Returns
+    -------
+    access_key, secret_key tuple or None, None on failure
+    """
+    s3_access_key = call_with_sg_user_id(
+        user, sg.create_s3_access_key, timedelta=s3_access_key_validity_period())
+    if s3_access_key is None:
         return None, None
-    s3_access_key = sg.create_s3_access_key(user_id=user_id, timedelta=timedelta)
 
     return s3_access_key["accessKey"], s3_access_key["secretAccessKey"]
 
@@ -259,9 +604,168 @@ def revoke_and_regenerate_s3_access_credentials(user):
     return create_new_s3_access_key(user)
 
 
-def s3_access_credentials_as_context():
-    """Returns new credentials as dict"""
-    access_key, secret_access_key = revoke_and_regenerate_s3_access_credentials(current_user)
+def rotate_s3_access_credentials(user_ids, max_workers=DEFAULT_ROTATION_WORKERS,
+                                 max_requests_per_second=None, callback=None):
+    """Revokes all access keys and generates a new pair for many users.
+
+    Rotations run concurrently within one event loop and share a single
+    authenticated StorageGRID session. Database access and callbacks
+    happen in the calling thread.
+
+    Parameters
+    ----------
+    user_ids: list of int
+        ids of users in database
+    max_workers: int
+        number of users rotated concurrently
+    max_requests_per_second: float, default None
+        cap on StorageGRID requests during the rotation, in addition to
+        STORAGEGRID_MAX_REQUESTS_PER_SECOND of the current app, which
+        applies in any case
+    callback: callable, default None
+        called with each user's report as soon as the rotation finished
+
+    Returns
+    -------
+    list of dict
+        one report per user with keys 'username', 'status' ('rotated'
+        or 'failed'), 'revoked', 'access_key', 'secret_key' and 'error'
+    """
+    member_of = current_app.config.get('STORAGEGRID_DEFAULT_GROUP_UUID', None)
+    if member_of is not None:
+        member_of = [member_of]
+
+    rate_limiter = None
+    if max_requests_per_second:
+        rate_limiter = sg.RateLimiter(max_requests_per_second, parent=sg.get_client().rate_limiter)
+
+    users = [User.query.get(user_id) for user_id in user_ids]
+    reports = []
+
+    def _finish(user, outcome):
+        report = {
+            "username": user.username,
+            "status": "failed",
+            "revoked": outcome["revoked"],
+            "access_key": None,
+            "secret_key": None,
+            "error": outcome["error"]
+        }
+        if outcome["sg_user"] is not None:
+            record_sg_user(user, outcome["sg_user"])
+        elif outcome["sg_user_not_found"]:
+            forget_sg_user(user)
+        if outcome["revoked"] is not None:
+            vault.discard_credentials([user.id])
+
+        s3_access_key = outcome["s3_access_key"]
+        if s3_access_key is not None:
+            report["access_key"] = s3_access_key["accessKey"]
+            report["secret_key"] = s3_access_key["secretAccessKey"]
+
+        if report["error"] is None:
+            if s3_access_key is None:
+                report["error"] = "Failed creating new access key."
+            elif report["revoked"] is None or len(report["revoked"]["failed"]) > 0:
+                report["error"] = "Failed revoking old access keys."
+            else:
+                report["status"] = "rotated"
+
+        if report["status"] == "failed":
+            logger.error("Rotating s3 access keys for user %s failed: %s", user.username, report["error"])
+        if callback is not None:
+            callback(report)
+        reports.append(report)
+
+    _rotate_s3_access_credentials(
+        [(user, user.username, user.name, user.sg_user_id) for user in users],
+        _finish, max_workers=max_workers, rate_limiter=rate_limiter,
+        member_of=member_of, timedelta=s3_access_key_validity_period())
+
+    return reports
+
+
+@async_to_sync
+async def _rotate_s3_access_credentials(users, finish, max_workers, rate_limiter, member_of, timedelta):
+    finish = sync_to_async(finish, thread_sensitive=True)
+    semaphore = asyncio.Semaphore(max_workers)
+
+    async with AsyncStorageGridClient(rate_limiter=rate_limiter) as client:
+        async def _sync_user(username, full_name):
+            sg_user = await client.get_user_by_short_name(username)
+            if sg_user is None:
+                logger.debug("User %s does not exist on StorageGRID, create.", username)
+                sg_user = await client.create_user(
+                    unique_name=f'user/{username}',
+                    full_name=full_name,
+                    member_of=member_of)
+            return sg_user
+
+        async def _rotate(username, full_name, sg_user_id):
+            outcome = {"sg_user": None, "sg_user_not_found": False, "revoked": None,
+                       "s3_access_key": None, "error": None}
+            for attempt in range(2):
+                if sg_user_id is None:
+                    outcome["sg_user"] = await _sync_user(username, full_name)
+                    if outcome["sg_user"] is None:
+                        outcome["error"] = "Failed syncing user."
+                        return outcome
+                    sg_user_id = outcome["sg_user"]["id"]
+                try:
+                    s3_access_keys = await client.list_s3_access_keys(sg_user_id)
+                    if s3_access_keys is not None:
+                        outcome["revoked"] = await client.delete_s3_access_keys(
+                            sg_user_id, [s3_access_key["id"] for s3_access_key in s3_access_keys])
+                    outcome["s3_access_key"] = await client.create_s3_access_key(sg_user_id, timedelta)
+                    return outcome
+                except sg.UserNotFoundError:
+                    if attempt > 0:
+                        raise
+                    logger.warning("StorageGRID user id %s recorded for user %s not found, sync anew.",
+                                   sg_user_id, username)
+                    outcome["sg_user_not_found"] = True
+                    sg_user_id = None
+
+        async def _rotate_and_finish(user, username, full_name, sg_user_id):
+            async with semaphore:
+                try:
+                    outcome = await _rotate(username, full_name, sg_user_id)
+                except Exception as exc:
+                    logger.exception("Rotating s3 access keys for user %s failed.", username)
+                    outcome = {"sg_user": None, "sg_user_not_found": False, "revoked": None,
+                               "s3_access_key": None, "error": str(exc)}
+            await finish(user, outcome)
+
+        await asyncio.gather(*(_rotate_and_finish(*user) for user in users))
+
+
+def sg_user_id_as_context(user):
+    """Returns StorageGRID user id of user, synced if necessary."""
+    return sync_user(user)
+
+
+def s3_access_credentials_as_context(user, sg_user_id=None):
+    """Returns new credentials as dict
+
+    A StorageGRID user id resolved before, i.e. by sg_user_id_as_context,
+    is used without looking up the user again. With
+    STORAGEGRID_S3_CREDENTIALS_REUSE, credentials issued recently are
+    served again from the vault instead."""
+    reuse = vault.reuse_enabled()
+    if reuse:
+        credentials = vault.load_credentials(user)
+        if credentials is not None:
+            logger.debug("Reuse stored s3 access credentials of user %s.", user.username)
+            access_key, secret_access_key = credentials
+            return {"access_key": access_key, "secret_access_key": secret_access_key}
+
+    if sg_user_id is not None and user.sg_user_id is None:
+        user.sg_user_id = sg_user_id
+    issued_at = datetime.datetime.now()
+    access_key, secret_access_key = revoke_and_regenerate_s3_access_credentials(user)
+    if reuse and access_key is not None:
+        vault.store_credentials(user, access_key, secret_access_key,
+                                issued_at, issued_at + s3_access_key_validity_period())
     return {"access_key": access_key, "secret_access_key": secret_access_key}
 
 
@@ -270,34 +774,113 @@ def s3_access_credentials_as_context():
 #############################################################################
 
 
+def dls_permission_hash(base_uris):
+    """Hash of the set of base URIs default search permissions are granted on."""
+    return hashlib.sha256(json.dumps(sorted(set(base_uris))).encode()).hexdigest()
+
+
 def sync_all_users_to_dtool_lookup_server(grant_default_search_permissions=None,
-                                          default_search_permissions=None):
+                                          default_search_permissions=None,
+                                          max_concurrency=None,
+                                          page_size=None,
+                                          full=False):
     """Create all users in db at lookup server.
 
+    Only users never synced before or, if granting default search permissions,
+    users granted another set of default search permissions before are
+    processed, unless full. If there are none, the
+    lookup server is not contacted at all. Users missing at the lookup server
+    are determined as set difference and registered concurrently. Search
+    permissions are granted with a single update per base URI.
+
     Parameters
     ----------
-    grant_default_search_permissions: bool, default True
+    grant_default_search_permissions: bool, default False
         Grant grant synced users default search permissions.
     default_search_permissions: list of str, default None
         List of base URI to grant synced users search permissions to.
         Will look up DTOOL_LOOKUP_DEFAULT_SEARCH_PERMISSIONS config value.
-    """
-
-    dcg_user_list = [user.username for user in User.query.all()]
-    dls_user_list = [user['username'] for user in dls.list_users()]
+    max_concurrency: int, default None
+        Max. number of concurrent requests, per default DSERVER_MAX_CONCURRENCY.
+    page_size: int, default None
+        Users requested per page, per default DSERVER_PAGE_SIZE.
+    full: bool, default False
+        Process all users, not only new or changed ones.
 
-    base_uris = current_app.config.get('DTOOL_LOOKUP_DEFAULT_SEARCH_PERMISSIONS', [])
-    if isinstance(base_uris, str):
-        base_uris = [base_uris]
-
-    for username in dcg_user_list:
-        logger.debug("Processing user '{}'.".format(username))
-        if username not in dls_user_list:
-            logger.debug("Register user '{}'.".format(username))
-            dls.register_user(username)
-        else:
-            logger.debug("User '{}' already registered.".format(username))
-        if grant_default_search_permissions:
-            logger.debug("Grant user '{}' search perissions on {}.".format(username, base_uris))
-            for base_uri in base_uris:
-                dls.grant_permissions(base_uri, username)
+    Returns
+    -------
+    dict
+        report with keys 'users' (counts and per-user outcome of registration),
+        'permissions' (per-base URI outcome) and 'timing' (seconds per step)
+    """
+    if default_search_permissions is None:
+        default_search_permissions = current_app.config.get('DTOOL_LOOKUP_DEFAULT_SEARCH_PERMISSIONS', [])
+    if isinstance(default_search_permissions, str):
+        default_search_permissions = [default_search_permissions]
+    if max_concurrency is None:
+        max_concurrency = current_app.config.get('DSERVER_MAX_CONCURRENCY', dls.DEFAULT_MAX_CONCURRENCY)
+    if page_size is None:
+        page_size = current_app.config.get('DSERVER_PAGE_SIZE', dls.DEFAULT_PAGE_SIZE)
+
+    granted_base_uris = default_search_permissions if grant_default_search_permissions else []
+    # without granting, the permissions recorded at the last grant stay untouched
+    permission_hash = dls_permission_hash(granted_base_uris) if grant_default_search_permissions else None
+
+    report = {
+        "users": {"local": 0, "stale": 0, "remote": None, "registered": {}, "synced": 0},
+        "permissions": {},
+        "timing": {},
+    }
+    start = time.perf_counter()
+
+    report["users"]["local"] = User.query.count()
+    query = User.query
+    if not full and permission_hash is None:
+        query = query.filter(User.dls_synced_at.is_(None))
+    elif not full:
+        query = query.filter(db.or_(
+            User.dls_synced_at.is_(None),
+            User.dls_permission_hash.is_(None),
+            User.dls_permission_hash != permission_hash))
+    stale_users = query.all()
+    report["users"]["stale"] = len(stale_users)
+    if len(stale_users) == 0:
+        logger.debug("All users synced against permission set %s.", permission_hash)
+        report["timing"]["total"] = time.perf_counter() - start
+        return report
+
+    stale_usernames = {user.username for user in stale_users}
+    dls_usernames = {user['username'] for user in dls.list_all_users(
+        page_size=page_size, max_concurrency=max_concurrency)}
+    report["users"]["remote"] = len(dls_usernames)
+    report["timing"]["list_users"] = time.perf_counter() - start
+
+    missing_usernames = sorted(stale_usernames - dls_usernames)
+    logger.debug("Register %d users.", len(missing_usernames))
+    step_start = time.perf_counter()
+    if len(missing_usernames) > 0:
+        report["users"]["registered"] = dls.register_users(
+            missing_usernames, max_concurrency=max_concurrency)
+    report["timing"]["register_users"] = time.perf_counter() - step_start
+
+    if len(granted_base_uris) > 0:
+        logger.debug("Grant %d users search permissions on %s.",
+                     len(stale_usernames), granted_base_uris)
+        step_start = time.perf_counter()
+        report["permissions"] = dls.grant_permissions_on_base_uris(
+            granted_base_uris, sorted(stale_usernames))
+        report["timing"]["grant_permissions"] = time.perf_counter() - step_start
+
+    # users stay stale and are retried next time if anything failed for them
+    if all(ret is True for ret in report["permissions"].values()):
+        synced_at = datetime.datetime.now()
+        for user in stale_users:
+            if report["users"]["registered"].get(user.username, True) is True:
+                user.dls_synced_at = synced_at
+                if permission_hash is not None:
+                    user.dls_permission_hash = permission_hash
+                report["users"]["synced"] += 1
+        db.session.commit()
+
+    report["timing"]["total"] = time.perf_counter() - start
+    return report
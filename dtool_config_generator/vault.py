@@ -0,0 +1,162 @@
+#
+# Copyright 2022 Johannes Laurin Hörmann
+#
+# ### MIT license
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+"""Vault for issued s3 access credentials, encrypted with the app secret.
+
+With STORAGEGRID_S3_CREDENTIALS_REUSE enabled, the s3 access credentials
+last issued to a user are kept encrypted with a key derived from
+SECRET_KEY, along with their expiry. Within
+STORAGEGRID_S3_CREDENTIALS_REUSE_WINDOW seconds after issuing and as long
+as they remain valid for at least STORAGEGRID_S3_CREDENTIALS_MIN_VALIDITY
+seconds, they are served again instead of revoking and regenerating keys:
+
+    credentials = load_credentials(user)
+    if credentials is None:
+        access_key, secret_key = revoke_and_regenerate_s3_access_credentials(user)
+        store_credentials(user, access_key, secret_key, issued_at, expires_at)
+
+Stored credentials are discarded whenever a user's keys are revoked.
+"""
+import base64
+import datetime
+import json
+import logging
+
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from dtool_config_generator.extensions import db
+from dtool_config_generator.metrics import registry
+from dtool_config_generator.models import StoredS3AccessCredentials
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_REUSE_WINDOW = 3600  # seconds
+DEFAULT_MIN_VALIDITY = 3600  # seconds
+
+
+def reuse_enabled():
+    """Whether issued s3 access credentials are stored for reuse."""
+    return bool(current_app.config.get('STORAGEGRID_S3_CREDENTIALS_REUSE', False))
+
+
+def _fernet():
+    secret_key = current_app.config["SECRET_KEY"]
+    if isinstance(secret_key, str):
+        secret_key = secret_key.encode()
+    key = HKDF(algorithm=hashes.SHA256(), length=32, salt=None,
+               info=b'dtool_config_generator.vault').derive(secret_key)
+    return Fernet(base64.urlsafe_b64encode(key))
+
+
+def store_credentials(user, access_key, secret_key, issued_at, expires_at=None):
+    """Store s3 access credentials issued to user, replacing older ones.
+
+    Credentials issued before the ones stored already are not stored, i.e.
+    if two requests of the same user regenerate credentials concurrently.
+
+    Returns
+    -------
+    bool
+        True if stored
+    """
+    encrypted_credentials = _fernet().encrypt(
+        json.dumps({"access_key": access_key, "secret_key": secret_key}).encode())
+
+    stored = StoredS3AccessCredentials.query.filter_by(user_id=user.id).first()
+    if stored is not None and stored.issued_at > issued_at:
+        logger.debug("Newer s3 access credentials stored for user %s already.", user.username)
+        return False
+    if stored is None:
+        stored = StoredS3AccessCredentials(user_id=user.id)
+        db.session.add(stored)
+    stored.encrypted_credentials = encrypted_credentials
+    stored.issued_at = issued_at
+    stored.expires_at = expires_at
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        logger.warning("Storing s3 access credentials for user %s failed.", user.username)
+        return False
+    logger.debug("Stored s3 access credentials for user %s, expiring %s.", user.username, expires_at)
+    return True
+
+
+def load_credentials(user, now=None):
+    """Stored s3 access credentials of user if still to be reused.
+
+    Returns
+    -------
+    access_key, secret_key tuple or None
+        None if no credentials stored, issued longer than the reuse window
+        ago, about to expire or not decryptable with the current SECRET_KEY
+    """
+    stored = StoredS3AccessCredentials.query.filter_by(user_id=user.id).first()
+    if stored is None:
+        registry.increment('vault.misses')
+        return None
+
+    if now is None:
+        now = datetime.datetime.now()
+    reuse_window = datetime.timedelta(seconds=int(current_app.config.get(
+        'STORAGEGRID_S3_CREDENTIALS_REUSE_WINDOW', DEFAULT_REUSE_WINDOW)))
+    min_validity = datetime.timedelta(seconds=int(current_app.config.get(
+        'STORAGEGRID_S3_CREDENTIALS_MIN_VALIDITY', DEFAULT_MIN_VALIDITY)))
+
+    if now >= stored.issued_at + reuse_window:
+        logger.debug("Stored s3 access credentials of user %s outside reuse window.", user.username)
+        registry.increment('vault.stale')
+        return None
+    if stored.expires_at is not None and now >= stored.expires_at - min_validity:
+        logger.debug("Stored s3 access credentials of user %s about to expire.", user.username)
+        registry.increment('vault.stale')
+        return None
+
+    try:
+        credentials = json.loads(_fernet().decrypt(stored.encrypted_credentials))
+    except InvalidToken:
+        logger.warning("Stored s3 access credentials of user %s cannot be decrypted.", user.username)
+        registry.increment('vault.stale')
+        return None
+
+    registry.increment('vault.hits')
+    return credentials["access_key"], credentials["secret_key"]
+
+
+def discard_credentials(user_ids):
+    """Discard stored s3 access credentials of users by id, i.e. after revoking their keys."""
+    user_ids = list(user_ids)
+    if len(user_ids) == 0:
+        return 0
+    count = StoredS3AccessCredentials.query.filter(
+        StoredS3AccessCredentials.user_id.in_(user_ids)).delete(synchronize_session=False)
+    db.session.commit()
+    if count > 0:
+        logger.debug("Discarded stored s3 access credentials of %d users.", count)
+    return count
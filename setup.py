@@ -58,7 +58,9 @@ setup(
             "dtool_config_generator", "version.py"),
     },
     install_requires=[
+        "aiohttp>=3.9",  # callable raise_for_status
         "asgiref",
+        "cryptography",
         "dtool_lookup_api>=0.10.1",
         "flask<2.2.0",  # https://github.com/marshmallow-code/flask-smorest/issues/384
         "flask-admin",
@@ -74,6 +76,7 @@ setup(
         "itsdangerous",
         "marshmallow-sqlalchemy==0.28.1",
         "psycopg2",  # for postgresql support
+        "PyJWT",
         "pyyaml",
         "requests",
         "Werkzeug<=2.2.2",
@@ -7,6 +7,11 @@ from flask_ldap3_login import LDAP3LoginManager, AuthenticationResponseStatus
 
 from dtool_config_generator.config import Config
 from dtool_config_generator import create_app, db
+from dtool_config_generator.comm.dtool_lookup_server import (
+    CredentialsBasedLookupClientWithPersistentToken, client_loop)
+from dtool_config_generator.emulators import EmulatorServer
+from dtool_config_generator.emulators.dtool_lookup_server import create_app as create_dtool_lookup_server_emulator_app
+from dtool_config_generator.emulators.storagegrid import create_app as create_storagegrid_emulator_app
 
 
 class TestingConfig(Config):
@@ -57,6 +62,25 @@ def ldap_service(docker_ip, docker_services, ldap_config):
     return ldap_config
 
 
+# =========
+# emulators
+# =========
+
+
+@pytest.fixture(scope="function")
+def storagegrid_emulator():
+    """Emulated StorageGRID tenant API served on a random local port."""
+    with EmulatorServer(create_storagegrid_emulator_app(seed=0)) as server:
+        yield server
+
+
+@pytest.fixture(scope="function")
+def dtool_lookup_server_emulator():
+    """Emulated dtool-lookup-server and token generator served on a random local port."""
+    with EmulatorServer(create_dtool_lookup_server_emulator_app(seed=0)) as server:
+        yield server
+
+
 # =========
 # flask app
 # =========
@@ -117,3 +141,47 @@ def production_runner(production_app):
     with production_app.app_context():
         db.create_all()
         return production_app.test_cli_runner()
+
+
+@pytest.fixture(scope="function")
+def storagegrid_app_factory(test_config, storagegrid_emulator, tmp_path):
+    """Creates apps talking to the emulated StorageGRID, requires no docker services.
+
+    Call with config overrides, i.e. storagegrid_app_factory(BUNDLE_MAX_WORKERS=2).
+    Apps share a file database, as several operations access it from
+    concurrent threads, which must not share the single in-memory connection."""
+    def factory(**config_overrides):
+        config = dict(test_config)
+        config["STORAGEGRID_HOST"] = storagegrid_emulator.host
+        config["STORAGEGRID_SCHEME"] = "http"
+        config["STORAGEGRID_RETRY_BACKOFF_FACTOR"] = 0
+        config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'storagegrid_app.db'}"
+        config.update(config_overrides)
+        app = create_app(config)
+        with app.app_context():
+            db.create_all()
+        return app
+    return factory
+
+
+@pytest.fixture(scope="function")
+def storagegrid_app(storagegrid_app_factory):
+    """App talking to the emulated StorageGRID, requires no docker services."""
+    return storagegrid_app_factory()
+
+
+@pytest.fixture(scope="function")
+def emulated_app(storagegrid_app_factory, dtool_lookup_server_emulator):
+    """App talking to the emulated StorageGRID and lookup server, requires no docker services."""
+    # the lookup client token persists across clients, start from scratch
+    CredentialsBasedLookupClientWithPersistentToken._token = None
+    CredentialsBasedLookupClientWithPersistentToken._token_expiry = None
+
+    yield storagegrid_app_factory(
+        DSERVER_URL=dtool_lookup_server_emulator.url,
+        DSERVER_TOKEN_GENERATOR_URL=f"{dtool_lookup_server_emulator.url}/token",
+        DSERVER_USERNAME=dtool_lookup_server_emulator.app.emulator.username,
+        DSERVER_PASSWORD=dtool_lookup_server_emulator.app.emulator.password,
+        DSERVER_GRANT_QUEUE_WINDOW=0.1)
+
+    client_loop.shutdown()
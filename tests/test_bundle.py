@@ -0,0 +1,102 @@
+"""Test bulk generation of config bundles against the emulated StorageGRID."""
+import io
+import json
+import tarfile
+import zipfile
+
+import pytest
+
+from dtool_config_generator import db
+from dtool_config_generator.bundle import generate_bundle
+from dtool_config_generator.cli import user_cli
+from dtool_config_generator.models import User
+
+
+@pytest.fixture
+def bundle_app(storagegrid_app_factory, tmp_path):
+    (tmp_path / "dtool.json").write_text(
+        '{"DTOOL_USER": "{{ user.username }}", "KEY": "{{ s3_credentials.access_key }}"}')
+    app = storagegrid_app_factory(
+        STORAGEGRID_S3_CREDENTIALS_EMBEDDED_IN_CONFIG=True,
+        DTOOL_CONFIG_TEMPLATE=str(tmp_path / "dtool.json"))
+    with app.app_context():
+        for i in range(6):
+            db.session.add(User(username=f'user-{i}', confirmed=True))
+        db.session.add(User(username='unconfirmed'))
+        db.session.add(User(username='admin', confirmed=True, is_admin=True))
+        db.session.commit()
+    return app
+
+
+def test_generate_bundle_zip(bundle_app, storagegrid_emulator):
+    usernames = [f'user-{i}' for i in range(6)]
+    with bundle_app.app_context():
+        report = {}
+        data = b"".join(generate_bundle(usernames + ['unconfirmed', 'unknown'], max_workers=3, report=report))
+
+    archive = zipfile.ZipFile(io.BytesIO(data))
+    assert sorted(archive.namelist()) == sorted(
+        ['report.json'] + [f'{username}/{name}' for username in usernames
+                           for name in ('dtool.json', 'dtool_readme.yml')])
+    for username in usernames:
+        config = json.loads(archive.read(f'{username}/dtool.json'))
+        assert config["DTOOL_USER"] == username
+        assert len(config["KEY"]) > 0
+    assert json.loads(archive.read('report.json')) == report
+    assert all(report[username]["status"] == "rendered" for username in usernames)
+    assert report['unconfirmed']["status"] == "skipped"
+    assert report['unknown']["status"] == "skipped"
+    assert len(storagegrid_emulator.app.emulator.users) == 6
+
+
+def test_generate_bundle_key_generation_failed(bundle_app, storagegrid_emulator):
+    emulator = storagegrid_emulator.app.emulator
+    emulator.fail_next(1, status=500, endpoint='storagegrid.create_s3_access_key')
+    with bundle_app.app_context():
+        report = {}
+        data = b"".join(generate_bundle(['user-0', 'user-1'], max_workers=1, report=report))
+
+    archive = zipfile.ZipFile(io.BytesIO(data))
+    assert sorted(archive.namelist()) == ['report.json', 'user-1/dtool.json', 'user-1/dtool_readme.yml']
+    assert report['user-0']["status"] == "failed"
+    assert "s3_credentials" in report['user-0']["error"]
+    assert report['user-1']["status"] == "rendered"
+
+
+def test_cli_user_bundle_tar(bundle_app, tmp_path):
+    output = tmp_path / "bundle.tar.gz"
+    result = bundle_app.test_cli_runner().invoke(
+        user_cli, args=['bundle', 'user-0', 'user-1', '--format', 'tar.gz', '-o', str(output)])
+    assert result.exit_code == 0
+    with tarfile.open(output) as archive:
+        assert sorted(archive.getnames()) == [
+            'report.json',
+            'user-0/dtool.json', 'user-0/dtool_readme.yml',
+            'user-1/dtool.json', 'user-1/dtool_readme.yml']
+        assert archive.getmember('user-0/dtool.json').mode == 0o600
+
+    result = bundle_app.test_cli_runner().invoke(
+        user_cli, args=['bundle', 'user-0', 'unconfirmed', '-o', str(tmp_path / "bundle.zip")])
+    assert result.exit_code == 1
+
+
+def test_bundle_route(bundle_app):
+    client = bundle_app.test_client()
+    with bundle_app.app_context():
+        user_id = User.query.filter_by(username='user-0').first().id
+        admin_id = User.query.filter_by(username='admin').first().id
+
+    with client.session_transaction() as session:
+        session["_user_id"] = str(user_id)
+    response = client.post('/generate/bundle', json={"usernames": ['user-0']})
+    assert response.status_code != 200
+
+    with client.session_transaction() as session:
+        session["_user_id"] = str(admin_id)
+    response = client.post('/generate/bundle', json={"usernames": ['user-0'], "format": "rar"})
+    assert response.status_code == 400
+    response = client.post('/generate/bundle', json={"usernames": ['user-0', 'user-1']})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/zip'
+    archive = zipfile.ZipFile(io.BytesIO(response.data))
+    assert 'user-1/dtool.json' in archive.namelist()
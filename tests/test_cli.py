@@ -67,6 +67,14 @@ def test_cli_dls_base_uri_allow(production_runner):
     assert result.exit_code == 0
 
 
+def test_cli_dls_base_uri_allow_many(production_runner):
+    result = production_runner.invoke(
+        dls_cli, args=['base-uri', 'allow', 's3://test-bucket', 'testuser', '--file', '-'],
+        input="# usernames\ntestuser\n")
+    logger.debug(result.output)
+    assert result.exit_code == 0
+
+
 @pytest.mark.skip(reason="No way to undo modification to production system.")
 def test_cli_dls_base_uri_revoke(production_runner):
     result = production_runner.invoke(dls_cli, args=['base-uri', 'revoke', 's3://test-bucket', 'testuser'])
@@ -0,0 +1,274 @@
+"""Tests against the emulated lookup server, no production environment required."""
+import logging
+import time
+
+import pytest
+
+import dtool_config_generator.comm.dtool_lookup_server as dls
+
+from dtool_config_generator import db
+from dtool_config_generator.cli import user_cli
+from dtool_config_generator.models import User
+from dtool_config_generator.reconcile import count_failures, reconcile
+from dtool_config_generator.utils import sync_all_users_to_dtool_lookup_server
+
+
+logger = logging.getLogger(__name__)
+
+
+def add_users(usernames, confirmed=True):
+    for username in usernames:
+        db.session.add(User(username=username, confirmed=confirmed))
+    db.session.commit()
+
+
+def test_dtool_lookup_server_token_reused(emulated_app, dtool_lookup_server_emulator):
+    emulator = dtool_lookup_server_emulator.app.emulator
+    with emulated_app.app_context():
+        for _ in range(5):
+            assert [user["username"] for user in dls.list_users()] == [emulator.username]
+        assert emulator.request_counts["dtool_lookup_server.token"] == 1
+        assert emulator.request_counts["dtool_lookup_server.config_info"] == 0
+        assert emulator.request_counts["dtool_lookup_server.list_users"] == 5
+
+
+def test_dtool_lookup_server_reauthenticate_on_rejected_token(emulated_app, dtool_lookup_server_emulator):
+    emulator = dtool_lookup_server_emulator.app.emulator
+    with emulated_app.app_context():
+        assert dls.register_user('test-user') is True
+        emulator.expire_tokens()
+        assert dls.user_info('test-user')["username"] == 'test-user'
+        assert emulator.request_counts["dtool_lookup_server.token"] == 2
+        assert emulator.request_counts["dtool_lookup_server.get_user"] == 2
+
+
+def test_dtool_lookup_server_token_rejection_by_status(emulated_app, dtool_lookup_server_emulator):
+    emulator = dtool_lookup_server_emulator.app.emulator
+    with emulated_app.app_context():
+        assert dls.register_user('test-user') is True
+        # rejection recognized by status code, whatever the message
+        emulator.fail_next(1, status=401)
+        assert dls.user_info('test-user')["username"] == 'test-user'
+        assert emulator.request_counts["dtool_lookup_server.token"] == 2
+
+    assert dls.is_token_rejection(dls.TokenRejectedError(403, 'http://localhost/users'))
+    assert not dls.is_token_rejection(dls.LookupServerError("Token has expired"))
+
+
+def test_dtool_lookup_server_session_kept_on_failed_authentication(emulated_app, dtool_lookup_server_emulator):
+    emulator = dtool_lookup_server_emulator.app.emulator
+    with emulated_app.app_context():
+        dls.list_users()
+        client, = dls.client_loop._clients.values()
+        session = client.session
+
+        dls.CredentialsBasedLookupClientWithPersistentToken._token = None
+        emulator.fail_next(1, status=500)
+        with pytest.raises(RuntimeError):
+            dls.list_users()
+        assert client.session is session
+        assert not session.closed
+
+        assert [user["username"] for user in dls.list_users()] == [emulator.username]
+        assert client.session is session
+        assert emulator.request_counts["dtool_lookup_server.token"] == 3
+
+
+def test_dtool_lookup_server_update_permissions(emulated_app, dtool_lookup_server_emulator):
+    emulator = dtool_lookup_server_emulator.app.emulator
+    emulator.add_base_uri('s3://test-bucket', users_with_search_permissions=['old-user'])
+    with emulated_app.app_context():
+        usernames = [f'user-{i:02d}' for i in range(20)]
+        assert dls.grant_permissions_to_users('s3://test-bucket', usernames, allow_register=True) is True
+        # one read-modify-write for all users
+        assert emulator.request_counts["dtool_lookup_server.get_base_uri"] == 1
+        assert emulator.request_counts["dtool_lookup_server.put_base_uri"] == 1
+
+        # nothing written if nothing changes
+        assert dls.grant_permissions_to_users('s3://test-bucket', usernames) is True
+        assert emulator.request_counts["dtool_lookup_server.put_base_uri"] == 1
+
+        assert dls.revoke_permissions_from_users('s3://test-bucket', ['old-user'] + usernames[10:]) is True
+
+    base_uri_info = emulator.base_uris['s3://test-bucket']
+    assert base_uri_info["users_with_search_permissions"] == usernames[:10]
+    assert base_uri_info["users_with_register_permissions"] == usernames
+
+
+def test_dtool_lookup_server_list_all_users(emulated_app, dtool_lookup_server_emulator):
+    emulator = dtool_lookup_server_emulator.app.emulator
+    for i in range(24):
+        emulator.add_user(f'user-{i:02d}')
+    with emulated_app.app_context():
+        users = dls.list_all_users(page_size=10)
+    assert sorted(user["username"] for user in users) == sorted(emulator.users.keys())
+    # three pages, the last one short
+    assert emulator.request_counts["dtool_lookup_server.list_users"] == 3
+
+
+def test_dtool_lookup_server_register_users_concurrently(emulated_app, dtool_lookup_server_emulator):
+    emulator = dtool_lookup_server_emulator.app.emulator
+    with emulated_app.app_context():
+        dls.list_users()  # authenticate before injecting latency
+        emulator.latency = 0.05
+        usernames = [f'user-{i:02d}' for i in range(20)]
+        start = time.perf_counter()
+        outcome = dls.register_users(usernames, max_concurrency=10)
+        elapsed = time.perf_counter() - start
+    assert outcome == {username: True for username in usernames}
+    assert set(usernames) < set(emulator.users.keys())
+    assert elapsed < 20 * emulator.latency
+
+
+def test_dtool_lookup_server_register_users_failures(emulated_app, dtool_lookup_server_emulator):
+    emulator = dtool_lookup_server_emulator.app.emulator
+    with emulated_app.app_context():
+        dls.list_users()
+        emulator.fail_next(1, status=500)
+        outcome = dls.register_users(['user-a', 'user-b'], max_concurrency=1)
+    assert outcome == {'user-a': False, 'user-b': True}
+
+
+def test_dtool_lookup_server_queue_grant_coalesced(emulated_app, dtool_lookup_server_emulator):
+    emulator = dtool_lookup_server_emulator.app.emulator
+    emulator.add_base_uri('s3://test-bucket')
+    with emulated_app.app_context():
+        futures = [dls.queue_grant('s3://test-bucket', f'user-{i}') for i in range(5)]
+        assert all(future.result(timeout=10) for future in futures)
+    assert emulator.base_uris['s3://test-bucket']["users_with_search_permissions"] == [
+        f'user-{i}' for i in range(5)]
+    assert emulator.request_counts["dtool_lookup_server.put_base_uri"] == 1
+
+
+def test_sync_all_users_to_dtool_lookup_server(emulated_app, dtool_lookup_server_emulator):
+    emulator = dtool_lookup_server_emulator.app.emulator
+    emulator.add_base_uri('s3://test-bucket')
+    emulator.add_user('user-00')
+    with emulated_app.app_context():
+        add_users([f'user-{i:02d}' for i in range(3)])
+        report = sync_all_users_to_dtool_lookup_server(
+            grant_default_search_permissions=True, default_search_permissions=['s3://test-bucket'])
+    assert report["users"]["local"] == 3
+    assert report["users"]["registered"] == {'user-01': True, 'user-02': True}
+    assert report["permissions"] == {'s3://test-bucket': True}
+    assert emulator.base_uris['s3://test-bucket']["users_with_search_permissions"] == [
+        f'user-{i:02d}' for i in range(3)]
+
+
+def test_sync_all_users_to_dtool_lookup_server_incremental(emulated_app, dtool_lookup_server_emulator):
+    emulator = dtool_lookup_server_emulator.app.emulator
+    emulator.add_base_uri('s3://test-bucket')
+    emulator.add_base_uri('s3://other-bucket')
+    with emulated_app.app_context():
+        add_users(['user-a', 'user-b'])
+        report = sync_all_users_to_dtool_lookup_server(
+            grant_default_search_permissions=True, default_search_permissions=['s3://test-bucket'])
+        assert report["users"]["synced"] == 2
+
+        # runs without granting neither process nor mark users granted before
+        report = sync_all_users_to_dtool_lookup_server(grant_default_search_permissions=False)
+        assert report["users"]["stale"] == 0
+
+        # nothing changed, lookup server not contacted
+        request_count = sum(emulator.request_counts.values())
+        report = sync_all_users_to_dtool_lookup_server(
+            grant_default_search_permissions=True, default_search_permissions=['s3://test-bucket'])
+        assert report["users"]["stale"] == 0
+        assert sum(emulator.request_counts.values()) == request_count
+
+        # only new users processed
+        add_users(['user-c'])
+        report = sync_all_users_to_dtool_lookup_server(
+            grant_default_search_permissions=True, default_search_permissions=['s3://test-bucket'])
+        assert report["users"]["stale"] == 1
+        assert report["users"]["registered"] == {'user-c': True}
+
+        # changed default permissions, all users processed, but granting fails
+        del emulator.base_uris['s3://other-bucket']
+        report = sync_all_users_to_dtool_lookup_server(
+            grant_default_search_permissions=True,
+            default_search_permissions=['s3://test-bucket', 's3://other-bucket'])
+        assert report["users"]["stale"] == 3
+        assert report["users"]["registered"] == {}
+        assert report["permissions"]['s3://other-bucket'] is not True
+        assert report["users"]["synced"] == 0
+
+        # retried next time
+        emulator.add_base_uri('s3://other-bucket')
+        report = sync_all_users_to_dtool_lookup_server(
+            grant_default_search_permissions=True,
+            default_search_permissions=['s3://test-bucket', 's3://other-bucket'])
+        assert report["users"]["stale"] == 3
+        assert report["users"]["synced"] == 3
+
+        report = sync_all_users_to_dtool_lookup_server(
+            grant_default_search_permissions=True,
+            default_search_permissions=['s3://test-bucket', 's3://other-bucket'],
+            full=True)
+        assert report["users"]["stale"] == 3
+
+    assert emulator.base_uris['s3://other-bucket']["users_with_search_permissions"] == [
+        'user-a', 'user-b', 'user-c']
+
+
+def test_reconcile(emulated_app, storagegrid_emulator, dtool_lookup_server_emulator):
+    emulator = dtool_lookup_server_emulator.app.emulator
+    emulator.add_base_uri('s3://test-bucket')
+    with emulated_app.app_context():
+        add_users(['user-a', 'user-b'])
+        add_users(['user-unconfirmed'], confirmed=False)
+
+        report = reconcile(dry_run=True, grant=True, base_uris=['s3://test-bucket'])
+        assert report["outcome"] is None
+        assert report["plan"]["lookup_server_register"] == ['user-a', 'user-b']
+
+        report = reconcile(grant=True, base_uris=['s3://test-bucket'])
+        assert count_failures(report["outcome"]) == 0
+        assert all(user.sg_user_id is not None for user in User.query.filter_by(confirmed=True))
+
+        # second pass finds nothing left to do
+        report = reconcile(grant=True, base_uris=['s3://test-bucket'])
+        assert report["outcome"] is None
+
+    assert {'user-a', 'user-b'} < set(emulator.users.keys())
+    assert 'user-unconfirmed' not in emulator.users
+    assert emulator.base_uris['s3://test-bucket']["users_with_search_permissions"] == ['user-a', 'user-b']
+    assert len(storagegrid_emulator.app.emulator.users) == 2
+
+
+def test_reconcile_prune(emulated_app, storagegrid_emulator, dtool_lookup_server_emulator):
+    sg_emulator = storagegrid_emulator.app.emulator
+    emulator = dtool_lookup_server_emulator.app.emulator
+    emulator.add_base_uri('s3://test-bucket', users_with_search_permissions=['user-gone'])
+    sg_user = sg_emulator.add_user('user-gone')
+    for _ in range(2):
+        sg_emulator.add_s3_access_key(sg_user["id"])
+    with emulated_app.app_context():
+        db.session.add(User(username='user-gone', confirmed=True, activated=False, sg_user_id=sg_user["id"]))
+        db.session.commit()
+
+        report = reconcile(prune=True, base_uris=['s3://test-bucket'])
+        assert report["plan"]["storagegrid_disable"] == {'user-gone': sg_user["id"]}
+        assert count_failures(report["outcome"]) == 0
+        assert len(report["outcome"]["storagegrid"]["disabled"]['user-gone']["s3_access_keys"]["deleted"]) == 2
+
+        # second pass finds nothing left to do
+        report = reconcile(prune=True, base_uris=['s3://test-bucket'])
+        assert report["outcome"] is None
+
+    assert sg_emulator.users[sg_user["id"]]["disable"] is True
+    assert len(sg_emulator.s3_access_keys.get(sg_user["id"], {})) == 0
+    assert emulator.base_uris['s3://test-bucket']["users_with_search_permissions"] == []
+
+
+def test_cli_user_reconcile_lookup_server_error(emulated_app, storagegrid_emulator, dtool_lookup_server_emulator):
+    emulator = dtool_lookup_server_emulator.app.emulator
+    # service user lacks admin rights, lookup server keeps answering 403
+    emulator.users[emulator.username]["is_admin"] = False
+    with emulated_app.app_context():
+        add_users(['user-a'])
+
+    result = emulated_app.test_cli_runner().invoke(user_cli, args=['reconcile'])
+    assert result.exit_code == 1
+    assert "Token rejected with status 403" in result.output
+    assert result.exception is None or isinstance(result.exception, SystemExit)
@@ -0,0 +1,87 @@
+"""Test upstream call instrumentation."""
+import asyncio
+
+import pytest
+
+import dtool_config_generator.comm.storagegrid as sg
+
+from dtool_config_generator.metrics import MetricsRegistry, instrument, registry, timed_iter
+
+
+def test_instrument_counts_outcomes():
+    test_registry = MetricsRegistry()
+
+    @instrument('test.func', registry=test_registry)
+    def func(ret=True, raise_error=False):
+        if raise_error:
+            raise ValueError("error")
+        return ret
+
+    func()
+    func(ret=None)
+    with pytest.raises(ValueError):
+        func(raise_error=True)
+
+    metrics = test_registry.as_dict()["operations"]["test.func"]
+    assert metrics["calls"] == 3
+    assert metrics["failures"] == 1
+    assert metrics["errors"] == 1
+    assert metrics["latency"]["count"] == 3
+
+
+def test_instrument_coroutine_function():
+    test_registry = MetricsRegistry()
+
+    @instrument('test.coro', registry=test_registry)
+    async def coro():
+        await asyncio.sleep(0.01)
+        return True
+
+    assert asyncio.run(coro())
+
+    metrics = test_registry.as_dict()["operations"]["test.coro"]
+    assert metrics["calls"] == 1
+    assert metrics["latency"]["min"] >= 0.01
+
+
+def test_timed_iter():
+    test_registry = MetricsRegistry()
+    assert list(timed_iter('test.iter', range(3), registry=test_registry)) == [0, 1, 2]
+    assert test_registry.as_dict()["operations"]["test.iter"]["calls"] == 1
+
+
+def test_prometheus_text():
+    test_registry = MetricsRegistry(buckets=(0.1, 1.0))
+    test_registry.observe('test.op', 0.5)
+    text = test_registry.as_prometheus_text()
+    assert 'dtool_config_generator_calls_total{operation="test.op",outcome="success"} 1' in text
+    assert 'dtool_config_generator_call_duration_seconds_bucket{operation="test.op",le="0.1"} 0' in text
+    assert 'dtool_config_generator_call_duration_seconds_bucket{operation="test.op",le="1.0"} 1' in text
+    assert 'dtool_config_generator_call_duration_seconds_bucket{operation="test.op",le="+Inf"} 1' in text
+
+
+def test_storagegrid_calls_instrumented(storagegrid_app):
+    registry.reset()
+    with storagegrid_app.app_context():
+        sg.list_users()
+        assert sg.get_user_by_short_name('nonexistent') is None
+    operations = registry.as_dict()["operations"]
+    assert operations["storagegrid.list_users"]["calls"] == 1
+    assert operations["storagegrid.get_user_by_short_name"]["failures"] == 1
+
+
+def test_prometheus_route_with_bearer_token(storagegrid_app):
+    storagegrid_app.config["METRICS_BEARER_TOKEN"] = "scraper-token"
+    client = storagegrid_app.test_client()
+
+    response = client.get("/config/metrics/prometheus")
+    assert response.status_code == 302
+
+    response = client.get("/config/metrics/prometheus",
+                          headers={"Authorization": "Bearer wrong-token"})
+    assert response.status_code == 302
+
+    response = client.get("/config/metrics/prometheus",
+                          headers={"Authorization": "Bearer scraper-token"})
+    assert response.status_code == 200
+    assert "# TYPE dtool_config_generator_calls_total counter" in response.get_data(as_text=True)
@@ -0,0 +1,78 @@
+"""Test offboarding against the emulated StorageGRID and lookup server."""
+import json
+import logging
+
+from dtool_config_generator import db
+from dtool_config_generator.cli import user_cli
+from dtool_config_generator.models import User
+from dtool_config_generator.offboard import count_failures, offboard_users
+
+
+logger = logging.getLogger(__name__)
+
+
+def test_offboard_users(emulated_app, storagegrid_emulator, dtool_lookup_server_emulator):
+    sg_emulator = storagegrid_emulator.app.emulator
+    dls_emulator = dtool_lookup_server_emulator.app.emulator
+
+    recorded_sg_user = sg_emulator.add_user('user-a')
+    unrecorded_sg_user = sg_emulator.add_user('user-b')
+    for sg_user in (recorded_sg_user, unrecorded_sg_user):
+        for _ in range(3):
+            sg_emulator.add_s3_access_key(sg_user["id"])
+    for i in range(12):
+        dls_emulator.add_base_uri(
+            f's3://bucket-{i:02d}',
+            users_with_search_permissions=['user-a', 'user-b', 'user-c', 'user-stays'],
+            users_with_register_permissions=['user-a', 'user-stays'])
+
+    with emulated_app.app_context():
+        db.session.add(User(username='user-a', confirmed=True, sg_user_id=recorded_sg_user["id"]))
+        db.session.add(User(username='user-b', confirmed=True))
+        db.session.add(User(username='user-c', confirmed=True))
+        db.session.add(User(username='user-stays', confirmed=True))
+        db.session.commit()
+
+        users = User.query.filter(User.username.in_(['user-a', 'user-b', 'user-c'])).all()
+        report = offboard_users(users)
+        logger.debug(json.dumps(report, indent=4))
+        assert count_failures(report) == 0
+
+        assert report["users"]['user-a']["sg_user_id"] == recorded_sg_user["id"]
+        assert len(report["users"]['user-a']["s3_access_keys"]["deleted"]) == 3
+        assert report["users"]['user-b']["sg_user_id"] == unrecorded_sg_user["id"]
+        assert report["users"]['user-b']["disabled"] is True
+        # not on StorageGRID, nothing to do
+        assert report["users"]['user-c']["sg_user_id"] is None
+        assert len(report["permissions"]) == 12
+
+        assert [user.username for user in User.query.filter_by(activated=False)] == [
+            'user-a', 'user-b', 'user-c']
+
+    for sg_user in (recorded_sg_user, unrecorded_sg_user):
+        assert sg_emulator.users[sg_user["id"]]["disable"] is True
+        assert len(sg_emulator.s3_access_keys.get(sg_user["id"], {})) == 0
+    for base_uri_info in dls_emulator.base_uris.values():
+        assert base_uri_info["users_with_search_permissions"] == ['user-stays']
+        assert base_uri_info["users_with_register_permissions"] == ['user-stays']
+    # one read-modify-write per base URI for all users
+    assert dls_emulator.request_counts["dtool_lookup_server.put_base_uri"] == 12
+
+
+def test_cli_user_offboard(emulated_app, dtool_lookup_server_emulator):
+    dls_emulator = dtool_lookup_server_emulator.app.emulator
+    dls_emulator.add_base_uri('s3://bucket', users_with_search_permissions=['user-a'])
+    dls_emulator.add_base_uri('s3://other-bucket', users_with_search_permissions=['user-a'])
+    with emulated_app.app_context():
+        db.session.add(User(username='user-a', confirmed=True))
+        db.session.commit()
+
+    runner = emulated_app.test_cli_runner()
+    result = runner.invoke(user_cli, args=['offboard', 'user-unknown'])
+    assert result.exit_code == 1
+
+    result = runner.invoke(user_cli, args=['offboard', 'user-a', '--base-uri', 's3://bucket'])
+    logger.debug(result.output)
+    assert result.exit_code == 0
+    assert dls_emulator.base_uris['s3://bucket']["users_with_search_permissions"] == []
+    assert dls_emulator.base_uris['s3://other-bucket']["users_with_search_permissions"] == ['user-a']
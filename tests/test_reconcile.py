@@ -0,0 +1,64 @@
+"""Test planning of reconciliation changes."""
+from dtool_config_generator.reconcile import plan_changes, plan_size
+
+
+def local_user(managed=True, activated=True, sg_user_id=None):
+    return {
+        "name": None,
+        "managed": managed,
+        "activated": activated,
+        "sg_user_id": sg_user_id,
+        "sg_user_urn": None,
+    }
+
+
+def sg_user(short_name, id, disable=False):
+    return {"id": id, "uniqueName": f"user/{short_name}", "userURN": f"urn:user/{short_name}",
+            "disable": disable}
+
+
+def test_plan_changes():
+    state = {
+        "local": {
+            "synced": local_user(sg_user_id="id-synced"),
+            "unrecorded": local_user(),
+            "stale": local_user(sg_user_id="id-gone"),
+            "deactivated": local_user(managed=False, activated=False),
+            "deactivated-enabled": local_user(managed=False, activated=False, sg_user_id="id-enabled"),
+            "deactivated-disabled": local_user(managed=False, activated=False, sg_user_id="id-disabled"),
+            "unconfirmed": local_user(managed=False),
+        },
+        "storagegrid": {
+            "synced": sg_user("synced", "id-synced"),
+            "unrecorded": sg_user("unrecorded", "id-unrecorded"),
+            "deactivated-enabled": sg_user("deactivated-enabled", "id-enabled"),
+            "deactivated-disabled": sg_user("deactivated-disabled", "id-disabled", disable=True),
+        },
+        "lookup_server_users": {"synced", "stale"},
+        "search_permissions": {"s3://bucket": {"synced", "deactivated"}},
+    }
+
+    plan = plan_changes(state, grant=True, prune=True)
+    assert plan["storagegrid_create"] == [("stale", "stale")]
+    assert plan["storagegrid_record"] == {
+        "unrecorded": {"sg_user_id": "id-unrecorded", "sg_user_urn": "urn:user/unrecorded"}}
+    assert plan["storagegrid_forget"] == ["stale"]
+    assert plan["storagegrid_disable"] == {"deactivated-enabled": "id-enabled"}
+    assert plan["lookup_server_register"] == ["unrecorded"]
+    assert plan["lookup_server_permissions"] == {
+        "s3://bucket": {"grant_search": ["stale", "unrecorded"], "revoke_search": ["deactivated"]}}
+    assert plan_size(plan) == 8
+
+    plan = plan_changes(state, grant=False, prune=False)
+    assert plan["storagegrid_disable"] == {}
+    assert plan["lookup_server_permissions"] == {}
+
+
+def test_plan_changes_in_sync():
+    state = {
+        "local": {"synced": local_user(sg_user_id="id-synced")},
+        "storagegrid": {"synced": sg_user("synced", "id-synced")},
+        "lookup_server_users": {"synced"},
+        "search_permissions": {"s3://bucket": {"synced"}},
+    }
+    assert plan_size(plan_changes(state, grant=True, prune=True)) == 0
@@ -0,0 +1,134 @@
+"""Test revoking and rotating s3 access keys against the emulated StorageGRID."""
+import asyncio
+import json
+import time
+
+import dtool_config_generator.comm.storagegrid as sg
+
+from dtool_config_generator import db
+from dtool_config_generator.cli import sg_cli
+from dtool_config_generator.comm.storagegrid_async import AsyncStorageGridClient
+from dtool_config_generator.models import User
+from dtool_config_generator.utils import revoke_all_s3_access_keys, rotate_s3_access_credentials
+
+
+def test_revoke_all_s3_access_keys(storagegrid_app, storagegrid_emulator):
+    emulator = storagegrid_emulator.app.emulator
+    sg_user = emulator.add_user('test-user')
+    s3_access_keys = [emulator.add_s3_access_key(sg_user["id"]) for _ in range(3)]
+    with storagegrid_app.app_context():
+        user = User(username='test-user', name='Test User', sg_user_id=sg_user["id"])
+        db.session.add(user)
+        db.session.commit()
+
+        outcome = revoke_all_s3_access_keys(user)
+        assert sorted(outcome["deleted"]) == sorted(key["id"] for key in s3_access_keys)
+        assert outcome["not_found"] == []
+        assert outcome["failed"] == []
+        assert emulator.s3_access_keys[sg_user["id"]] == {}
+
+
+def test_delete_s3_access_keys_outcome(storagegrid_app, storagegrid_emulator):
+    emulator = storagegrid_emulator.app.emulator
+    sg_user = emulator.add_user('test-user')
+    s3_access_keys = [emulator.add_s3_access_key(sg_user["id"])["id"] for _ in range(2)]
+
+    async def delete_s3_access_keys(access_keys):
+        async with AsyncStorageGridClient() as client:
+            return await client.delete_s3_access_keys(sg_user["id"], access_keys)
+
+    with storagegrid_app.app_context():
+        outcome = asyncio.run(delete_s3_access_keys([s3_access_keys[0], 'SGKHunknown']))
+        assert outcome == {"deleted": [s3_access_keys[0]], "not_found": ['SGKHunknown'], "failed": []}
+
+        emulator.fail_next(1, status=500)
+        outcome = asyncio.run(delete_s3_access_keys([s3_access_keys[1]]))
+        assert outcome == {"deleted": [], "not_found": [], "failed": [s3_access_keys[1]]}
+
+
+def test_cli_sg_revoke(storagegrid_app, storagegrid_emulator):
+    emulator = storagegrid_emulator.app.emulator
+    sg_user = emulator.add_user('test-user')
+    for _ in range(2):
+        emulator.add_s3_access_key(sg_user["id"])
+    with storagegrid_app.app_context():
+        db.session.add(User(username='test-user', sg_user_id=sg_user["id"]))
+        db.session.commit()
+
+    result = storagegrid_app.test_cli_runner().invoke(sg_cli, args=['revoke', 'test-user'])
+    assert result.exit_code == 0, result.output
+    assert "Deleted 2 keys, 0 keys already gone." in result.output
+
+
+def test_rotate_s3_access_credentials(storagegrid_app, storagegrid_emulator):
+    emulator = storagegrid_emulator.app.emulator
+    with storagegrid_app.app_context():
+        users = []
+        for i in range(4):
+            sg_user = emulator.add_user(f'user-{i}')
+            emulator.add_s3_access_key(sg_user["id"])
+            users.append(User(username=f'user-{i}', name=f'User {i}', sg_user_id=sg_user["id"]))
+        # not yet synced and stale StorageGRID user id
+        users.append(User(username='new-user', name='New User'))
+        users.append(User(username='stale-user', name='Stale User', sg_user_id='unknown'))
+        db.session.add_all(users)
+        db.session.commit()
+
+        rate_limiter = sg.get_client().rate_limiter
+        reports = rotate_s3_access_credentials(
+            [user.id for user in users], max_workers=2, max_requests_per_second=100)
+        assert sg.get_client().rate_limiter is rate_limiter
+
+        assert sorted(report["username"] for report in reports) == sorted(user.username for user in users)
+        for report in reports:
+            assert report["status"] == "rotated", report["error"]
+        assert sum(len(report["revoked"]["deleted"]) for report in reports) == 4
+        for user in users:
+            s3_access_keys = list(emulator.s3_access_keys[user.sg_user_id].values())
+            assert len(s3_access_keys) == 1
+        assert User.query.filter_by(username='stale-user').one().sg_user_id != 'unknown'
+
+    # one authenticated session for all rotations
+    assert emulator.request_counts["storagegrid.authorize"] == 1
+
+
+def test_rotate_s3_access_credentials_app_rate_limit(storagegrid_app_factory, storagegrid_emulator):
+    emulator = storagegrid_emulator.app.emulator
+    app = storagegrid_app_factory(STORAGEGRID_MAX_REQUESTS_PER_SECOND=20)
+    with app.app_context():
+        users = [User(username=f'user-{i}', sg_user_id=emulator.add_user(f'user-{i}')["id"]) for i in range(3)]
+        db.session.add_all(users)
+        db.session.commit()
+
+        start = time.perf_counter()
+        reports = rotate_s3_access_credentials(
+            [user.id for user in users], max_workers=3, max_requests_per_second=1000)
+        elapsed = time.perf_counter() - start
+
+    assert all(report["status"] == "rotated" for report in reports)
+    # the higher cap of the rotation does not lift the cap of the app
+    n_requests = sum(emulator.request_counts.values())
+    assert elapsed >= 0.9 * (n_requests - 1) / 20
+
+
+def test_cli_sg_rotate_all(storagegrid_app, storagegrid_emulator, tmp_path):
+    emulator = storagegrid_emulator.app.emulator
+    with storagegrid_app.app_context():
+        for i in range(4):
+            sg_user = emulator.add_user(f'user-{i}')
+            emulator.add_s3_access_key(sg_user["id"])
+            db.session.add(User(username=f'user-{i}', sg_user_id=sg_user["id"], confirmed=i < 3))
+        db.session.add(User(username='other', confirmed=True))
+        db.session.commit()
+
+    result = storagegrid_app.test_cli_runner().invoke(sg_cli, args=[
+        'rotate-all', '--match', 'user-*', '--confirmed-only', '-w', '2', '-r', '50',
+        '-o', str(tmp_path / "summary.json")])
+    assert result.exit_code == 0, result.output
+    summary = json.loads((tmp_path / "summary.json").read_text())
+    assert (summary["total"], summary["rotated"], summary["failed"]) == (3, 3, [])
+    assert [report["username"] for report in summary["users"]] == ['user-0', 'user-1', 'user-2']
+    assert all("secret_key" not in report for report in summary["users"])
+    # unselected users untouched
+    assert emulator.get_user_by_unique_name('user/other') is None
+    assert len(emulator.s3_access_keys[emulator.get_user_by_unique_name('user/user-3')["id"]]) == 1
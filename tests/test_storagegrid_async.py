@@ -0,0 +1,73 @@
+"""Test the asynchronous StorageGRID client against the emulated StorageGRID."""
+import asyncio
+import time
+
+import dtool_config_generator.comm.storagegrid as sg
+
+from dtool_config_generator import db
+from dtool_config_generator.cli import sg_cli
+from dtool_config_generator.comm.storagegrid_async import AsyncStorageGridClient
+from dtool_config_generator.models import User
+from dtool_config_generator.utils import sync_users
+
+
+def test_async_storagegrid_client_bounded_concurrency(storagegrid_app, storagegrid_emulator):
+    emulator = storagegrid_emulator.app.emulator
+    sg_user_ids = [emulator.add_user(f'user-{i}')["id"] for i in range(6)]
+
+    async def get_users():
+        async with AsyncStorageGridClient(max_concurrency=3) as client:
+            return await client.gather(*(client.get_user_by_id(sg_user_id) for sg_user_id in sg_user_ids))
+
+    with storagegrid_app.app_context():
+        # token shared with the synchronous client
+        sg.get_token()
+        emulator.latency = 0.2
+        start = time.perf_counter()
+        sg_users = asyncio.run(get_users())
+        elapsed = time.perf_counter() - start
+
+    assert [sg_user["id"] for sg_user in sg_users] == sg_user_ids
+    assert emulator.request_counts["storagegrid.authorize"] == 1
+    # two rounds of three requests
+    assert 0.4 <= elapsed < 1.0
+
+
+def test_async_storagegrid_client_gather_exceptions(storagegrid_app, storagegrid_emulator):
+    emulator = storagegrid_emulator.app.emulator
+    sg_user_id = emulator.add_user('test-user')["id"]
+
+    async def failing():
+        raise RuntimeError("failed")
+
+    async def get_user():
+        async with AsyncStorageGridClient() as client:
+            return await client.gather(client.get_user_by_id(sg_user_id), failing())
+
+    with storagegrid_app.app_context():
+        sg_user, exc = asyncio.run(get_user())
+
+    assert sg_user["id"] == sg_user_id
+    assert isinstance(exc, RuntimeError)
+
+
+def test_sync_users_concurrently(storagegrid_app, storagegrid_emulator):
+    emulator = storagegrid_emulator.app.emulator
+    with storagegrid_app.app_context():
+        users = [User(username=f'user-{i}', name=f'User {i}') for i in range(5)]
+        db.session.add_all(users)
+        db.session.commit()
+
+        sync_users(users)
+        assert all(user.sg_user_id in emulator.users for user in users)
+
+
+def test_cli_sg_sync(storagegrid_app, storagegrid_emulator):
+    emulator = storagegrid_emulator.app.emulator
+    with storagegrid_app.app_context():
+        db.session.add_all([User(username=f'user-{i}', name=f'User {i}') for i in range(3)])
+        db.session.commit()
+
+    result = storagegrid_app.test_cli_runner().invoke(sg_cli, args=['sync', 'user-0', 'user-1', 'user-2'])
+    assert result.exit_code == 0, result.output
+    assert len(emulator.users) == 3
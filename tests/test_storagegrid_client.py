@@ -0,0 +1,145 @@
+"""Test the pooled StorageGRID client against the emulated StorageGRID."""
+import threading
+import time
+
+import dtool_config_generator.comm.storagegrid as sg
+
+from dtool_config_generator.cli import sg_cli
+
+
+def test_storagegrid_session_shared(storagegrid_app_factory):
+    app = storagegrid_app_factory(STORAGEGRID_POOL_SIZE=3, STORAGEGRID_KEEP_ALIVE=False)
+    with app.app_context():
+        client = sg.get_client()
+        assert sg.get_client() is client
+        adapter = client.session.get_adapter(client.url('/org/users'))
+        assert adapter._pool_maxsize == 3
+        assert client.session.headers['Connection'] == 'close'
+        sg.list_users()
+        sg.list_users()
+        assert sg.get_client().session is client.session
+
+
+def test_storagegrid_retry_on_unavailable(storagegrid_app, storagegrid_emulator):
+    emulator = storagegrid_emulator.app.emulator
+    emulator.add_user('test-user')
+    with storagegrid_app.app_context():
+        client = sg.get_client()
+        headers = sg.headers()
+        emulator.fail_next(2, status=503)
+        response = client.get(client.url('/org/users/user/test-user'), headers=headers)
+        assert response.status_code == 200
+        assert emulator.request_counts["storagegrid.get_user_by_short_name"] == 3
+
+
+def test_storagegrid_no_retry_on_post(storagegrid_app, storagegrid_emulator):
+    emulator = storagegrid_emulator.app.emulator
+    with storagegrid_app.app_context():
+        client = sg.get_client()
+        headers = sg.headers()
+        emulator.fail_next(1, status=503)
+        response = client.post(client.url('/org/users'), headers=headers,
+                               json={"uniqueName": 'user/test-user', "fullName": 'Test User'})
+        assert response.status_code == 503
+        assert emulator.request_counts["storagegrid.create_user"] == 1
+
+
+def test_storagegrid_token_cached(storagegrid_app, storagegrid_emulator):
+    emulator = storagegrid_emulator.app.emulator
+    with storagegrid_app.app_context():
+        for _ in range(5):
+            assert sg.list_users() == []
+        assert emulator.request_counts["storagegrid.authorize"] == 1
+        assert emulator.request_counts["storagegrid.org_config"] == 1
+        assert emulator.request_counts["storagegrid.list_users"] == 5
+        assert sg.token_stats()["refreshes"] == 1
+
+
+def test_storagegrid_reauthorize_on_rejected_token(storagegrid_app, storagegrid_emulator):
+    emulator = storagegrid_emulator.app.emulator
+    emulator.add_user('test-user')
+    with storagegrid_app.app_context():
+        assert sg.get_user_by_short_name('test-user') is not None
+        emulator.expire_tokens()
+        assert sg.get_user_by_short_name('test-user') is not None
+        assert emulator.request_counts["storagegrid.authorize"] == 2
+        assert sg.token_stats()["rejections"] == 1
+
+
+def test_storagegrid_token_reused_within_lifetime(storagegrid_app_factory, storagegrid_emulator):
+    emulator = storagegrid_emulator.app.emulator
+    emulator.token_lifetime = 3600
+    app = storagegrid_app_factory(STORAGEGRID_TOKEN_REFRESH_MARGIN=60)
+    with app.app_context():
+        for _ in range(3):
+            sg.list_users()
+        assert emulator.request_counts["storagegrid.authorize"] == 1
+        assert sg.token_stats()["refreshes"] == 1
+        assert sg.token_stats()["hits"] == 2
+
+
+def test_storagegrid_token_refreshed_before_expiry(storagegrid_app_factory, storagegrid_emulator):
+    emulator = storagegrid_emulator.app.emulator
+    emulator.token_lifetime = 2
+    app = storagegrid_app_factory(STORAGEGRID_TOKEN_REFRESH_MARGIN=60)
+    with app.app_context():
+        # lifetime below refresh margin, token refreshed halfway instead of on every call
+        sg.list_users()
+        sg.list_users()
+        assert emulator.request_counts["storagegrid.authorize"] == 1
+        time.sleep(1.1)
+        sg.list_users()
+        assert emulator.request_counts["storagegrid.authorize"] == 2
+        assert sg.token_stats()["refreshes"] == 2
+
+
+def test_storagegrid_token_cache_counters_thread_safe():
+    token_cache = sg.TokenCache()
+    token_cache.set('token')
+
+    def get_tokens():
+        for _ in range(1000):
+            token_cache.get()
+
+    threads = [threading.Thread(target=get_tokens) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert token_cache.stats()["hits"] == 8000
+
+
+def test_storagegrid_authorization_failure(storagegrid_app_factory, storagegrid_emulator):
+    emulator = storagegrid_emulator.app.emulator
+    app = storagegrid_app_factory(STORAGEGRID_PASSWORD='wrong')
+    with app.app_context():
+        assert sg.get_token() is None
+        assert sg.token_stats()["failures"] == 1
+        assert emulator.request_counts["storagegrid.authorize"] == 1
+
+
+def test_storagegrid_iter_users(storagegrid_app, storagegrid_emulator):
+    emulator = storagegrid_emulator.app.emulator
+    for i in range(25):
+        emulator.add_user(f'user-{i:02d}')
+    with storagegrid_app.app_context():
+        for prefetch in (True, False):
+            users = list(sg.iter_users(page_size=10, prefetch=prefetch))
+            assert [user["uniqueName"] for user in users] == [f'user/user-{i:02d}' for i in range(25)]
+        # three pages per pass, the last one short
+        assert emulator.request_counts["storagegrid.list_users"] == 6
+
+
+def test_cli_sg_users(storagegrid_app, storagegrid_emulator):
+    emulator = storagegrid_emulator.app.emulator
+    for i in range(3):
+        emulator.add_user(f'user-{i}')
+    emulator.add_user('federated', federated=True)
+
+    runner = storagegrid_app.test_cli_runner()
+    result = runner.invoke(sg_cli, args=['users', '--page-size', '2'])
+    assert result.exit_code == 0, result.output
+    assert len(result.output.splitlines()) == 4
+    result = runner.invoke(sg_cli, args=['users', '--type', 'federated'])
+    assert result.exit_code == 0, result.output
+    assert [line.split('\t')[0] for line in result.output.splitlines()] == ['federated-user/federated']
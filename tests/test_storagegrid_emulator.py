@@ -0,0 +1,87 @@
+"""Test the emulated StorageGRID itself, no production environment required."""
+import time
+
+import requests
+
+from dtool_config_generator.emulators import EmulatorServer
+from dtool_config_generator.emulators.storagegrid import DEFAULT_ACCOUNT_ID, DEFAULT_PASSWORD, DEFAULT_USERNAME, create_app
+
+
+def authorize(url):
+    response = requests.post(f'{url}/api/v3/authorize', json={
+        "accountId": DEFAULT_ACCOUNT_ID, "username": DEFAULT_USERNAME, "password": DEFAULT_PASSWORD})
+    assert response.status_code == 200
+    return {"Authorization": f'Bearer {response.json()["data"]}'}
+
+
+def test_storagegrid_emulator_users_and_keys(storagegrid_emulator):
+    url = storagegrid_emulator.url
+    emulator = storagegrid_emulator.app.emulator
+
+    assert requests.post(f'{url}/api/v3/authorize', json={
+        "accountId": DEFAULT_ACCOUNT_ID, "username": DEFAULT_USERNAME, "password": 'wrong'}).status_code == 401
+    assert requests.get(f'{url}/api/v3/org/users').status_code == 401
+
+    headers = authorize(url)
+    response = requests.post(f'{url}/api/v3/org/users', headers=headers,
+                             json={"uniqueName": 'user/test-user', "fullName": 'Test User'})
+    assert response.status_code == 201
+    user_id = response.json()["data"]["id"]
+    assert requests.post(f'{url}/api/v3/org/users', headers=headers,
+                         json={"uniqueName": 'user/test-user', "fullName": 'Test User'}).status_code == 409
+    assert requests.get(f'{url}/api/v3/org/users/user/test-user',
+                        headers=headers).json()["data"]["id"] == user_id
+
+    response = requests.post(f'{url}/api/v3/org/users/{user_id}/s3-access-keys', headers=headers, json={})
+    assert response.status_code == 201
+    s3_access_key = response.json()["data"]
+    assert "secretAccessKey" in s3_access_key
+
+    # secrets are only revealed on creation
+    listed = requests.get(f'{url}/api/v3/org/users/{user_id}/s3-access-keys', headers=headers).json()["data"]
+    assert [key["id"] for key in listed] == [s3_access_key["id"]]
+    assert "secretAccessKey" not in listed[0]
+
+    delete_url = f'{url}/api/v3/org/users/{user_id}/s3-access-keys/{s3_access_key["id"]}'
+    assert requests.delete(delete_url, headers=headers).status_code == 204
+    assert requests.delete(delete_url, headers=headers).status_code == 404
+    assert emulator.request_counts["storagegrid.delete_s3_access_key"] == 2
+
+
+def test_storagegrid_emulator_pagination(storagegrid_emulator):
+    url = storagegrid_emulator.url
+    emulator = storagegrid_emulator.app.emulator
+    urns = sorted(emulator.add_user(f'user-{i}')["userURN"] for i in range(5))
+
+    headers = authorize(url)
+    page = requests.get(f'{url}/api/v3/org/users', headers=headers, params={"limit": 2}).json()["data"]
+    assert [user["userURN"] for user in page] == urns[:2]
+    page = requests.get(f'{url}/api/v3/org/users', headers=headers,
+                        params={"limit": 2, "marker": urns[1]}).json()["data"]
+    assert [user["userURN"] for user in page] == urns[2:4]
+    assert requests.get(f'{url}/api/v3/org/users', headers=headers,
+                        params={"marker": 'unknown'}).status_code == 400
+
+
+def test_storagegrid_emulator_conditions(storagegrid_emulator):
+    url = storagegrid_emulator.url
+    emulator = storagegrid_emulator.app.emulator
+    headers = authorize(url)
+
+    emulator.fail_next(2, status=429)
+    assert requests.get(f'{url}/api/v3/org/users', headers=headers).status_code == 429
+    assert requests.get(f'{url}/api/v3/org/users', headers=headers).status_code == 429
+    assert requests.get(f'{url}/api/v3/org/users', headers=headers).status_code == 200
+
+    emulator.expire_tokens()
+    assert requests.get(f'{url}/api/v3/org/users', headers=headers).status_code == 401
+
+    emulator.latency = 0.1
+    start = time.perf_counter()
+    requests.get(f'{url}/api/v3/versions')
+    assert time.perf_counter() - start >= 0.1
+
+
+def test_storagegrid_emulator_error_rate():
+    with EmulatorServer(create_app(error_rate=1.0, error_status=500, seed=0)) as server:
+        assert requests.get(f'{server.url}/api/v3/versions').status_code == 500
@@ -0,0 +1,60 @@
+"""Test recording StorageGRID user ids against the emulated StorageGRID."""
+from dtool_config_generator import db
+from dtool_config_generator.cli import sg_cli
+from dtool_config_generator.models import User
+from dtool_config_generator.utils import create_new_s3_access_key, sync_user
+
+
+def test_sync_user_records_id(storagegrid_app, storagegrid_emulator):
+    emulator = storagegrid_emulator.app.emulator
+    with storagegrid_app.app_context():
+        user = User(username='test-user', name='Test User')
+        db.session.add(user)
+        db.session.commit()
+
+        sg_user_id = sync_user(user)
+        assert sg_user_id in emulator.users
+        assert user.sg_user_id == sg_user_id
+
+        # recorded id is used as is, without querying the server
+        assert sync_user(user) == sg_user_id
+        assert emulator.request_counts["storagegrid.get_user_by_short_name"] == 1
+        assert emulator.request_counts["storagegrid.create_user"] == 1
+
+
+def test_stale_sg_user_id_resynced(storagegrid_app, storagegrid_emulator):
+    emulator = storagegrid_emulator.app.emulator
+    with storagegrid_app.app_context():
+        user = User(username='test-user', name='Test User')
+        db.session.add(user)
+        db.session.commit()
+
+        sync_user(user)
+        stale_sg_user_id = user.sg_user_id
+        del emulator.users[stale_sg_user_id]
+
+        access_key, secret_key = create_new_s3_access_key(user)
+        assert access_key is not None and secret_key is not None
+        assert user.sg_user_id != stale_sg_user_id
+        assert len(emulator.s3_access_keys[user.sg_user_id]) == 1
+
+
+def test_cli_sg_backfill(storagegrid_app, storagegrid_emulator):
+    emulator = storagegrid_emulator.app.emulator
+    sg_users = [emulator.add_user(f'user-{i}') for i in range(5)]
+    emulator.add_user('other')
+    with storagegrid_app.app_context():
+        db.session.add_all([User(username=f'user-{i}') for i in range(5)])
+        db.session.add(User(username='not-on-storagegrid'))
+        db.session.commit()
+
+    result = storagegrid_app.test_cli_runner().invoke(sg_cli, args=['backfill', '--page-size', '2'])
+    assert result.exit_code == 0, result.output
+    assert "for 5 users" in result.output
+
+    with storagegrid_app.app_context():
+        for i, sg_user in enumerate(sg_users):
+            user = User.query.filter_by(username=f'user-{i}').one()
+            assert (user.sg_user_id, user.sg_user_urn) == (sg_user["id"], sg_user["userURN"])
+        assert User.query.filter_by(username='not-on-storagegrid').one().sg_user_id is None
+    assert emulator.request_counts["storagegrid.get_user_by_short_name"] == 0
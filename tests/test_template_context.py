@@ -0,0 +1,176 @@
+"""Test building the template context from concurrent providers."""
+import threading
+import time
+
+import pytest
+
+from dtool_config_generator import db
+from dtool_config_generator.metrics import registry
+from dtool_config_generator.models import User
+from dtool_config_generator.utils import (
+    NO_TIMEOUT,
+    TemplateContextBuilder,
+    s3_access_credentials_as_context,
+    sg_user_id_as_context)
+
+
+def test_template_context_builder(storagegrid_app):
+    calls = []
+    lock = threading.Lock()
+
+    def shared(user):
+        with lock:
+            calls.append('shared')
+        time.sleep(0.1)
+        return 'shared value'
+
+    def slow_provider(user, shared):
+        time.sleep(0.2)
+        return f'{user.username}: {shared}'
+
+    def other_slow_provider(user, shared):
+        time.sleep(0.2)
+        return shared.upper()
+
+    builder = TemplateContextBuilder()
+    builder.register(shared, expose=False)
+    builder.register(slow_provider, requires=["shared"])
+    builder.register(other_slow_provider, requires=["shared"])
+    with pytest.raises(ValueError):
+        builder.register(slow_provider)
+    with pytest.raises(ValueError):
+        builder.register(slow_provider, name="unknown_requirement", requires=["unknown"])
+
+    with storagegrid_app.app_context():
+        start = time.perf_counter()
+        context = builder.run(User(username='test-user'))
+        elapsed = time.perf_counter() - start
+
+    assert context == {
+        "slow_provider": 'test-user: shared value',
+        "other_slow_provider": 'SHARED VALUE'}
+    assert calls == ['shared']
+    assert elapsed < 0.45
+
+
+def test_template_context_builder_failures(storagegrid_app):
+    def failing(user):
+        raise RuntimeError("failed")
+
+    def hanging(user):
+        time.sleep(1)
+        return 'too late'
+
+    def dependent(user, failing):
+        return 'never called'
+
+    builder = TemplateContextBuilder()
+    builder.register(failing)
+    builder.register(hanging, timeout=0.1)
+    builder.register(dependent, requires=["failing"])
+    builder.register(lambda user: 'fine', name="fine")
+
+    with storagegrid_app.app_context():
+        start = time.perf_counter()
+        context = builder.run(User(username='test-user'))
+        assert time.perf_counter() - start < 0.5
+
+    assert context == {"failing": None, "hanging": None, "dependent": None, "fine": 'fine'}
+
+
+def test_template_context_builder_no_timeout(storagegrid_app):
+    def slow_side_effect(user):
+        time.sleep(0.3)
+        return 'issued'
+
+    def slow(user):
+        time.sleep(0.3)
+        return 'too late'
+
+    builder = TemplateContextBuilder()
+    builder.register(slow_side_effect, timeout=NO_TIMEOUT)
+    builder.register(slow)
+
+    storagegrid_app.config["TEMPLATE_CONTEXT_PROVIDER_TIMEOUT"] = 0.1
+    with storagegrid_app.app_context():
+        db.session.add(User(username='test-user'))
+        db.session.commit()
+        # expired by commit
+        user = User.query.filter_by(username='test-user').first()
+        db.session.commit()
+        context = builder.run(user)
+
+    assert context == {"slow_side_effect": 'issued', "slow": None}
+
+
+def test_template_context_builder_not_threaded(storagegrid_app_factory, storagegrid_emulator):
+    emulator = storagegrid_emulator.app.emulator
+    # providers recording synced ids must work with a single in-memory connection
+    app = storagegrid_app_factory(
+        SQLALCHEMY_DATABASE_URI='sqlite://', STORAGEGRID_S3_CREDENTIALS_EMBEDDED_IN_CONFIG=True)
+    builder = app.template_context_builder
+    builder.register(lambda user: threading.get_ident(), name="worker_thread")
+    builder.register(lambda user, sg_user_id: threading.get_ident(), name="calling_thread",
+                     requires=["sg_user_id"], threaded=False)
+
+    with app.app_context():
+        db.session.add(User(username='test-user', confirmed=True))
+        db.session.commit()
+        user = User.query.filter_by(username='test-user').first()
+        context = builder.run(user)
+        assert user.sg_user_id in emulator.users
+
+    assert context["s3_credentials"]["access_key"] is not None
+    assert context["calling_thread"] == threading.get_ident()
+    assert context["worker_thread"] != threading.get_ident()
+
+
+def test_template_context_builder_selected_names(storagegrid_app):
+    calls = []
+
+    def record(name):
+        def provider(user, **kwargs):
+            calls.append(name)
+            return name
+        return provider
+
+    builder = TemplateContextBuilder()
+    builder.register(record('shared'), name="shared", expose=False)
+    builder.register(record('credentials'), name="credentials", requires=["shared"])
+    builder.register(record('other'), name="other")
+
+    registry.reset()
+    with storagegrid_app.app_context():
+        assert builder.run(User(username='test-user'), names={"user", "other"}) == {"other": 'other'}
+        assert calls == ['other']
+        assert registry.as_dict()["counters"] == {
+            "context.provider.credentials.skipped": 1,
+            "context.provider.shared.skipped": 1}
+
+        calls.clear()
+        assert builder.run(User(username='test-user'), names={"credentials", "shared"}) == {
+            "credentials": 'credentials'}
+        assert calls == ['shared', 'credentials']
+
+
+def test_s3_access_credentials_provider(storagegrid_app, storagegrid_emulator):
+    emulator = storagegrid_emulator.app.emulator
+    sg_user = emulator.add_user('test-user')
+    emulator.add_s3_access_key(sg_user["id"])
+
+    builder = TemplateContextBuilder()
+    builder.register(sg_user_id_as_context, name="sg_user_id", expose=False)
+    builder.register(s3_access_credentials_as_context, name="s3_credentials", requires=["sg_user_id"])
+
+    with storagegrid_app.app_context():
+        db.session.add(User(username='test-user', confirmed=True))
+        db.session.commit()
+        user = User.query.filter_by(username='test-user').first()
+        context = builder.run(user)
+        assert User.query.filter_by(username='test-user').first().sg_user_id == sg_user["id"]
+
+    assert context["s3_credentials"]["access_key"] is not None
+    assert [s3_access_key["accessKey"] for s3_access_key in emulator.s3_access_keys[sg_user["id"]].values()] == [
+        context["s3_credentials"]["access_key"]]
+    # user looked up only once
+    assert emulator.request_counts["storagegrid.get_user_by_short_name"] == 1
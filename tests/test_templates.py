@@ -0,0 +1,214 @@
+"""Test caching of custom template environments and pre-rendered templates."""
+import datetime
+import os
+
+import pytest
+
+from dtool_config_generator import create_app, db
+from dtool_config_generator.metrics import registry
+from dtool_config_generator.models import User
+from dtool_config_generator.rendering import (
+    LRUCache, render_config, template_environment, template_hash, template_variables)
+
+
+@pytest.fixture
+def template_app(test_config, tmp_path):
+    template_dir = tmp_path / "templates"
+    template_dir.mkdir()
+    (template_dir / "dtool.json").write_text('{"user": "{{ username }}"}')
+    config = dict(test_config)
+    config["DTOOL_CONFIG_TEMPLATE"] = str(template_dir / "dtool.json")
+    config["DTOOL_TEMPLATE_BYTECODE_CACHE_DIR"] = str(tmp_path)
+    return create_app(config)
+
+
+def test_template_environment_reused(template_app):
+    template_path = template_app.config["DTOOL_CONFIG_TEMPLATE"]
+    template_dir = os.path.dirname(template_path)
+    with template_app.app_context():
+        env = template_environment(template_dir)
+        template = env.get_template("dtool.json")
+        assert template_environment(template_dir) is env
+        # compiled only once
+        assert env.get_template("dtool.json") is template
+        assert template.render(username="testuser") == '{"user": "testuser"}'
+
+        with open(template_path, 'w') as f:
+            f.write('{"username": "{{ username }}"}')
+        stat = os.stat(template_path)
+        os.utime(template_path, (stat.st_atime, stat.st_mtime + 1))
+        assert env.get_template("dtool.json").render(username="testuser") == '{"username": "testuser"}'
+
+    # compiled templates shared via bytecode cache
+    assert any(name.startswith('__jinja2_') for name in os.listdir(os.path.dirname(template_dir)))
+
+
+def test_template_environment_without_auto_reload(template_app):
+    template_app.config["DTOOL_TEMPLATE_AUTO_RELOAD"] = False
+    template_path = template_app.config["DTOOL_CONFIG_TEMPLATE"]
+    template_dir = os.path.dirname(template_path)
+    with template_app.app_context():
+        env = template_environment(template_dir)
+        template = env.get_template("dtool.json")
+        stat = os.stat(template_path)
+        os.utime(template_path, (stat.st_atime, stat.st_mtime + 1))
+        assert env.get_template("dtool.json") is template
+
+
+def test_template_environment_without_bytecode_cache(template_app):
+    template_app.config["DTOOL_TEMPLATE_BYTECODE_CACHE_DIR"] = None
+    template_dir = os.path.dirname(template_app.config["DTOOL_CONFIG_TEMPLATE"])
+    with template_app.app_context():
+        assert template_environment(template_dir).bytecode_cache is None
+
+
+def test_template_variables(template_app):
+    template_dir = os.path.dirname(template_app.config["DTOOL_CONFIG_TEMPLATE"])
+    with open(os.path.join(template_dir, "credentials.json"), 'w') as f:
+        f.write('"key": "{{ s3_credentials.access_key }}"')
+    with open(os.path.join(template_dir, "with_include.json"), 'w') as f:
+        f.write('{"user": "{{ user.username }}", {% include "credentials.json" %}}')
+    with open(os.path.join(template_dir, "dynamic_include.json"), 'w') as f:
+        f.write('{% include included %}')
+
+    with template_app.app_context():
+        env = template_environment(template_dir)
+        template = env.get_template("dtool.json")
+        assert template_variables(template) == {"username"}
+        assert template_variables(env.get_template("with_include.json")) == {"user", "s3_credentials"}
+        assert template_variables(env.get_template("dynamic_include.json")) is None
+
+        # hash covers included templates
+        version = template_hash(env.get_template("with_include.json"))
+        assert template_hash(env.get_template("with_include.json")) == version
+        with open(os.path.join(template_dir, "credentials.json"), 'w') as f:
+            f.write('"secret": "{{ s3_credentials.secret_key }}"')
+        path = os.path.join(template_dir, "credentials.json")
+        stat = os.stat(path)
+        os.utime(path, (stat.st_atime, stat.st_mtime + 1))
+        assert template_hash(env.get_template("with_include.json")) != version
+        assert template_hash(env.get_template("dynamic_include.json")) is None
+
+
+def test_lru_cache():
+    cache = LRUCache(maxsize=5, getsize=len)
+    cache.set("a", "aa")
+    cache.set("b", "bb")
+    assert cache.get("a") == "aa"
+    cache.set("c", "cc")
+    # least recently used entry evicted
+    assert cache.get("b") is None
+    assert cache.get("a") == "aa"
+    cache.set("d", "dddddd")
+    assert cache.get("d") is None
+    assert (len(cache), cache.size, cache.hits, cache.misses) == (2, 4, 2, 2)
+
+
+def test_render_config_prerendered(template_app):
+    template_dir = os.path.dirname(template_app.config["DTOOL_CONFIG_TEMPLATE"])
+    with open(os.path.join(template_dir, "dtool.json"), 'w') as f:
+        f.write('{"user": "{{ user.username }}", "key": "{{ s3_credentials.access_key }}", '
+                '"secret": "{{ s3_credentials[\'secret_key\'] }}", "id": "{{ sg_user_id }}"}')
+    with open(os.path.join(template_dir, "filtered.json"), 'w') as f:
+        f.write('{"key": {{ s3_credentials.access_key | tojson }}, '
+                '"id": "{% if sg_user_id %}{{ sg_user_id }}{% endif %}"}')
+
+    with template_app.app_context():
+        db.create_all()
+        db.session.add(User(username='test-user'))
+        db.session.commit()
+        user = User.query.filter_by(username='test-user').first()
+        env = template_environment(template_dir)
+        template = env.get_template("dtool.json")
+
+        registry.reset()
+        for i in range(2):
+            secrets = {"s3_credentials": {"access_key": f"key-{i}", "secret_key": f"secret-{i}"},
+                       "sg_user_id": None}
+            assert render_config(template, user, secrets) == template.render(user=user, **secrets)
+        assert registry.as_dict()["counters"] == {
+            'render.prerender.hits': 1, 'render.prerender.misses': 1}
+
+        # syncs keep pre-rendered template
+        user.sg_user_id = 'uuid'
+        user.dls_synced_at = datetime.datetime(2024, 1, 1)
+        db.session.commit()
+        assert render_config(template, user, secrets) == template.render(user=user, **secrets)
+        assert registry.as_dict()["counters"]['render.prerender.misses'] == 1
+
+        # profile changes invalidate pre-rendered template
+        user.username = 'renamed-user'
+        db.session.commit()
+        assert '"user": "renamed-user"' in render_config(template, user, secrets)
+        assert registry.as_dict()["counters"]['render.prerender.misses'] == 2
+
+        # templates that process secrets are rendered fully
+        template = env.get_template("filtered.json")
+        for sg_user_id in ["uuid", None]:
+            secrets["sg_user_id"] = sg_user_id
+            assert render_config(template, user, secrets) == template.render(user=user, **secrets)
+
+
+def test_readme_conditional_get(template_app):
+    template_dir = os.path.dirname(template_app.config["DTOOL_CONFIG_TEMPLATE"])
+    template_path = os.path.join(template_dir, "dtool_readme.yml")
+    with open(template_path, 'w') as f:
+        f.write('owner: {{ user.name }}')
+    template_app.config["DTOOL_README_TEMPLATE"] = template_path
+    with template_app.app_context():
+        db.create_all()
+        db.session.add(User(username='test-user', name='Test User', confirmed=True))
+        db.session.commit()
+        user_id = User.query.filter_by(username='test-user').first().id
+
+    client = template_app.test_client()
+    with client.session_transaction() as session:
+        session["_user_id"] = str(user_id)
+
+    registry.reset()
+    response = client.get('/generate/readme')
+    assert response.status_code == 200
+    assert response.get_data(as_text=True) == 'owner: Test User'
+    etag, _ = response.get_etag()
+    assert etag is not None
+
+    response = client.get('/generate/readme', headers={"If-None-Match": f'"{etag}"'})
+    assert response.status_code == 304
+    assert response.get_etag()[0] == etag
+    assert response.data == b''
+    # other client without rendered readme served from cache
+    assert client.get('/generate/readme').get_data(as_text=True) == 'owner: Test User'
+    assert registry.as_dict()["counters"] == {
+        'render.readme.hits': 1, 'render.readme.misses': 1, 'render.readme.not_modified': 1}
+
+    # i.e. compressing proxies weaken the etag
+    response = client.get('/generate/readme', headers={"If-None-Match": f'W/"{etag}"'})
+    assert response.status_code == 304
+
+    # sync of fields not rendered
+    with template_app.app_context():
+        user = db.session.get(User, user_id)
+        user.sg_user_id = 'uuid'
+        db.session.commit()
+    response = client.get('/generate/readme', headers={"If-None-Match": f'"{etag}"'})
+    assert response.status_code == 304
+
+    # profile change
+    with template_app.app_context():
+        user = db.session.get(User, user_id)
+        user.name = 'Renamed User'
+        db.session.commit()
+    response = client.get('/generate/readme', headers={"If-None-Match": f'"{etag}"'})
+    assert response.status_code == 200
+    assert response.get_data(as_text=True) == 'owner: Renamed User'
+    assert response.get_etag()[0] != etag
+    etag, _ = response.get_etag()
+
+    # template change
+    with open(template_path, 'w') as f:
+        f.write('owners:\n  - {{ user.name }}')
+    stat = os.stat(template_path)
+    os.utime(template_path, (stat.st_atime, stat.st_mtime + 1))
+    response = client.get('/generate/readme', headers={"If-None-Match": f'"{etag}"'})
+    assert response.status_code == 200
+    assert response.get_data(as_text=True) == 'owners:\n  - Renamed User'
@@ -0,0 +1,79 @@
+"""Test reuse of issued s3 access credentials against the emulated StorageGRID."""
+import datetime
+
+import pytest
+
+from dtool_config_generator import db
+from dtool_config_generator.models import StoredS3AccessCredentials, User
+from dtool_config_generator.utils import revoke_all_s3_access_keys, s3_access_credentials_as_context
+from dtool_config_generator.vault import load_credentials, store_credentials
+
+
+@pytest.fixture
+def vault_app(storagegrid_app_factory, tmp_path):
+    (tmp_path / "dtool.json").write_text('{"KEY": "{{ s3_credentials.access_key }}"}')
+    app = storagegrid_app_factory(
+        STORAGEGRID_S3_CREDENTIALS_EMBEDDED_IN_CONFIG=True,
+        STORAGEGRID_S3_CREDENTIALS_REUSE=True,
+        DTOOL_CONFIG_TEMPLATE=str(tmp_path / "dtool.json"))
+    with app.app_context():
+        db.session.add(User(username='test-user', confirmed=True))
+        db.session.commit()
+    return app
+
+
+def test_s3_access_credentials_reused(vault_app, storagegrid_emulator):
+    emulator = storagegrid_emulator.app.emulator
+    with vault_app.app_context():
+        user = User.query.filter_by(username='test-user').first()
+        credentials = s3_access_credentials_as_context(user)
+        assert credentials["access_key"] is not None
+        assert s3_access_credentials_as_context(user) == credentials
+        assert emulator.request_counts["storagegrid.create_s3_access_key"] == 1
+
+        # encrypted at rest
+        stored = StoredS3AccessCredentials.query.filter_by(user_id=user.id).one()
+        assert credentials["secret_access_key"].encode() not in stored.encrypted_credentials
+
+        # stale outside reuse window and shortly before expiry
+        now = datetime.datetime.now()
+        assert load_credentials(user, now=now) is not None
+        assert load_credentials(user, now=now + datetime.timedelta(hours=2)) is None
+        stored.expires_at = now + datetime.timedelta(minutes=30)
+        db.session.commit()
+        assert load_credentials(user, now=now) is None
+
+        # older credentials do not replace newer ones
+        assert not store_credentials(user, 'old', 'old', now - datetime.timedelta(minutes=1))
+
+        # not decryptable with another secret key
+        stored.expires_at = None
+        db.session.commit()
+        assert load_credentials(user) is not None
+        vault_app.config["SECRET_KEY"] = 'other secret'
+        assert load_credentials(user) is None
+
+        # revoking keys discards stored credentials
+        vault_app.config["SECRET_KEY"] = 'secret'
+        revoke_all_s3_access_keys(user)
+        assert StoredS3AccessCredentials.query.count() == 0
+
+
+def test_generate_config_rotate(vault_app, storagegrid_emulator):
+    emulator = storagegrid_emulator.app.emulator
+    with vault_app.app_context():
+        user_id = User.query.filter_by(username='test-user').first().id
+
+    client = vault_app.test_client()
+    with client.session_transaction() as session:
+        session["_user_id"] = str(user_id)
+
+    assert b'name="rotate"' in client.get('/generate/config').data
+    first = client.post('/generate/config', data={}).get_json()
+    assert client.post('/generate/config', data={}).get_json() == first
+    assert emulator.request_counts["storagegrid.create_s3_access_key"] == 1
+
+    rotated = client.post('/generate/config', data={"rotate": "y"}).get_json()
+    assert rotated["KEY"] != first["KEY"]
+    assert emulator.request_counts["storagegrid.create_s3_access_key"] == 2
+    assert client.post('/generate/config', data={}).get_json() == rotated